@@ -5,9 +5,9 @@ import teuthology.report
 doc = """
 usage:
     teuthology-report -h
-    teuthology-report [-v] [-R] [-n] [-s SERVER] [-a ARCHIVE] [-D] -r RUN ...
-    teuthology-report [-v] [-s SERVER] [-a ARCHIVE] [-D] -r RUN -j JOB ...
-    teuthology-report [-v] [-R] [-n] [-s SERVER] [-a ARCHIVE] --all-runs
+    teuthology-report [-v] [-R] [-n] [-c N] [-s SERVER] [-a ARCHIVE] [-D] -r RUN ...
+    teuthology-report [-v] [-c N] [-s SERVER] [-a ARCHIVE] [-D] -r RUN -j JOB ...
+    teuthology-report [-v] [-R] [-n] [-c N] [-s SERVER] [-a ARCHIVE] --all-runs
 
 Submit test results to a web service
 
@@ -33,6 +33,11 @@ optional arguments:
                         behavior.
   -D, --dead            Mark all given jobs (or entire runs) with status
                         'dead'. Implies --refresh.
+  -c N, --concurrency N
+                        Upload up to N jobs at once, retrying each one with
+                        backoff if it fails. Useful when backfilling a
+                        large archive.
+                        [default: 1]
   -v, --verbose         be more verbose
 """.format(archive_base=teuthology.config.config.archive_base)
 
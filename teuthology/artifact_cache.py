@@ -0,0 +1,330 @@
+"""
+A caching HTTP stand-in for gitbuilder, run on the teuthology controller so
+that each package, repo index or kernel image a job needs is downloaded from
+upstream once and then served to every node in the job from the controller.
+
+It is off unless ~/.teuthology.yaml has an artifact_cache section::
+
+    artifact_cache:
+      # address the test nodes can reach this machine at
+      address: 10.214.0.10
+      # where to keep downloaded files; shared by all jobs on this machine
+      path: /var/cache/teuthology/artifacts
+      # GB to keep; the least recently used files are removed first
+      max_size: 50
+      # seconds to reuse files whose url is not pinned to a sha1 (branch
+      # refs, version files, ...)
+      mutable_ttl: 60
+      # hosts to cache files from besides gitbuilder_host (and
+      # gitbuilder.ceph.com, which kernels come from)
+      extra_hosts: []
+
+Nodes fetch ``http://<address>:<port>/<upstream host>/<path>``, which is
+served from the store, or fetched from ``http://<upstream host>/<path>``
+first on a miss. Requests for any other host are refused, so that the
+cache cannot be used as an open proxy. Use `cached_url` to rewrite upstream
+urls.
+"""
+import contextlib
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import time
+import urllib2
+import urlparse
+
+import gevent.event
+
+from .config import config as teuth_config
+
+log = logging.getLogger(__name__)
+
+
+class ArtifactStore(object):
+    """
+    On-disk LRU store of upstream files, keyed by '<host>/<path>'.
+
+    Files whose url contains a sha1 directory never change upstream and are
+    kept until evicted; anything else is refetched once it is older than
+    mutable_ttl seconds. Concurrent requests for the same missing file share
+    one upstream fetch.
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, root, max_bytes, mutable_ttl=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mutable_ttl = mutable_ttl
+        self.pending = {}
+        self.stats = dict(hits=0, misses=0, bytes_fetched=0)
+
+    @staticmethod
+    def is_immutable(key):
+        """
+        True if the file at key can never change upstream.
+        """
+        return '/sha1/' in key
+
+    def path_for(self, key):
+        """
+        :returns: where key is stored
+        """
+        parts = key.split('/')
+        if not key or '..' in parts or '' in parts[:-1]:
+            raise ValueError('bad artifact key: %r' % key)
+        if parts[-1] == '':
+            # directory index
+            parts[-1] = '.index'
+        return os.path.join(self.root, *parts)
+
+    def lookup(self, key):
+        """
+        :returns: the stored file for key if it is usable, else None
+        """
+        path = self.path_for(key)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not self.is_immutable(key) and \
+                time.time() - st.st_mtime > self.mutable_ttl:
+            return None
+        # atime tracks use, for eviction; mtime is when we fetched it
+        os.utime(path, (time.time(), st.st_mtime))
+        return path
+
+    def get(self, key):
+        """
+        :returns: the path of a stored copy of key, fetching it first if
+                  necessary
+        :raises: urllib2.HTTPError if upstream does not have it
+        """
+        path = self.lookup(key)
+        if path is not None:
+            self.stats['hits'] += 1
+            return path
+        pending = self.pending.get(key)
+        if pending is not None:
+            return pending.get()
+        pending = self.pending[key] = gevent.event.AsyncResult()
+        try:
+            path = self.fetch(key)
+            pending.set(path)
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            del self.pending[key]
+        self.evict(keep=path)
+        return path
+
+    def fetch(self, key):
+        """
+        Download key from upstream into the store.
+        """
+        self.stats['misses'] += 1
+        url = 'http://' + key
+        path = self.path_for(key)
+        log.info('Fetching %s', url)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        src = urllib2.urlopen(url)
+        try:
+            # write next to the destination and rename, so other jobs
+            # sharing the store never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       prefix='.fetch.')
+            try:
+                with os.fdopen(fd, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, self.chunk_size)
+                    self.stats['bytes_fetched'] += dst.tell()
+                os.rename(tmp, path)
+            except Exception:
+                os.unlink(tmp)
+                raise
+        finally:
+            src.close()
+        return path
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used files until the store fits in
+        max_bytes.
+
+        :param keep: path of a file not to remove, e.g. one just fetched to
+                     be served, even if it alone is bigger than max_bytes
+        """
+        files = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.startswith('.fetch.'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                total += st.st_size
+                if path != keep:
+                    files.append((st.st_atime, st.st_size, path))
+        files.sort()
+        while total > self.max_bytes and files:
+            _, size, path = files.pop(0)
+            log.debug('Evicting %s', path)
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+
+
+class ArtifactCache(object):
+    """
+    Serve an `ArtifactStore` over HTTP.
+    """
+    def __init__(self, store, address, hosts, port=0):
+        """
+        :param store: the ArtifactStore to serve
+        :param address: address advertised to test nodes
+        :param hosts: the upstream hosts files may be fetched from
+        :param port: port to listen on; by default, any free one
+        """
+        self.store = store
+        self.address = address
+        self.hosts = frozenset(hosts)
+        self.port = port
+        self.server = None
+        self.bytes_served = 0
+
+    @property
+    def url(self):
+        return 'http://{address}:{port}'.format(address=self.address,
+                                                port=self.port)
+
+    def start(self):
+        """
+        Start listening.
+        """
+        from gevent import pywsgi
+        self.server = pywsgi.WSGIServer(('0.0.0.0', self.port), self.app,
+                                        log=None)
+        self.server.start()
+        self.port = self.server.server_port
+        log.info('Serving artifact cache at %s from %s', self.url,
+                 self.store.root)
+        return self
+
+    def stop(self):
+        """
+        Stop listening.
+        """
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+    def get_stats(self):
+        """
+        :returns: dict of hits, misses, bytes_fetched and bytes_served
+        """
+        return dict(self.store.stats, bytes_served=self.bytes_served)
+
+    def app(self, environ, start_response):
+        """
+        WSGI application serving GET/HEAD of '/<host>/<path>'.
+        """
+        method = environ['REQUEST_METHOD']
+        if method not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [])
+            return []
+        key = environ['PATH_INFO'].lstrip('/')
+        if environ.get('QUERY_STRING'):
+            # not cacheable; we have no use for these anyway
+            start_response('400 Bad Request', [])
+            return []
+        if key.split('/')[0] not in self.hosts:
+            start_response('403 Forbidden', [])
+            return []
+        try:
+            path = self.store.get(key)
+        except ValueError:
+            start_response('400 Bad Request', [])
+            return []
+        except urllib2.HTTPError as e:
+            start_response('{code} {msg}'.format(code=e.code, msg=e.msg), [])
+            return []
+        except (urllib2.URLError, IOError) as e:
+            log.warn('Failed to fetch %s: %s', key, e)
+            start_response('502 Bad Gateway', [])
+            return []
+        size = os.path.getsize(path)
+        start_response('200 OK', [
+            ('Content-Type', 'application/octet-stream'),
+            ('Content-Length', str(size)),
+            ])
+        if method == 'HEAD':
+            return []
+        self.bytes_served += size
+        return self._read(path)
+
+    def _read(self, path):
+        with file(path, 'rb') as f:
+            while True:
+                data = f.read(self.store.chunk_size)
+                if not data:
+                    break
+                yield data
+
+
+def cached_url(ctx, url):
+    """
+    :returns: url, rewritten to go through the job's artifact cache if
+              there is one and url can be cached
+    """
+    cache = getattr(ctx, 'artifact_cache', None)
+    if cache is None:
+        return url
+    parts = urlparse.urlsplit(url)
+    if parts.scheme != 'http' or parts.query or \
+            parts.netloc not in cache.hosts:
+        return url
+    return '{cache}/{host}{path}'.format(cache=cache.url, host=parts.netloc,
+                                         path=parts.path)
+
+
+@contextlib.contextmanager
+def serve(ctx):
+    """
+    Run an artifact cache for the job while the block runs, if one is
+    configured and the job does not already have one. The cache is ctx.
+    artifact_cache while it runs; its hit/miss counters go in the job
+    summary when it stops.
+    """
+    conf = teuth_config.artifact_cache
+    if not conf or getattr(ctx, 'artifact_cache', None) is not None:
+        yield
+        return
+    store = ArtifactStore(
+        root=os.path.expanduser(conf.get('path',
+                                         '~/.cache/teuthology/artifacts')),
+        max_bytes=int(float(conf.get('max_size', 50)) * 1024 ** 3),
+        mutable_ttl=conf.get('mutable_ttl', 60),
+        )
+    hosts = set(['gitbuilder.ceph.com'] + conf.get('extra_hosts', []))
+    if teuth_config.gitbuilder_host:
+        hosts.add(teuth_config.gitbuilder_host)
+    cache = ArtifactCache(store, address=conf['address'], hosts=hosts).start()
+    ctx.artifact_cache = cache
+    try:
+        yield
+    finally:
+        cache.stop()
+        ctx.artifact_cache = None
+        stats = cache.get_stats()
+        log.info('Artifact cache: %s', stats)
+        ctx.summary['artifact_cache'] = stats
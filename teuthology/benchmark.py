@@ -0,0 +1,211 @@
+"""
+Collect the results of benchmark tasks.
+
+Benchmark tasks run their tool with an `OutputCapture` as stdout, parse what
+it printed with one of the parse_* functions here, and `record` the result.
+Each recorded result is kept, with any per-second time series, in
+benchmarks.json in the job's archive; its headline numbers also go in the
+job summary under 'benchmarks', so that results can be compared across
+sha1s without digging through logs.
+"""
+import json
+import logging
+import math
+import os
+import re
+
+log = logging.getLogger(__name__)
+
+
+class OutputCapture(object):
+    """
+    Stands in for a Logger as the stdout of `Remote.run`: every line is
+    still logged, and also kept in lines for parsing afterwards.
+    """
+    def __init__(self, logger):
+        self.logger = logger
+        self.lines = []
+
+    def log(self, level, line):
+        self.lines.append(line)
+        self.logger.log(level, line)
+
+
+def percentile(values, pct):
+    """
+    :returns: the pct-th percentile of values (nearest rank), or None if
+              there are none
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def _number(value):
+    """
+    :returns: value as an int or float, or None if it is not a number
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# "   sec Cur ops   started  finished  avg MB/s  cur MB/s  last lat   avg lat"
+_RADOS_BENCH_SECOND = re.compile(r'^\s*(\d+)' + r'\s+(\S+)' * 7 + r'\s*$')
+_RADOS_BENCH_COLUMNS = ('sec', 'cur_ops', 'started', 'finished', 'avg_mbps',
+                        'cur_mbps', 'last_lat', 'avg_lat')
+_RADOS_BENCH_TOTALS = {
+    'total time run': 'total_time',
+    'total writes made': 'ops',
+    'total reads made': 'ops',
+    'write size': 'op_size',
+    'read size': 'op_size',
+    'bandwidth (mb/sec)': 'bandwidth_mbps',
+    'stddev bandwidth': 'bandwidth_stddev',
+    'max bandwidth (mb/sec)': 'bandwidth_max',
+    'min bandwidth (mb/sec)': 'bandwidth_min',
+    'average iops': 'iops',
+    'average latency': 'latency_avg',
+    'stddev latency': 'latency_stddev',
+    'max latency': 'latency_max',
+    'min latency': 'latency_min',
+    }
+
+
+def parse_rados_bench(lines):
+    """
+    Parse the output of rados bench.
+
+    rados bench does not report latency percentiles. last_lat_p50 and
+    last_lat_p99 are taken over its per-second samples of the latest op's
+    latency instead, so they describe those few samples rather than the
+    latency of every op. Latencies are in seconds.
+
+    :param lines: the lines rados bench printed
+    :returns: dict of the totals printed at the end (bandwidth_mbps, iops,
+              latency_avg, ...), with the per-second progress lines as a
+              list of dicts under 'series'
+    """
+    result = dict(series=[])
+    for line in lines:
+        match = _RADOS_BENCH_SECOND.match(line)
+        if match:
+            result['series'].append(dict(
+                zip(_RADOS_BENCH_COLUMNS,
+                    [_number(value) for value in match.groups()])))
+            continue
+        label, sep, value = line.partition(':')
+        if not sep:
+            continue
+        label = label.strip().lower()
+        if label.endswith('(s)'):
+            label = label[:-len('(s)')].strip()
+        key = _RADOS_BENCH_TOTALS.get(label)
+        if key is not None:
+            result[key] = _number(value.strip())
+    if 'iops' not in result and result.get('total_time') and \
+            result.get('ops') is not None:
+        result['iops'] = result['ops'] / result['total_time']
+    samples = [s['last_lat'] for s in result['series']
+               if s['last_lat'] is not None and s['finished']]
+    result['last_lat_p50'] = percentile(samples, 50)
+    result['last_lat_p99'] = percentile(samples, 99)
+    return result
+
+
+_OMAPBENCH_TOTALS = {
+    'number of object maps written': 'objects',
+    'number of threads used': 'threads',
+    'entries per object map': 'entries',
+    'average latency': 'latency_avg_ms',
+    'minimum latency': 'latency_min_ms',
+    'maximum latency': 'latency_max_ms',
+    'total latency': 'latency_total_ms',
+    }
+# ">= 100ms        [*****"
+_OMAPBENCH_BUCKET = re.compile(r'^>=\s*([\d.]+)\s*ms\s*\[(\**)')
+
+
+def parse_omapbench(lines):
+    """
+    Parse the output of omapbench.
+
+    latency_p50_ms and latency_p99_ms are the lower bounds of the histogram
+    buckets holding those percentiles, weighted by the length of each
+    bucket's bar. objects_per_sec is estimated from the total latency of
+    all the writes and the number of threads writing.
+
+    :param lines: the lines omapbench printed
+    :returns: dict of objects, threads, entries and latency_*_ms, with the
+              histogram as a list of [lower bound (ms), bar length] pairs
+              under 'histogram'
+    """
+    result = dict(histogram=[])
+    for line in lines:
+        match = _OMAPBENCH_BUCKET.match(line.strip())
+        if match:
+            result['histogram'].append(
+                [_number(match.group(1)), len(match.group(2))])
+            continue
+        label, sep, value = line.partition(':')
+        if not sep:
+            continue
+        key = _OMAPBENCH_TOTALS.get(label.strip().lower())
+        if key is not None:
+            value = value.strip()
+            if value.endswith('ms'):
+                value = value[:-len('ms')]
+            result[key] = _number(value)
+    total = sum(count for _, count in result['histogram'])
+    for pct in (50, 99):
+        seen = 0
+        result['latency_p{pct}_ms'.format(pct=pct)] = None
+        for lower, count in result['histogram']:
+            seen += count
+            if total and seen >= pct / 100.0 * total:
+                result['latency_p{pct}_ms'.format(pct=pct)] = lower
+                break
+    if result.get('latency_total_ms') and result.get('objects'):
+        result['objects_per_sec'] = (result['objects'] *
+                                     result.get('threads', 1) * 1000.0 /
+                                     result['latency_total_ms'])
+    return result
+
+
+# metrics too bulky for the job summary; they are only in benchmarks.json
+_DETAIL = ('series', 'histogram')
+
+
+def record(ctx, benchmark, role, results, **params):
+    """
+    Save the results of a benchmark run in benchmarks.json in the archive
+    and in the job summary.
+
+    :param benchmark: name of the benchmark, e.g. 'radosbench'
+    :param role: the role it ran as, or None
+    :param results: dict of metrics, as returned by a parse_* function
+    :param params: anything else identifying the run, e.g. the pool
+    """
+    entry = dict(params, benchmark=benchmark, client=role)
+    entry.update(results)
+    benchmarks = getattr(ctx, 'benchmarks', None)
+    if benchmarks is None:
+        benchmarks = ctx.benchmarks = []
+    benchmarks.append(entry)
+    ctx.summary.setdefault('benchmarks', []).append(
+        dict((key, value) for key, value in entry.iteritems()
+             if key not in _DETAIL))
+    log.info('%s on %s: %s', benchmark, role,
+             ', '.join('{k}={v}'.format(k=k, v=v)
+                       for k, v in sorted(results.iteritems())
+                       if k not in _DETAIL))
+    if ctx.archive is not None:
+        with file(os.path.join(ctx.archive, 'benchmarks.json'), 'w') as f:
+            json.dump(benchmarks, f, indent=2, sort_keys=True)
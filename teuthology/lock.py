@@ -492,6 +492,12 @@ def create_if_vm(ctx, machine_name):
                     (machine_name))
             destroy_if_vm(ctx, machine_name)
             create_if_vm(ctx, machine_name)
+    # the guest was (re)imaged, so anything we knew about it is stale
+    cluster = getattr(ctx, 'cluster', None)
+    if cluster is not None:
+        for remote in cluster.remotes.iterkeys():
+            if remote.name == machine_name:
+                remote.invalidate_facts()
     return True
 #
 # Use downburst to destroy a virtual machine
@@ -36,9 +36,11 @@ def ls(archive_dir, verbose):
                     if not found:
                         print '(no process or summary.yaml)',
                     # tail
-                    tail = os.popen(
-                        'tail -1 %s/%s/teuthology.log' % (archive_dir, j)
-                    ).read().rstrip()
+                    try:
+                        tail = tail_line(
+                            os.path.join(job_dir, 'teuthology.log')).rstrip()
+                    except IOError:
+                        tail = ''
                     print tail,
                 except IOError as e:
                     continue
@@ -69,3 +71,24 @@ def get_jobs(archive_dir):
 
     jobs = [job for job in dir_contents if is_job_dir(archive_dir, job)]
     return sorted(jobs)
+
+
+def tail_line(path, blocksize=4096):
+    """
+    Return the last line of a file, like ``tail -1``, reading backwards from
+    its end so that only the last few blocks are ever read.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = ''
+        while pos > 0:
+            step = min(blocksize, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+            # ignore the newline terminating the last line
+            newline = data.rfind('\n', 0, len(data) - 1)
+            if newline >= 0:
+                return data[newline + 1:]
+        return data
@@ -18,7 +18,17 @@ import urlparse
 import yaml
 import json
 import re
-import tempfile
+import hashlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 from teuthology import safepath
 from .orchestra import run
@@ -639,42 +649,377 @@ def get_file(remote, path, sudo=False, dest_dir='/tmp'):
     return file_data
 
 
-def pull_directory(remote, remotedir, localdir):
+def get_files(remote, paths, sudo=False):
+    """
+    Get the contents of several small remote files in a single round trip.
+
+    :param remote: Remote site.
+    :param paths: Paths on the remote to read.
+    :param sudo: read the files as super user
+    :returns: a list of file contents, in the order of paths
+    """
+    prefix = ['sudo'] if sudo else []
+    results = remote.batch(
+        [prefix + ['cat', '--', path] for path in paths],
+        log_output=False,
+        )
+    return [result.stdout for result in results]
+
+
+class Throttle(object):
+    """
+    Limit the rate of a data transfer to a number of bytes per second.
+
+    A single Throttle may be shared by several concurrent transfers, in
+    which case they split the budget between them.
+    """
+    def __init__(self, rate, _sleeper=None):
+        self.rate = float(rate)
+        self.sleeper = _sleeper or time.sleep
+        self._next = 0.0
+
+    def consume(self, nbytes):
+        """
+        Account for nbytes having been transferred, sleeping as long as
+        needed to keep within the rate.
+        """
+        now = time.time()
+        self._next = max(self._next, now) + nbytes / self.rate
+        delay = self._next - now
+        if delay > 0:
+            self.sleeper(delay)
+
+
+class TransferMeter(object):
+    """
+    Wrap a file-like object being read from, counting the bytes that went
+    through it and periodically logging progress.
+
+    Reads are slowed down to honor any given `Throttle` objects.
+    """
+    def __init__(self, f, name, log_every=256 * 1024 * 1024, throttles=()):
+        self.f = f
+        self.name = name
+        self.log_every = log_every
+        self.throttles = [t for t in throttles if t is not None]
+        self.bytes = 0
+        self.start = time.time()
+        self._next_log = log_every
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bytes += len(data)
+        for throttle in self.throttles:
+            throttle.consume(len(data))
+        if self.bytes >= self._next_log:
+            self._next_log += self.log_every
+            log.debug('%s: %d MB transferred, %.1f MB/s', self.name,
+                      self.bytes >> 20, self.rate / (1 << 20))
+        return data
+
+    @property
+    def duration(self):
+        return time.time() - self.start
+
+    @property
+    def rate(self):
+        """
+        Bytes per second so far
+        """
+        duration = self.duration
+        if duration <= 0:
+            return 0.0
+        return self.bytes / duration
+
+
+def _open_tar_stream(fileobj, codec):
+    """
+    Open a tarfile reading a stream compressed with codec.
+    """
+    if codec == 'gzip':
+        return tarfile.open(mode='r|gz', fileobj=fileobj)
+    if codec == 'zstd':
+        fileobj = zstandard.ZstdDecompressor().stream_reader(fileobj)
+    elif codec == 'lz4':
+        fileobj = lz4.frame.LZ4FrameFile(fileobj, mode='rb')
+    return tarfile.open(mode='r|', fileobj=fileobj)
+
+
+def choose_tar_codec(remote, codec):
+    """
+    Pick the codec to transfer a tarball from remote with: codec if both we
+    and remote support it, else gzip.
+    """
+    if codec in ('gzip', 'none'):
+        return codec
+    decoders = dict(zstd=zstandard, lz4=lz4)
+    if codec not in decoders:
+        raise ValueError('Unknown archive codec: {codec}'.format(codec=codec))
+    if decoders[codec] is None:
+        log.info('No local %s support, using gzip instead', codec)
+        return 'gzip'
+    proc = remote.run(
+        args=['which', codec],
+        stdout=StringIO(),
+        check_status=False,
+        )
+    if proc.exitstatus != 0:
+        log.info('%s not found on %s, using gzip instead', codec,
+                 remote.shortname)
+        return 'gzip'
+    return codec
+
+
+def _dedupe_file(path, seen):
+    """
+    Replace path with a hard link to an identical file already in seen, a
+    dict mapping content hashes to paths; otherwise record path there.
+
+    :returns: True if path was replaced
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            sha1.update(chunk)
+    digest = sha1.hexdigest()
+    existing = seen.get(digest)
+    if existing is None:
+        seen[digest] = path
+        return False
+    os.remove(path)
+    os.link(existing, path)
+    return True
+
+
+def pull_directory(remote, remotedir, localdir, throttles=(), codec='gzip',
+                   exclude=(), dedupe=None):
     """
     Copy a remote directory to a local directory.
+
+    The directory is tarred on the remote host and unpacked here as it
+    arrives, without going through an intermediate file on either side.
+
+    :param throttles: `Throttle` objects limiting the transfer rate
+    :param codec:     compression to use for the transfer, see
+                      `choose_tar_codec`
+    :param exclude:   glob patterns of remote files to leave out
+    :param dedupe:    if given, a dict mapping content hashes to local
+                      files, shared between calls; files whose content was
+                      already pulled (e.g. from another host) become hard
+                      links to the earlier copy. This only saves disk space
+                      in the archive: duplicates are found after they have
+                      been transferred, so it does not shorten the transfer
+    :returns: a dict with the number of (compressed) bytes and files
+              transferred, the number of deduplicated files, and the
+              duration in seconds
     """
     log.debug('Transferring archived files from %s:%s to %s',
               remote.shortname, remotedir, localdir)
     if not os.path.exists(localdir):
         os.mkdir(localdir)
-    _, local_tarfile = tempfile.mkstemp(dir=localdir)
-    remote.get_tar(remotedir, local_tarfile, sudo=True)
-    with open(local_tarfile, 'r+') as fb1:
-        tar = tarfile.open(mode='r|gz', fileobj=fb1)
-        while True:
-            ti = tar.next()
-            if ti is None:
-                break
+    codec = choose_tar_codec(remote, codec)
+    proc = remote.get_tar_stream(remotedir, sudo=True, codec=codec,
+                                 exclude=exclude)
+    meter = TransferMeter(
+        proc.stdout, '{host}:{path}'.format(host=remote.shortname,
+                                            path=remotedir),
+        throttles=throttles)
+    files = 0
+    deduped = 0
+    tar = _open_tar_stream(meter, codec)
+    while True:
+        ti = tar.next()
+        if ti is None:
+            break
 
-            if ti.isdir():
-                # ignore silently; easier to just create leading dirs below
-                pass
-            elif ti.isfile():
-                sub = safepath.munge(ti.name)
-                safepath.makedirs(root=localdir, path=os.path.dirname(sub))
-                tar.makefile(ti, targetpath=os.path.join(localdir, sub))
+        if ti.isdir():
+            # ignore silently; easier to just create leading dirs below
+            pass
+        elif ti.isfile():
+            sub = safepath.munge(ti.name)
+            safepath.makedirs(root=localdir, path=os.path.dirname(sub))
+            targetpath = os.path.join(localdir, sub)
+            tar.makefile(ti, targetpath=targetpath)
+            files += 1
+            if dedupe is not None and _dedupe_file(targetpath, dedupe):
+                deduped += 1
+        else:
+            if ti.isdev():
+                type_ = 'device'
+            elif ti.issym():
+                type_ = 'symlink'
+            elif ti.islnk():
+                type_ = 'hard link'
             else:
-                if ti.isdev():
-                    type_ = 'device'
-                elif ti.issym():
-                    type_ = 'symlink'
-                elif ti.islnk():
-                    type_ = 'hard link'
-                else:
-                    type_ = 'unknown'
-                    log.info('Ignoring tar entry: %r type %r', ti.name, type_)
-                    continue
-    os.remove(local_tarfile)
+                type_ = 'unknown'
+                log.info('Ignoring tar entry: %r type %r', ti.name, type_)
+                continue
+    tar.close()
+    # consume the end-of-archive padding so the remote tar can exit
+    while meter.read(65536):
+        pass
+    proc.wait()
+    stats = dict(bytes=meter.bytes, files=files, deduped=deduped,
+                 codec=codec, duration=meter.duration)
+    log.info('Transferred %d files (%d bytes, %s) from %s:%s in %.1fs',
+             files, meter.bytes, codec, remote.shortname, remotedir,
+             stats['duration'])
+    return stats
+
+
+def truncate_large_files(remote, path, max_size, keep, exclude=()):
+    """
+    Cut every file under a remote directory that is larger than max_size
+    bytes down to its first and last keep bytes, with a marker line in
+    between.
+
+    :param exclude: glob patterns (matched against file names) of files to
+                    leave alone
+    :returns: the number of files truncated
+    """
+    assert 2 * keep < max_size, \
+        'keep must be less than half of max_size'
+    py_cmd = '\n'.join([
+        'import fnmatch, os, sys',
+        'root, max_size, keep = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])',
+        'exclude = sys.argv[4:]',
+        'for dirpath, dirnames, filenames in os.walk(root):',
+        '    for name in filenames:',
+        '        if any(fnmatch.fnmatch(name, p) for p in exclude):',
+        '            continue',
+        '        fn = os.path.join(dirpath, name)',
+        '        if os.path.islink(fn) or not os.path.isfile(fn):',
+        '            continue',
+        '        size = os.path.getsize(fn)',
+        '        if size <= max_size:',
+        '            continue',
+        '        with open(fn, "r+b") as f:',
+        '            f.seek(size - keep)',
+        '            tail = f.read(keep)',
+        '            f.seek(keep)',
+        '            marker = "\\n[... truncated %d bytes ...]\\n" % (size - 2 * keep)',
+        '            f.write(marker.encode())',
+        '            f.write(tail)',
+        '            f.truncate()',
+        '        sys.stdout.write(fn + "\\n")',
+        ])
+    proc = remote.run(
+        args=[
+            'sudo',
+            'python',
+            '-c',
+            py_cmd,
+            path,
+            str(max_size),
+            str(keep),
+            ] + list(exclude),
+        stdout=StringIO(),
+        )
+    truncated = proc.stdout.getvalue().splitlines()
+    if truncated:
+        log.info('Truncated %d large files on %s', len(truncated),
+                 remote.shortname)
+    return len(truncated)
+
+
+_LOG_SCAN_SCRIPT = '\n'.join([
+    'import glob, json, re, sys',
+    'spec = json.loads(sys.argv[1])',
+    'patterns = [re.compile(p) for p in spec["patterns"]]',
+    'any_pattern = re.compile("|".join("(?:%s)" % p for p in spec["patterns"]))',
+    'excludes = [re.compile(p) for p in spec["excludes"]]',
+    'counts = [0] * len(patterns)',
+    'first = [None] * len(patterns)',
+    'first_hit = None',
+    'for path in sorted(set(sum([glob.glob(p) for p in spec["paths"]], []))):',
+    '    try:',
+    '        f = open(path, "rb")',
+    '    except IOError:',
+    '        continue',
+    '    for line in f:',
+    '        line = line.decode("utf-8", "replace")',
+    '        if not any_pattern.search(line):',
+    '            continue',
+    '        if any(e.search(line) for e in excludes):',
+    '            continue',
+    '        hit = [path, line.rstrip("\\n")]',
+    '        if first_hit is None:',
+    '            first_hit = hit',
+    '        for i, p in enumerate(patterns):',
+    '            if p.search(line):',
+    '                counts[i] += 1',
+    '                if first[i] is None:',
+    '                    first[i] = hit',
+    'json.dump(dict(counts=counts, first=first, first_hit=first_hit),',
+    '          sys.stdout)',
+    ])
+
+
+def log_scan_command(paths, patterns, excludes=(), sudo=False):
+    """
+    Build a command that reads a set of log files once and reports, for
+    each pattern, how many lines matched it and the first one that did.
+
+    Patterns and excludes are Python regular expressions (which are close
+    to, but not quite, egrep's). A line matching any exclude is ignored.
+
+    :param paths: log files on the remote; may contain glob patterns
+    :param patterns: patterns to look for, most severe first
+    :param excludes: whitelist patterns
+    :param sudo: read the logs as super user
+    :returns: the command, to be run with stdout captured; parse its
+              output with `LogScan`
+    """
+    spec = dict(paths=list(paths), patterns=list(patterns),
+                excludes=list(excludes))
+    prefix = ['sudo'] if sudo else []
+    return prefix + ['python', '-c', _LOG_SCAN_SCRIPT, json.dumps(spec)]
+
+
+class LogScan(object):
+    """
+    The result of a `log_scan_command()`.
+
+    counts and first map each pattern to its number of matching lines and
+    to the (path, line) of the first of them (or None); first_hit is the
+    first line to match any pattern.
+    """
+    def __init__(self, patterns, output):
+        data = json.loads(output)
+        self.patterns = list(patterns)
+        self.counts = dict(zip(self.patterns, data['counts']))
+        self.first = dict(
+            (pattern, tuple(hit) if hit else None)
+            for pattern, hit in zip(self.patterns, data['first']))
+        first_hit = data['first_hit']
+        self.first_hit = tuple(first_hit) if first_hit else None
+
+    def __nonzero__(self):
+        return self.first_hit is not None
+
+    def most_severe(self):
+        """
+        :returns: (pattern, path, line) for the first line matching the
+                  most severe pattern that matched anything, or None
+        """
+        for pattern in self.patterns:
+            if self.first[pattern] is not None:
+                return (pattern,) + self.first[pattern]
+        return None
+
+
+def scan_logs(remote, paths, patterns, excludes=(), sudo=False):
+    """
+    Scan log files on a remote in a single pass. See `log_scan_command()`
+    for the arguments.
+
+    :returns: a `LogScan`
+    """
+    proc = remote.run(
+        args=log_scan_command(paths, patterns, excludes, sudo=sudo),
+        stdout=StringIO(),
+        )
+    return LogScan(patterns, proc.stdout.getvalue())
 
 
 def pull_directory_tarball(remote, remotedir, localfile):
@@ -736,16 +1081,7 @@ def get_scratch_devices(remote):
     """
     Read the scratch disk list from remote host
     """
-    devs = []
-    try:
-        file_data = get_file(remote, "/scratch_devs")
-        devs = file_data.split()
-    except Exception:
-        r = remote.run(
-            args=['ls', run.Raw('/dev/[sv]d?')],
-            stdout=StringIO()
-            )
-        devs = r.stdout.getvalue().strip().split('\n')
+    devs = list(remote.facts['scratch_devs'])
 
     # Remove root device (vm guests) from the disk list
     for dev in devs:
@@ -754,29 +1090,35 @@ def get_scratch_devices(remote):
             log.warn("Removing root device: %s from device list" % dev)
 
     log.debug('devs={d}'.format(d=devs))
+    if not devs:
+        return []
 
+    # probe every device over a single channel
+    results = remote.batch(
+        [
+            [
+                # node exists
+                'stat',
+                dev,
+                run.Raw('&&'),
+                # readable
+                'sudo', 'dd', 'if=%s' % dev, 'of=/dev/null', 'count=1',
+                run.Raw('&&'),
+                # not mounted
+                run.Raw('!'),
+                'mount',
+                run.Raw('|'),
+                'grep', '-q', dev,
+            ]
+            for dev in devs
+        ],
+        check_status=False,
+    )
     retval = []
-    for dev in devs:
-        try:
-            # FIXME: Split this into multiple calls.
-            remote.run(
-                args=[
-                    # node exists
-                    'stat',
-                    dev,
-                    run.Raw('&&'),
-                    # readable
-                    'sudo', 'dd', 'if=%s' % dev, 'of=/dev/null', 'count=1',
-                    run.Raw('&&'),
-                    # not mounted
-                    run.Raw('!'),
-                    'mount',
-                    run.Raw('|'),
-                    'grep', '-q', dev,
-                ]
-            )
+    for dev, result in zip(devs, results):
+        if result.exitstatus == 0:
             retval.append(dev)
-        except run.CommandFailedError:
+        else:
             log.debug("get_scratch_devices: %s is in use" % dev)
     return retval
 
@@ -1100,30 +1442,74 @@ def stop_daemons_of_type(ctx, type_):
         raise exc_info[0], exc_info[1], exc_info[2]
 
 
-def get_system_type(remote, distro=False, version=False):
+# gather everything in SYSTEM_FACTS over a single channel, as key=value lines
+_FACTS_SCRIPT = """
+echo arch=$(uname -m)
+echo kernel=$(uname -r)
+echo distro=$(lsb_release -is 2>/dev/null)
+echo release=$(lsb_release -rs 2>/dev/null)
+echo codename=$(lsb_release -sc 2>/dev/null)
+echo cpus=$(getconf _NPROCESSORS_ONLN)
+echo mem_kb=$(awk '/^MemTotal:/ { print $2 }' /proc/meminfo)
+if [ -f /scratch_devs ]; then
+    echo scratch_devs=$(cat /scratch_devs)
+else
+    echo scratch_devs=$(ls /dev/[sv]d? 2>/dev/null)
+fi
+"""
+
+DEB_DISTROS = ['Ubuntu', 'Debian']
+RPM_DISTROS = ['CentOS', 'Fedora', 'RedHatEnterpriseServer',
+               'openSUSE project', 'SUSE LINUX']
+
+
+def gather_facts(remote):
     """
-    Return this system type (deb or rpm) or Distro.
+    Collect what we need to know about a host's platform in one remote
+    invocation. Use remote.facts rather than calling this directly; it is
+    cached there until the host reconnects (e.g. after a reboot).
+
+    :returns: dict with arch, kernel, distro (as lsb_release -is prints
+              it), release, codename, package_type ('deb', 'rpm' or None),
+              cpus, mem_kb and scratch_devs (the candidate scratch devices,
+              unprobed)
     """
     r = remote.run(
-        args=[
-            'sudo', 'lsb_release', '-is',
-        ],
+        args=['sh', '-c', _FACTS_SCRIPT],
         stdout=StringIO(),
     )
-    system_value = r.stdout.getvalue().strip()
+    facts = {}
+    for line in r.stdout.getvalue().splitlines():
+        key, _, value = line.partition('=')
+        facts[key] = value.strip()
+    for key in ('cpus', 'mem_kb'):
+        facts[key] = int(facts[key]) if facts.get(key) else None
+    facts['scratch_devs'] = facts.get('scratch_devs', '').split()
+    if facts.get('distro') in DEB_DISTROS:
+        facts['package_type'] = 'deb'
+    elif facts.get('distro') in RPM_DISTROS:
+        facts['package_type'] = 'rpm'
+    else:
+        facts['package_type'] = None
+    log.debug('facts for %s: %s', remote.shortname, facts)
+    return facts
+
+
+def get_system_type(remote, distro=False, version=False):
+    """
+    Return this system type (deb or rpm) or Distro.
+    """
+    facts = remote.facts
+    system_value = facts['distro']
     log.debug("System to be installed: %s" % system_value)
     if version:
-        v = remote.run(args=['sudo', 'lsb_release', '-rs'], stdout=StringIO())
-        version = v.stdout.getvalue().strip()
+        version = facts['release']
     if distro and version:
         return system_value.lower(), version
     if distro:
         return system_value.lower()
-    if system_value in ['Ubuntu', 'Debian']:
-        return "deb"
-    if system_value in ['CentOS', 'Fedora', 'RedHatEnterpriseServer',
-                        'openSUSE project', 'SUSE LINUX']:
-        return "rpm"
+    if facts['package_type'] is not None:
+        return facts['package_type']
     if version:
         return version
     return system_value
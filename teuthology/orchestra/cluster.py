@@ -2,7 +2,81 @@
 Cluster definition
 part of context, Cluster is used to save connection information.
 """
+import collections
+import hashlib
+import json
+import logging
+import time
+from cStringIO import StringIO
+
 import teuthology.misc
+from teuthology.parallel import parallel
+from . import run
+
+log = logging.getLogger(__name__)
+
+
+HostResult = collections.namedtuple(
+    'HostResult', ['exitstatus', 'stdout', 'stderr', 'duration'])
+
+
+class FanoutResult(dict):
+    """
+    The outcome of `Cluster.fanout`: a dict mapping each `Remote` to a
+    `HostResult` of (exitstatus, stdout, stderr, duration).
+
+    exitstatus is None if the command crashed or the connection was lost.
+    """
+
+    def __init__(self, command, *args, **kwargs):
+        super(FanoutResult, self).__init__(*args, **kwargs)
+        self.command = command
+
+    @property
+    def failed(self):
+        """
+        The remotes on which the command did not exit zero, sorted by name.
+        """
+        return sorted((remote for remote, result in self.iteritems()
+                       if result.exitstatus != 0),
+                      key=lambda rem: rem.name)
+
+    def raise_for_status(self):
+        """
+        Raise CommandFailedError for the first failed remote, if any.
+        """
+        failed = self.failed
+        if failed:
+            raise run.CommandFailedError(
+                command=self.command,
+                exitstatus=self[failed[0]].exitstatus,
+                node=failed[0].shortname,
+                )
+
+
+PutResult = collections.namedtuple(
+    'PutResult', ['sent', 'skipped', 'bytes', 'duration'])
+
+# Reads the files listed (as [path, size] pairs) in argv[1] from stdin, one
+# after the other, replacing each path atomically.
+_PUT_FILES_SCRIPT = """
+import json, os, sys, tempfile
+inp = getattr(sys.stdin, 'buffer', sys.stdin)
+umask = os.umask(0)
+os.umask(umask)
+for path, size in json.loads(sys.argv[1]):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    f = os.fdopen(fd, 'wb')
+    while size:
+        buf = inp.read(min(size, 65536))
+        if not buf:
+            sys.exit('short read for ' + path)
+        f.write(buf)
+        size -= len(buf)
+    f.close()
+    os.chmod(tmp, 0o666 & ~umask)
+    os.rename(tmp, path)
+"""
 
 
 class Cluster(object):
@@ -56,13 +130,175 @@ class Cluster(object):
 
         Goes through nodes in alphabetical order.
 
-        If you don't specify wait=False, this will be sequentially.
+        If you don't specify wait=False, this will be sequentially. See
+        `fanout` for running on all nodes concurrently.
 
         Returns a list of `RemoteProcess`.
         """
         remotes = sorted(self.remotes.iterkeys(), key=lambda rem: rem.name)
         return [remote.run(**kwargs) for remote in remotes]
 
+    def fanout(self, args, stdin=None, max_concurrency=None,
+               fail_fast=True):
+        """
+        Run a command on all the nodes in this cluster at the same time and
+        collect each node's exit status, output and duration.
+
+        :param args: command to run, as for `Remote.run`
+        :param stdin: Standard input to send to each node; either a string
+                      or None.
+        :param max_concurrency: Run on at most this many nodes at once.
+                                Defaults to all of them.
+        :param fail_fast: If True, raise CommandFailedError as soon as the
+                          command fails on any node, abandoning the others.
+                          If False, wait for every node and leave it to the
+                          caller to inspect (or `raise_for_status()`) the
+                          result. Errors other than the command's exit
+                          status, such as failing to open a channel, are
+                          raised either way.
+        :returns: a `FanoutResult`
+        """
+        if not isinstance(args, basestring):
+            command = run.quote(args)
+        else:
+            command = args
+
+        def _run(remote):
+            start = time.time()
+            proc = remote.run(
+                args=args,
+                stdin=stdin,
+                stdout=StringIO(),
+                stderr=StringIO(),
+                check_status=False,
+                )
+            if fail_fast and proc.exitstatus != 0:
+                raise run.CommandFailedError(command=command,
+                                             exitstatus=proc.exitstatus,
+                                             node=remote.shortname)
+            return remote, HostResult(
+                proc.exitstatus,
+                proc.stdout.getvalue(),
+                proc.stderr.getvalue(),
+                time.time() - start,
+                )
+
+        results = FanoutResult(command)
+        with parallel(size=max_concurrency) as p:
+            for remote in self.remotes.iterkeys():
+                p.spawn(_run, remote)
+            for remote, result in p:
+                results[remote] = result
+        return results
+
+    def batch(self, commands, **kwargs):
+        """
+        Run a batch of commands on all the nodes in this cluster, using one
+        channel per node and all nodes at once.
+
+        See `Remote.batch` for the arguments.
+
+        Returns a dict mapping each `Remote` to its list of `BatchResult`.
+        """
+        commands = list(commands)
+
+        def _batch(remote):
+            return remote, remote.batch(commands, **kwargs)
+
+        with parallel() as p:
+            for remote in self.remotes.iterkeys():
+                p.spawn(_batch, remote)
+            return dict(p)
+
+    def put_files(self, files, sudo=False, max_concurrency=None):
+        """
+        Copy a set of files to all the nodes in this cluster at the same
+        time, using one channel per node for the data.
+
+        Files whose content on a node already matches (by sha1) are not sent
+        again, but still get the mode and owner asked for.
+
+        :param files: list of (src, path[, mode[, owner]]) tuples. src is a
+                      local file name or a file-like object; mode and owner
+                      are passed to chmod and chown.
+        :param sudo: write the files as super user
+        :param max_concurrency: Copy to at most this many nodes at once.
+                                Defaults to all of them.
+        :returns: a dict mapping each `Remote` to a `PutResult` of the
+                  number of files sent and skipped, the bytes sent and the
+                  duration.
+        """
+        entries = []
+        for entry in files:
+            src, path, mode, owner = (tuple(entry) + (None, None))[:4]
+            if hasattr(src, 'read'):
+                data = src.read()
+            else:
+                with open(src, 'rb') as f:
+                    data = f.read()
+            entries.append(
+                (path, data, hashlib.sha1(data).hexdigest(), mode, owner))
+        paths = [entry[0] for entry in entries]
+        prefix = ['sudo'] if sudo else []
+
+        def _put(remote):
+            start = time.time()
+            proc = remote.run(
+                args=prefix + ['sha1sum', '--'] + paths,
+                stdout=StringIO(),
+                stderr=StringIO(),
+                check_status=False,
+                )
+            existing = {}
+            for line in proc.stdout.getvalue().splitlines():
+                digest, _, name = line.partition('  ')
+                existing[name] = digest
+            todo = [entry for entry in entries
+                    if existing.get(entry[0]) != entry[2]]
+            args = []
+            if todo:
+                args += prefix + [
+                    'python', '-c', _PUT_FILES_SCRIPT,
+                    json.dumps([[entry[0], len(entry[1])] for entry in todo]),
+                    ]
+            # set these even on files we didn't send, in case they changed
+            for path, _, _, mode, owner in entries:
+                if owner:
+                    if args:
+                        args.append(run.Raw('&&'))
+                    args += prefix + ['chown', owner, path]
+                if mode:
+                    if args:
+                        args.append(run.Raw('&&'))
+                    args += prefix + ['chmod', mode, path]
+            if args:
+                remote.run(
+                    args=args,
+                    stdin=''.join(entry[1] for entry in todo),
+                    )
+            return remote, PutResult(
+                len(todo),
+                len(entries) - len(todo),
+                sum(len(entry[1]) for entry in todo),
+                time.time() - start,
+                )
+
+        start = time.time()
+        with parallel(size=max_concurrency) as p:
+            for remote in self.remotes.iterkeys():
+                p.spawn(_put, remote)
+            results = dict(p)
+        log.info(
+            'Copied %d bytes of %s to %d nodes in %.2f seconds '
+            '(%d files already up to date)',
+            sum(r.bytes for r in results.itervalues()),
+            ', '.join(paths),
+            len(results),
+            time.time() - start,
+            sum(r.skipped for r in results.itervalues()),
+            )
+        return results
+
     def write_file(self, file_name, content, sudo=False, perms=None):
         """
         Write text to a file on each node.
@@ -5,6 +5,13 @@ import base64
 import paramiko
 import os
 import logging
+import time
+
+import gevent
+try:
+    from gevent.lock import BoundedSemaphore
+except ImportError:
+    from gevent.coros import BoundedSemaphore
 
 from ..config import config
 from ..contextutil import safe_while
@@ -25,16 +32,54 @@ def split_user(user_at_host):
     return user, host
 
 
+_host_keys = {}
+
+
 def create_key(keytype, key):
     """
     Create an ssh-rsa or ssh-dss key.
+
+    Key objects are cached, since the same host key string is handed to us
+    every time a Remote for that host is (re)connected.
     """
+    cached = _host_keys.get((keytype, key))
+    if cached is not None:
+        return cached
     if keytype == 'ssh-rsa':
-        return paramiko.rsakey.RSAKey(data=base64.decodestring(key))
+        pkey = paramiko.rsakey.RSAKey(data=base64.decodestring(key))
     elif keytype == 'ssh-dss':
-        return paramiko.dsskey.DSSKey(data=base64.decodestring(key))
+        pkey = paramiko.dsskey.DSSKey(data=base64.decodestring(key))
     else:
         raise ValueError('keytype must be ssh-rsa or ssh-dsa')
+    _host_keys[(keytype, key)] = pkey
+    return pkey
+
+
+_ssh_config_cache = {}
+
+
+def get_ssh_config(path="~/.ssh/config"):
+    """
+    Parse an ssh config file, reusing the previous result as long as the
+    file's mtime has not changed.
+
+    :param path: path to the ssh config file
+    :returns:    a paramiko.SSHConfig, or None if the file does not exist
+    """
+    path = os.path.expanduser(path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        _ssh_config_cache.pop(path, None)
+        return None
+    cached = _ssh_config_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    ssh_config = paramiko.SSHConfig()
+    with open(path) as f:
+        ssh_config.parse(f)
+    _ssh_config_cache[path] = (mtime, ssh_config)
+    return ssh_config
 
 
 def connect(user_at_host, host_key=None, keep_alive=False,
@@ -76,10 +121,8 @@ def connect(user_at_host, host_key=None, keep_alive=False,
         timeout=60
     )
 
-    ssh_config_path = os.path.expanduser("~/.ssh/config")
-    if os.path.exists(ssh_config_path):
-        ssh_config = paramiko.SSHConfig()
-        ssh_config.parse(open(ssh_config_path))
+    ssh_config = get_ssh_config()
+    if ssh_config is not None:
         opts = ssh_config.lookup(host)
         opts_to_args = {
             'identityfile': 'key_filename',
@@ -102,3 +145,136 @@ def connect(user_at_host, host_key=None, keep_alive=False,
                 log.exception("Error connecting to {host}".format(host=host))
     ssh.get_transport().set_keepalive(keep_alive)
     return ssh
+
+
+class ConnectionPool(object):
+    """
+    Keep one warm SSH connection per user@host, so that every Remote
+    pointing at the same host shares a single transport and multiplexes its
+    exec channels over it.
+
+    If ``max_channels`` is set, at most that many exec channels are kept open
+    concurrently on each pooled transport; further commands block until a
+    running one exits. The default comes from the ``ssh_max_channels``
+    setting in ~/.teuthology.yaml and is unlimited when unset.
+    """
+
+    def __init__(self, max_channels=None):
+        if max_channels is None:
+            max_channels = config.ssh_max_channels
+        self.max_channels = max_channels
+        self._clients = {}
+        self._hosts = {}
+        self._limiters = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = dict(
+            hits=0,
+            misses=0,
+            reconnects=0,
+            channels_opened=0,
+            channel_open_time=0.0,
+            channel_open_time_max=0.0,
+        )
+
+    def get(self, user_at_host, host_key=None, keep_alive=False,
+            _connect=None):
+        """
+        Return a connected SSHClient for user_at_host, reusing the pooled one
+        if its transport is still active.
+
+        :param user_at_host: user@host
+        :param host_key:     ssh key
+        :param keep_alive:   keep_alive indicator
+        :param _connect:     connection routine, defaults to connect()
+        """
+        if _connect is None:
+            _connect = connect
+        old = self._clients.get(user_at_host)
+        if old is not None:
+            transport = old.get_transport()
+            if transport is not None and transport.is_active():
+                self.stats['hits'] += 1
+                return old
+            self.stats['reconnects'] += 1
+            self.discard(user_at_host)
+        else:
+            self.stats['misses'] += 1
+        ssh = _connect(user_at_host=user_at_host, host_key=host_key,
+                       keep_alive=keep_alive)
+        self._clients[user_at_host] = ssh
+        self._hosts[ssh] = user_at_host
+        if self.max_channels:
+            self._limiters[ssh] = BoundedSemaphore(self.max_channels)
+        return ssh
+
+    def discard(self, user_at_host):
+        """
+        Forget (and close) the pooled connection for user_at_host, if any.
+        """
+        ssh = self._clients.pop(user_at_host, None)
+        if ssh is None:
+            return
+        self._hosts.pop(ssh, None)
+        self._limiters.pop(ssh, None)
+        try:
+            ssh.close()
+        except Exception:
+            log.debug("Error closing connection to %s", user_at_host,
+                      exc_info=True)
+
+    def close_all(self):
+        for user_at_host in list(self._clients):
+            self.discard(user_at_host)
+
+    def exec_command(self, client, command):
+        """
+        Open an exec channel on client and run command on it, like
+        SSHClient.exec_command().
+
+        For pooled clients this honors the per-transport channel cap and
+        records the channel open latency.
+        """
+        limiter = self._limiters.get(client)
+        if limiter is not None:
+            limiter.acquire()
+        start = time.time()
+        try:
+            bufs = client.exec_command(command)
+        except Exception:
+            if limiter is not None:
+                limiter.release()
+            raise
+        if client in self._hosts:
+            elapsed = time.time() - start
+            self.stats['channels_opened'] += 1
+            self.stats['channel_open_time'] += elapsed
+            self.stats['channel_open_time_max'] = max(
+                self.stats['channel_open_time_max'], elapsed)
+        if limiter is not None:
+            gevent.spawn(self._release_on_exit, bufs[1].channel, limiter)
+        return bufs
+
+    @staticmethod
+    def _release_on_exit(channel, limiter):
+        try:
+            # also returns when the channel is closed underneath us
+            channel.recv_exit_status()
+        finally:
+            limiter.release()
+
+    def metrics(self):
+        """
+        :returns: a dict of pool counters plus the number of pooled
+                  connections and the average channel open latency.
+        """
+        metrics = dict(self.stats)
+        metrics['connections'] = len(self._clients)
+        opened = metrics['channels_opened']
+        metrics['channel_open_time_avg'] = \
+            metrics['channel_open_time'] / opened if opened else 0.0
+        return metrics
+
+
+pool = ConnectionPool()
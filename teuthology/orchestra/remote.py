@@ -12,6 +12,7 @@ from cStringIO import StringIO
 from teuthology import lockstatus as ls
 import os
 import pwd
+import shutil
 import tempfile
 
 try:
@@ -21,6 +22,15 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+# programs to pipe 'tar c' through for each supported codec; gzip is
+# handled by tar itself
+TAR_COMPRESSORS = {
+    'none': None,
+    'gzip': None,
+    'zstd': ['zstd', '-c', '-q', '-T0'],
+    'lz4': ['lz4', '-c', '-q'],
+    }
+
 
 class Remote(object):
 
@@ -47,12 +57,17 @@ class Remote(object):
         self.host_key = host_key
         self.keep_alive = keep_alive
         self.console = console
+        self._facts = None
         self.ssh = ssh or self.connect()
 
     def connect(self):
-        self.ssh = connection.connect(user_at_host=self.name,
-                                      host_key=self.host_key,
-                                      keep_alive=self.keep_alive)
+        """
+        Get a connection to this host, shared with any other Remote for the
+        same user@host through `connection.pool`.
+        """
+        self.ssh = connection.pool.get(user_at_host=self.name,
+                                       host_key=self.host_key,
+                                       keep_alive=self.keep_alive)
         return self.ssh
 
     def reconnect(self):
@@ -61,6 +76,8 @@ class Remote(object):
         for failure.
         """
         self.ssh.close()
+        # we may be talking to a rebooted or reimaged host
+        self.invalidate_facts()
         try:
             self.ssh = self.connect()
             return self.is_online
@@ -89,6 +106,23 @@ class Remote(object):
         if not self.is_online:
             return self.connect()
 
+    @property
+    def facts(self):
+        """
+        Platform facts (arch, distro, kernel version, ...) about this host;
+        see `misc.gather_facts`. Gathered on first use and kept until we
+        reconnect.
+        """
+        if self._facts is None:
+            self._facts = misc.gather_facts(self)
+        return self._facts
+
+    def invalidate_facts(self):
+        """
+        Forget the cached facts, e.g. because the host was reimaged.
+        """
+        self._facts = None
+
     @property
     def system_type(self):
         """
@@ -115,6 +149,16 @@ class Remote(object):
         r.remote = self
         return r
 
+    def batch(self, commands, **kwargs):
+        """
+        This calls `orchestra.run.run_batch` with our SSH client, running all
+        of commands over a single channel.
+
+        :returns: a list of `orchestra.run.BatchResult`
+        """
+        return run.run_batch(client=self.ssh, commands=commands,
+                             name=self.shortname, **kwargs)
+
     def mktemp(self):
         """
         Make a remote temporary file
@@ -194,27 +238,49 @@ class Remote(object):
             self.remove(path)
         return local_temp_path
 
-    def get_tar(self, path, to_path, sudo=False):
+    def get_tar_stream(self, path, sudo=False, codec='gzip', exclude=()):
         """
-        Tar a remote directory and copy it locally
+        Start tarring a remote directory to stdout.
+
+        Returns the running `RemoteProcess`; the tarball can be read
+        incrementally from its ``stdout``, after which the caller must
+        ``wait()`` for it.
+
+        :param codec:   how to compress the tarball; one of the keys of
+                        `TAR_COMPRESSORS`. Apart from gzip, the matching
+                        program has to be installed on the remote host.
+        :param exclude: glob patterns of files to leave out
         """
-        remote_temp_path = self.mktemp()
         args = []
         if sudo:
             args.append('sudo')
+        args.append('tar')
+        args.append('cz' if codec == 'gzip' else 'c')
+        args.extend(['-f', '-'])
+        args.extend('--exclude={0}'.format(pattern) for pattern in exclude)
         args.extend([
-            'tar',
-            'cz',
-            '-f', remote_temp_path,
             '-C', path,
             '--',
             '.',
             ])
-        self.run(args=args)
-        if sudo:
-            self.chmod(remote_temp_path, '0666')
-        self._sftp_get_file(remote_temp_path, to_path)
-        self.remove(remote_temp_path)
+        compressor = TAR_COMPRESSORS[codec]
+        if compressor:
+            args = ['set', '-o', 'pipefail', run.Raw(';')] + args + \
+                [run.Raw('|')] + compressor
+        return self.run(
+            args=args,
+            stdout=run.PIPE,
+            wait=False,
+            )
+
+    def get_tar(self, path, to_path, sudo=False):
+        """
+        Tar a remote directory and copy it locally
+        """
+        proc = self.get_tar_stream(path, sudo=sudo)
+        with open(to_path, 'wb') as f:
+            shutil.copyfileobj(proc.stdout, f)
+        proc.wait()
 
 
 def getShortName(name):
@@ -11,6 +11,7 @@ import logging
 import shutil
 
 from ..contextutil import safe_while
+from . import connection
 
 log = logging.getLogger(__name__)
 
@@ -67,7 +68,7 @@ class RemoteProcess(object):
             cmd=self.command))
 
         (self._stdin_buf, self._stdout_buf, self._stderr_buf) = \
-            self.client.exec_command(self.command)
+            connection.pool.exec_command(self.client, self.command)
         (self.stdin, self.stdout, self.stderr) = \
             (self._stdin_buf, self._stdout_buf, self._stderr_buf)
 
@@ -403,6 +404,156 @@ def run(
     return r
 
 
+BATCH_MARKER = '@@teuthology-batch'
+
+
+def batch_script(commands, stop_on_error=False):
+    """
+    Build a shell script that runs each of commands in turn and frames their
+    results on stdout.
+
+    For every command that ran, the script prints a header line::
+
+        @@teuthology-batch <index> <exitstatus> <stdout bytes> <stderr bytes>
+
+    immediately followed by the command's raw stdout and stderr.
+
+    :param commands:      list of commands; each either a string or a list
+                          of strings and `Raw` objects, as for `run()`
+    :param stop_on_error: Whether to skip the remaining commands once one of
+                          them exits non-zero.
+    """
+    lines = [
+        'd=$(mktemp -d) || exit 1',
+        'trap \'rm -rf "$d"\' EXIT',
+        ]
+    for index, args in enumerate(commands):
+        if not isinstance(args, basestring):
+            args = quote(args)
+        lines.extend([
+            '( {cmd}\n) </dev/null >"$d/o" 2>"$d/e"'.format(cmd=args),
+            's=$?',
+            'printf \'%s %d %d %d %d\\n\' {marker} {index} $s '
+            '$(wc -c <"$d/o") $(wc -c <"$d/e")'.format(
+                marker=BATCH_MARKER, index=index),
+            'cat "$d/o" "$d/e"',
+            ])
+        if stop_on_error:
+            lines.append('[ $s -eq 0 ] || exit 0')
+    return '\n'.join(lines) + '\n'
+
+
+class BatchResult(object):
+    """
+    The outcome of one command in a batch. exitstatus, stdout and stderr are
+    None if the command was skipped.
+    """
+    __slots__ = ['args', 'command', 'exitstatus', 'stdout', 'stderr']
+
+    def __init__(self, args, exitstatus=None, stdout=None, stderr=None):
+        self.args = args
+        if isinstance(args, basestring):
+            self.command = args
+        else:
+            self.command = quote(args)
+        self.exitstatus = exitstatus
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def skipped(self):
+        return self.exitstatus is None
+
+    def __repr__(self):
+        return '{classname}(args={args!r}, exitstatus={status!r})'.format(
+            classname=self.__class__.__name__,
+            args=self.args,
+            status=self.exitstatus,
+            )
+
+
+def parse_batch_output(data, commands):
+    """
+    Split the output of a `batch_script()` back into one `BatchResult` per
+    command.
+    """
+    results = [BatchResult(args) for args in commands]
+    pos = 0
+    while pos < len(data):
+        eol = data.index('\n', pos)
+        fields = data[pos:eol].split(' ')
+        if len(fields) != 5 or fields[0] != BATCH_MARKER:
+            raise ValueError(
+                'Malformed batch output at offset {pos}: {line!r}'.format(
+                    pos=pos, line=data[pos:eol]))
+        index, status, out_len, err_len = [int(f) for f in fields[1:]]
+        pos = eol + 1
+        result = results[index]
+        result.exitstatus = status
+        result.stdout = data[pos:pos + out_len]
+        pos += out_len
+        result.stderr = data[pos:pos + err_len]
+        pos += err_len
+    return results
+
+
+def run_batch(client, commands, check_status=True, stop_on_error=False,
+              logger=None, name=None, log_output=True):
+    """
+    Run several commands remotely over a single exec channel.
+
+    :param client: SSHConnection to run the commands with
+    :param commands: list of commands; each either a string or a list of
+                     strings and `Raw` objects, as for `run()`
+    :param check_status: Whether to raise CommandFailedError for the first
+                         command that exits non-zero. The other commands
+                         will still have run unless stop_on_error is set.
+    :param stop_on_error: Whether to skip the remaining commands once one
+                          of them exits non-zero.
+    :param logger: If logging, write the commands' output to "out" and "err"
+                   children of this logger. Defaults to logger named after
+                   this module.
+    :param name: Human readable name (probably hostname) of the destination
+                 host
+    :param log_output: Whether to log the commands' stdout; turn this off
+                       for output that is large or secret. stderr is
+                       always logged.
+    :returns: a list of `BatchResult`, in the order of commands
+    """
+    commands = list(commands)
+    if name is None:
+        (name, port) = client.get_transport().getpeername()
+    if logger is None:
+        logger = log
+    host_log = logger.getChild(name)
+    for args in commands:
+        host_log.debug(u"Queueing: {cmd!r}".format(
+            cmd=args if isinstance(args, basestring) else quote(args)))
+    out = StringIO()
+    run(
+        client=client,
+        args=['bash', '-s'],
+        stdin=batch_script(commands, stop_on_error=stop_on_error),
+        stdout=out,
+        logger=logger,
+        name=name,
+        )
+    results = parse_batch_output(out.getvalue(), commands)
+    for result in results:
+        if log_output:
+            for line in (result.stdout or '').splitlines():
+                host_log.getChild('stdout').info(line)
+        for line in (result.stderr or '').splitlines():
+            host_log.getChild('stderr').info(line)
+    if check_status:
+        for result in results:
+            if result.exitstatus:
+                raise CommandFailedError(command=result.command,
+                                         exitstatus=result.exitstatus,
+                                         node=name)
+    return results
+
+
 def wait(processes, timeout=None):
     """
     Wait for all given processes to exit.
@@ -1,6 +1,11 @@
+import subprocess
+from cStringIO import StringIO
+
 import fudge
 
-from .. import cluster, remote
+from .. import cluster, remote, run
+from ..run import CommandFailedError
+from .util import assert_raises
 
 
 class TestCluster(object):
@@ -204,3 +209,125 @@ class TestCluster(object):
             )
         c_foo = c.exclude('foo', lambda role: role.startswith('b'))
         assert c_foo.remotes == {r2: ['bar'], r3: ['foo']}
+
+    @fudge.with_fakes
+    def test_batch(self):
+        fudge.clear_expectations()
+        commands = [['true'], ['false']]
+        r1 = fudge.Fake('Remote').has_attr(name='r1')
+        ret1 = [fudge.Fake('BatchResult'), fudge.Fake('BatchResult')]
+        r1.expects('batch').with_args(commands, check_status=False)\
+            .returns(ret1)
+        r2 = fudge.Fake('Remote').has_attr(name='r2')
+        ret2 = [fudge.Fake('BatchResult'), fudge.Fake('BatchResult')]
+        r2.expects('batch').with_args(commands, check_status=False)\
+            .returns(ret2)
+        c = cluster.Cluster(
+            remotes=[
+                (r1, ['foo', 'bar']),
+                (r2, ['baz']),
+                ],
+            )
+        got = c.batch(commands, check_status=False)
+        assert got == {r1: ret1, r2: ret2}
+
+    def fake_remote(self, name, exitstatus):
+        remote = fudge.Fake('Remote').has_attr(name=name, shortname=name)
+
+        def _run(args, stdin, stdout, stderr, check_status):
+            assert check_status is False
+            proc = fudge.Fake('RemoteProcess').has_attr(
+                exitstatus=exitstatus, stdout=stdout, stderr=stderr)
+            stdout.write(name)
+            return proc
+        remote.provides('run').calls(_run)
+        return remote
+
+    def test_fanout(self):
+        r1 = self.fake_remote('r1', 0)
+        r2 = self.fake_remote('r2', 0)
+        c = cluster.Cluster(remotes=[(r1, ['foo']), (r2, ['bar'])])
+        got = c.fanout(['test'], max_concurrency=1)
+        assert set(got.keys()) == set([r1, r2])
+        assert got[r1].exitstatus == 0
+        assert got[r1].stdout == 'r1'
+        assert got[r2].stdout == 'r2'
+        assert got[r2].duration >= 0
+        assert got.failed == []
+        got.raise_for_status()
+
+    def test_fanout_fail_fast(self):
+        r1 = self.fake_remote('r1', 0)
+        r2 = self.fake_remote('r2', 1)
+        c = cluster.Cluster(remotes=[(r1, ['foo']), (r2, ['bar'])])
+        e = assert_raises(CommandFailedError, c.fanout, ['test'])
+        assert e.node == 'r2'
+        assert e.exitstatus == 1
+
+    def test_fanout_collect_all(self):
+        r1 = self.fake_remote('r1', 0)
+        r2 = self.fake_remote('r2', 1)
+        r3 = self.fake_remote('r3', None)
+        c = cluster.Cluster(
+            remotes=[(r1, ['foo']), (r2, ['bar']), (r3, ['baz'])])
+        got = c.fanout(['test'], fail_fast=False)
+        assert len(got) == 3
+        assert got.failed == [r2, r3]
+        e = assert_raises(CommandFailedError, got.raise_for_status)
+        assert e.node == 'r2'
+        assert e.command == 'test'
+
+    def local_remote(self, name):
+        remote = fudge.Fake('Remote').has_attr(name=name, shortname=name)
+
+        def _run(args, stdin=None, stdout=None, stderr=None,
+                 check_status=True):
+            proc = subprocess.Popen(
+                ['bash', '-c', run.quote(args)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                )
+            out, err = proc.communicate(stdin)
+            if stdout is not None:
+                stdout.write(out)
+            if stderr is not None:
+                stderr.write(err)
+            if check_status:
+                assert proc.returncode == 0, err
+            return fudge.Fake('RemoteProcess').has_attr(
+                exitstatus=proc.returncode, stdout=stdout, stderr=stderr)
+        remote.provides('run').calls(_run)
+        return remote
+
+    def test_put_files(self, tmpdir):
+        src = tmpdir.join('helper')
+        src.write('#!/bin/sh\necho hi\n')
+        dst = tmpdir.join('bin', 'helper')
+        conf = tmpdir.join('bin', 'helper.conf')
+        tmpdir.mkdir('bin')
+        r1 = self.local_remote('r1')
+        c = cluster.Cluster(remotes=[(r1, ['foo'])])
+        files = [(str(src), str(dst), 'a=rx'),
+                 (StringIO('key = value\n'), str(conf))]
+        got = c.put_files(files)
+        assert got[r1].sent == 2
+        assert got[r1].skipped == 0
+        assert got[r1].bytes == len('#!/bin/sh\necho hi\n') + 12
+        assert dst.read() == '#!/bin/sh\necho hi\n'
+        assert conf.read() == 'key = value\n'
+        assert oct(dst.stat().mode & 0777) == '0555'
+
+        conf.write('stale\n')
+        got = c.put_files([(str(src), str(dst)),
+                           (StringIO('key = value\n'), str(conf))])
+        assert got[r1].sent == 1
+        assert got[r1].skipped == 1
+        assert conf.read() == 'key = value\n'
+
+        # unchanged files still get their mode set
+        dst.chmod(0644)
+        got = c.put_files([(str(src), str(dst), 'a=rx')])
+        assert got[r1].sent == 0
+        assert got[r1].skipped == 1
+        assert oct(dst.stat().mode & 0777) == '0555'
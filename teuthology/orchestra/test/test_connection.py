@@ -104,3 +104,68 @@ class TestConnection(object):
             _create_key=create_key,
             )
         assert got is ssh
+
+
+class TestConnectionPool(object):
+    def fake_ssh(self, active=True):
+        ssh = fudge.Fake('SSHClient')
+        transport = fudge.Fake('Transport')
+        transport.provides('is_active').returns(active)
+        ssh.provides('get_transport').returns(transport)
+        ssh.provides('close')
+        return ssh
+
+    def test_get_reuses_active_connection(self):
+        pool = connection.ConnectionPool()
+        ssh = self.fake_ssh()
+        connect = fudge.Fake('connect').expects_call().times_called(1)\
+            .returns(ssh)
+        got1 = pool.get('jdoe@host', _connect=connect)
+        got2 = pool.get('jdoe@host', _connect=connect)
+        assert got1 is ssh
+        assert got2 is ssh
+        metrics = pool.metrics()
+        assert metrics['misses'] == 1
+        assert metrics['hits'] == 1
+        assert metrics['reconnects'] == 0
+        assert metrics['connections'] == 1
+
+    def test_get_reconnects_inactive_connection(self):
+        pool = connection.ConnectionPool()
+        dead = self.fake_ssh(active=False)
+        alive = self.fake_ssh()
+        connect = fudge.Fake('connect').expects_call().returns(dead)\
+            .next_call().returns(alive)
+        assert pool.get('jdoe@host', _connect=connect) is dead
+        assert pool.get('jdoe@host', _connect=connect) is alive
+        metrics = pool.metrics()
+        assert metrics['misses'] == 1
+        assert metrics['reconnects'] == 1
+        assert metrics['connections'] == 1
+
+    def test_get_separate_hosts(self):
+        pool = connection.ConnectionPool()
+        ssh1 = self.fake_ssh()
+        ssh2 = self.fake_ssh()
+        connect = fudge.Fake('connect').expects_call().returns(ssh1)\
+            .next_call().returns(ssh2)
+        assert pool.get('jdoe@host1', _connect=connect) is ssh1
+        assert pool.get('jdoe@host2', _connect=connect) is ssh2
+        assert pool.metrics()['misses'] == 2
+
+    def test_exec_command_releases_channel_slot(self):
+        pool = connection.ConnectionPool(max_channels=1)
+        ssh = self.fake_ssh()
+        channel = fudge.Fake('Channel')
+        channel.provides('recv_exit_status').returns(0)
+        stdout = fudge.Fake('ChannelFile').has_attr(channel=channel)
+        ssh.provides('exec_command').returns((None, stdout, None))
+        connect = fudge.Fake('connect').expects_call().returns(ssh)
+        pool.get('jdoe@host', _connect=connect)
+        pool.exec_command(ssh, 'true')
+        # would block forever if the first channel's slot leaked
+        pool.exec_command(ssh, 'true')
+        assert pool.metrics()['channels_opened'] == 2
+
+    def test_get_ssh_config_missing(self):
+        assert connection.get_ssh_config('/nonexistent/ssh_config') is None
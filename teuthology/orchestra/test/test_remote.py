@@ -54,3 +54,20 @@ class TestRemote(object):
             )
         assert got is ret
         assert got.remote is r
+
+    def test_facts_cached_until_reconnect(self, monkeypatch):
+        ssh = fudge.Fake('SSHConnection').provides('close')
+        r = remote.Remote(name='jdoe@xyzzy.example.com', ssh=ssh)
+        r.connect = lambda: None
+        gathered = []
+
+        def gather_facts(rem):
+            gathered.append(rem)
+            return dict(arch='x86_64')
+        monkeypatch.setattr(remote.misc, 'gather_facts', gather_facts)
+        assert r.facts['arch'] == 'x86_64'
+        assert r.facts['arch'] == 'x86_64'
+        assert gathered == [r]
+        r.reconnect()
+        r.facts
+        assert gathered == [r, r]
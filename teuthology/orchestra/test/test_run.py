@@ -407,3 +407,38 @@ class TestRun(object):
     def test_quote_and_raw(self):
         got = run.quote(['true', run.Raw('&&'), 'echo', 'yay'])
         assert got == "true && echo yay"
+
+    def run_batch_script(self, commands, **kwargs):
+        import subprocess
+        proc = subprocess.Popen(['bash', '-s'], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+        out, _ = proc.communicate(run.batch_script(commands, **kwargs))
+        assert proc.returncode == 0
+        return run.parse_batch_output(out, commands)
+
+    def test_batch_script(self):
+        commands = [
+            ['echo', 'one two'],
+            'echo oops >&2; printf "x\ny"',
+            ['false'],
+            ['true', run.Raw('&&'), 'echo', 'yay'],
+            ]
+        got = self.run_batch_script(commands)
+        assert [r.exitstatus for r in got] == [0, 0, 1, 0]
+        assert got[0].stdout == 'one two\n'
+        assert got[0].stderr == ''
+        assert got[1].stdout == 'x\ny'
+        assert got[1].stderr == 'oops\n'
+        assert got[3].stdout == 'yay\n'
+        assert got[3].command == 'true && echo yay'
+
+    def test_batch_script_stop_on_error(self):
+        commands = [['true'], ['false'], ['echo', 'skipped']]
+        got = self.run_batch_script(commands, stop_on_error=True)
+        assert [r.exitstatus for r in got] == [0, 1, None]
+        assert got[2].skipped
+
+    def test_parse_batch_output_malformed(self):
+        e = assert_raises(ValueError, run.parse_batch_output,
+                          'garbage\n', [['true']])
+        assert 'Malformed batch output' in str(e)
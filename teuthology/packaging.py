@@ -8,7 +8,8 @@ log = logging.getLogger(__name__)
 
 '''
 Infer things about platform type with this map.
-The key comes from processing lsb_release -ics or -irs (see _get_relmap).
+The key is the distro followed by its codename or release, from the remote's
+facts (see _get_relmap).
 '''
 _RELEASE_MAP = {
     'Ubuntu precise': dict(flavor='deb', release='ubuntu', version='precise'),
@@ -40,22 +41,11 @@ def _get_relmap(rem):
     """
     Internal worker to get the appropriate dict from RELEASE_MAP
     """
-    relmap = getattr(rem, 'relmap', None)
-    if relmap is not None:
-        return relmap
-    lsb_release_out = StringIO()
-    rem.run(args=['lsb_release', '-ics'], stdout=lsb_release_out)
-    release = lsb_release_out.getvalue().replace('\n', ' ').rstrip()
-    if release in _RELEASE_MAP:
-        rem.relmap = _RELEASE_MAP[release]
-        return rem.relmap
-    else:
-        lsb_release_out = StringIO()
-        rem.run(args=['lsb_release', '-irs'], stdout=lsb_release_out)
-        release = lsb_release_out.getvalue().replace('\n', ' ').rstrip()
+    facts = rem.facts
+    for release in ('{distro} {codename}', '{distro} {release}'):
+        release = release.format(**facts)
         if release in _RELEASE_MAP:
-            rem.relmap = _RELEASE_MAP[release]
-            return rem.relmap
+            return _RELEASE_MAP[release]
     raise RuntimeError('Can\'t get release info for {}'.format(rem))
 
 
@@ -54,10 +54,16 @@ class parallel(object):
     At the end of the with block, the main thread waits until all
     spawned functions have completed, or, if one exited with an exception,
     kills the rest and raises the exception.
+
+    If size is given, at most that many functions run at the same time;
+    spawn blocks until a slot frees up.
     """
 
-    def __init__(self):
-        self.group = gevent.pool.Group()
+    def __init__(self, size=None):
+        if size:
+            self.group = gevent.pool.Pool(size)
+        else:
+            self.group = gevent.pool.Group()
         self.results = gevent.queue.Queue()
         self.count = 0
         self.any_spawned = False
@@ -1,14 +1,25 @@
 import os
 import yaml
 import json
+import errno
+import hashlib
 import re
 import requests
 import logging
 import socket
+import sqlite3
+import time
 from datetime import datetime
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 import teuthology
 from .config import config
+from .contextutil import MaxWhileTries, safe_while
+from .parallel import parallel
 
 report_exceptions = (requests.exceptions.RequestException, socket.error)
 
@@ -35,6 +46,7 @@ def main(args):
     server = args['--server']
     if server:
         config.results_server = server
+    concurrency = int(args['--concurrency'] or 1)
     if args['--verbose']:
         teuthology.log.setLevel(logging.DEBUG)
 
@@ -44,7 +56,7 @@ def main(args):
 
     log = init_logging()
     reporter = ResultsReporter(archive_base, save=save, refresh=refresh,
-                               log=log)
+                               log=log, concurrency=concurrency)
     if dead and not job:
         for run_name in run:
             try_mark_run_dead(run[0])
@@ -60,6 +72,135 @@ def main(args):
         reporter.report_all_runs()
 
 
+class JobIndex(object):
+    """
+    An on-disk cache, kept in an sqlite database per archive base, of
+    directory listings and merged job info.
+
+    The database lives in the report_index_dir set in ~/.teuthology.yaml
+    (~/.cache/teuthology by default) rather than in the archive itself,
+    where every write would change the mtime of the archive base and so
+    invalidate the cached list of runs.
+
+    Each entry is stored along with a stamp (made of the mtimes of whatever it
+    was computed from) and is only returned if the caller presents the same
+    stamp, so anything that changed gets recomputed. Since it is only a
+    cache, a database that can't be opened is simply replaced or, failing
+    that, not used, and a query that fails (e.g. because another process
+    holds the database locked) is treated as a miss.
+    """
+    default_dir = '~/.cache/teuthology'
+    # mtimes this recent may not yet reflect changes made within the same
+    # clock tick, so entries based on them aren't stored
+    min_age = 2
+
+    def __init__(self, archive_base, log=None):
+        self.log = log or init_logging()
+        index_dir = os.path.expanduser(config.report_index_dir or
+                                       self.default_dir)
+        self.path = os.path.join(index_dir, 'report_index.{hash}.db'.format(
+            hash=hashlib.sha1(os.path.abspath(archive_base)).hexdigest()))
+        self.conn = None
+        try:
+            os.makedirs(index_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                self.log.warning("Not using report index %s: %s", self.path,
+                                 e)
+                return
+        try:
+            self.conn = self._connect()
+        except sqlite3.OperationalError as e:
+            # e.g. a read-only or locked database; don't throw it away
+            self.log.warning("Not using report index %s: %s", self.path, e)
+        except sqlite3.DatabaseError:
+            self.log.warning("Rebuilding damaged report index %s", self.path)
+            try:
+                os.remove(self.path)
+                self.conn = self._connect()
+            except (OSError, sqlite3.DatabaseError):
+                self.log.exception("Not using report index %s", self.path)
+
+    def _connect(self):
+        # don't hold reports up for long if another process is writing
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=1)
+        # this is a cache; losing it to a crash is fine
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS dirs '
+            '(path TEXT PRIMARY KEY, stamp TEXT, entries TEXT)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs '
+            '(run_name TEXT, job_id TEXT, stamp TEXT, info TEXT, '
+            'PRIMARY KEY (run_name, job_id))')
+        return conn
+
+    def _execute(self, sql, params):
+        """
+        Run a query against the index.
+
+        :returns: the cursor, or None if there is no index or the query
+                  failed
+        """
+        if self.conn is None:
+            return None
+        try:
+            return self.conn.execute(sql, params)
+        except sqlite3.Error as e:
+            self.log.debug("Report index query failed: %s", e)
+            return None
+
+    def _fresh(self, mtimes):
+        return all(time.time() - m >= self.min_age for m in mtimes if m)
+
+    def listdir(self, path, filter_func=None):
+        """
+        Like os.listdir(), followed by filtering the entries through
+        filter_func; the result is reused until path's mtime changes.
+        """
+        mtime = os.path.getmtime(path)
+        stamp = repr(mtime)
+        cursor = self._execute(
+            'SELECT entries FROM dirs WHERE path = ? AND stamp = ?',
+            (path, stamp))
+        row = cursor.fetchone() if cursor is not None else None
+        if row is not None:
+            return json.loads(row[0])
+        entries = os.listdir(path)
+        if filter_func is not None:
+            entries = filter(filter_func, entries)
+        if self._fresh([mtime]):
+            self._execute(
+                'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                (path, stamp, json.dumps(entries)))
+        return entries
+
+    def get_job(self, run_name, job_id, mtimes):
+        """
+        :param mtimes: the mtimes of the files the job info is made from,
+                       None for missing files
+        :returns:      the cached job info dict, or None
+        """
+        cursor = self._execute(
+            'SELECT info FROM jobs WHERE run_name = ? AND job_id = ? '
+            'AND stamp = ?', (run_name, job_id, repr(mtimes)))
+        row = cursor.fetchone() if cursor is not None else None
+        if row is not None:
+            return json.loads(row[0])
+
+    def put_job(self, run_name, job_id, mtimes, job_info):
+        if self.conn is None or not self._fresh(mtimes):
+            return
+        try:
+            info = json.dumps(job_info)
+        except (TypeError, ValueError):
+            # e.g. YAML timestamps; not worth caching
+            return
+        self._execute(
+            'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)',
+            (run_name, job_id, repr(mtimes), info))
+
+
 class ResultsSerializer(object):
     """
     This class exists to poke around in the archive directory doing things like
@@ -68,14 +209,44 @@ class ResultsSerializer(object):
     """
     yamls = ('orig.config.yaml', 'config.yaml', 'info.yaml', 'summary.yaml')
 
-    def __init__(self, archive_base, log=None):
+    def __init__(self, archive_base, log=None, use_index=True):
         self.archive_base = archive_base
         self.log = log or init_logging()
+        self._index = None
+        self.use_index = use_index
+
+    @property
+    def index(self):
+        """
+        The `JobIndex` for archive_base, or None if use_index is False or the
+        archive doesn't exist.
+        """
+        if self._index is None and self.use_index and \
+                os.path.isdir(self.archive_base):
+            self._index = JobIndex(self.archive_base, log=self.log)
+        return self._index
+
+    def _mtimes(self, job_archive_dir):
+        """
+        Return the mtimes of the files job_info() reads, None for missing
+        ones.
+        """
+        mtimes = []
+        for name in self.yamls + ('teuthology.log',):
+            try:
+                mtimes.append(
+                    os.path.getmtime(os.path.join(job_archive_dir, name)))
+            except OSError:
+                mtimes.append(None)
+        return mtimes
 
     def job_info(self, run_name, job_id, pretty=False):
         """
         Given a run name and job id, merge the job's YAML files together.
 
+        Results are cached in the archive's `JobIndex`, so a job's files are
+        only parsed again once they have changed.
+
         :param run_name: The name of the run.
         :param job_id:   The job's id.
         :returns:        A dict.
@@ -83,25 +254,33 @@ class ResultsSerializer(object):
         job_archive_dir = os.path.join(self.archive_base,
                                        run_name,
                                        job_id)
+        mtimes = self._mtimes(job_archive_dir)
+        index = self.index
+        if index is not None:
+            job_info = index.get_job(run_name, job_id, mtimes)
+            if job_info is not None:
+                return job_info
+
         job_info = {}
-        for yaml_name in self.yamls:
-            yaml_path = os.path.join(job_archive_dir, yaml_name)
-            if not os.path.exists(yaml_path):
+        for yaml_name, mtime in zip(self.yamls, mtimes):
+            if mtime is None:
                 continue
+            yaml_path = os.path.join(job_archive_dir, yaml_name)
             with file(yaml_path) as yaml_file:
-                partial_info = yaml.safe_load(yaml_file)
+                partial_info = yaml.load(yaml_file, Loader=SafeLoader)
                 if partial_info is not None:
                     job_info.update(partial_info)
 
-        log_path = os.path.join(job_archive_dir, 'teuthology.log')
-        if os.path.exists(log_path):
-            mtime = int(os.path.getmtime(log_path))
-            mtime_dt = datetime.fromtimestamp(mtime)
+        log_mtime = mtimes[-1]
+        if log_mtime is not None:
+            mtime_dt = datetime.fromtimestamp(int(log_mtime))
             job_info['updated'] = str(mtime_dt)
 
         if 'job_id' not in job_info:
             job_info['job_id'] = job_id
 
+        if index is not None:
+            index.put_job(run_name, job_id, mtimes, job_info)
         return job_info
 
     def json_for_job(self, run_name, job_id, pretty=False):
@@ -121,6 +300,12 @@ class ResultsSerializer(object):
 
         return job_json
 
+    def _listdir(self, path, filter_func):
+        index = self.index
+        if index is None:
+            return filter(filter_func, os.listdir(path))
+        return index.listdir(path, filter_func)
+
     def jobs_for_run(self, run_name):
         """
         Given a run name, look on the filesystem for directories containing job
@@ -132,14 +317,14 @@ class ResultsSerializer(object):
         archive_dir = os.path.join(self.archive_base, run_name)
         if not os.path.isdir(archive_dir):
             return {}
+
+        def is_job_dir(item):
+            return re.match('\d+$', item) and \
+                os.path.isdir(os.path.join(archive_dir, item))
+
         jobs = {}
-        for item in os.listdir(archive_dir):
-            if not re.match('\d+$', item):
-                continue
-            job_id = item
-            job_dir = os.path.join(archive_dir, job_id)
-            if os.path.isdir(job_dir):
-                jobs[job_id] = job_dir
+        for job_id in self._listdir(archive_dir, is_job_dir):
+            jobs[job_id] = os.path.join(archive_dir, job_id)
         return jobs
 
     def running_jobs_for_run(self, run_name):
@@ -164,19 +349,23 @@ class ResultsSerializer(object):
         archive_base = self.archive_base
         if not os.path.isdir(archive_base):
             return []
-        runs = []
-        for run_name in os.listdir(archive_base):
-            if not os.path.isdir(os.path.join(archive_base, run_name)):
-                continue
-            runs.append(run_name)
-        return runs
+
+        def is_run_dir(item):
+            return os.path.isdir(os.path.join(archive_base, item))
+
+        return self._listdir(archive_base, is_run_dir)
 
 
 class ResultsReporter(object):
     last_run_file = 'last_successful_run'
 
     def __init__(self, archive_base=None, base_uri=None, save=False,
-                 refresh=False, log=None):
+                 refresh=False, log=None, concurrency=1, retries=5):
+        """
+        :param concurrency: How many jobs to upload at once. Anything above
+                            1 also makes each upload retry, with backoff,
+                            up to `retries` times.
+        """
         self.log = log or init_logging()
         self.archive_base = archive_base or config.archive_base
         self.base_uri = base_uri or config.results_server
@@ -186,6 +375,10 @@ class ResultsReporter(object):
         self.serializer = ResultsSerializer(archive_base, log=self.log)
         self.save_last_run = save
         self.refresh = refresh
+        self.concurrency = max(int(concurrency), 1)
+        self.retries = retries
+        # jobs that could not be uploaded even after retrying
+        self.failed_jobs = 0
         self.session = self._make_session()
 
         if not self.base_uri:
@@ -194,7 +387,11 @@ class ResultsReporter(object):
 
     def _make_session(self, max_retries=10):
         session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=max_retries)
+        # keep a connection alive for each concurrent upload
+        pool_size = max(self.concurrency, 10)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size,
+                                                max_retries=max_retries)
         session.mount('http://', adapter)
         return session
 
@@ -220,13 +417,16 @@ class ResultsReporter(object):
         num_runs = len(run_names)
         num_jobs = 0
         self.log.info("Posting %s runs", num_runs)
+        start = time.time()
         for run in run_names:
             job_count = self.report_run(run)
             num_jobs += job_count
-            if self.save_last_run:
+            # don't skip past runs with jobs that failed to upload next time
+            if self.save_last_run and not self.failed_jobs:
                 self.last_run = run
         del self.last_run
-        self.log.info("Total: %s jobs in %s runs", num_jobs, len(run_names))
+        self.log.info("Total: %s jobs in %s runs (%.1f jobs/s)", num_jobs,
+                      len(run_names), _rate(num_jobs, start))
 
     def report_run(self, run_name, dead=False):
         """
@@ -257,11 +457,67 @@ class ResultsReporter(object):
         """
         Report several jobs to the results server.
 
+        The results server only accepts one job per request, so rather than
+        batching jobs into a single request, up to self.concurrency of them
+        are uploaded at once over the shared session. A job that still
+        fails after retrying is logged and skipped, so that it doesn't abort
+        the rest.
+
         :param run_name: The name of the run.
         :param job_ids:  The jobs' ids
         """
-        for job_id in job_ids:
-            self.report_job(run_name, job_id, dead=dead)
+        if self.concurrency == 1:
+            for job_id in job_ids:
+                self.report_job(run_name, job_id, dead=dead)
+            return
+
+        start = time.time()
+        count = 0
+        failed = 0
+        with parallel(size=self.concurrency) as p:
+            for job_id in job_ids:
+                p.spawn(self._try, self.report_job, run_name, job_id,
+                        dead=dead)
+            for result in p:
+                if result is None:
+                    failed += 1
+                else:
+                    count += 1
+        self.log.info("    %s jobs in %.1fs (%.1f jobs/s)", count,
+                      time.time() - start, _rate(count, start))
+        if failed:
+            self.log.error("    %s jobs failed to upload", failed)
+            self.failed_jobs += failed
+
+    def _retry(self, func, *args, **kwargs):
+        """
+        Call func, retrying with increasing sleeps if it raises any of
+        report_exceptions other than a 4xx HTTP error.
+        """
+        with safe_while(sleep=1, increment=2, tries=self.retries,
+                        action=func.__name__) as proceed:
+            while proceed():
+                try:
+                    return func(*args, **kwargs)
+                except report_exceptions as e:
+                    response = getattr(e, 'response', None)
+                    status = getattr(response, 'status_code', None)
+                    if status is not None and 400 <= status < 500:
+                        raise
+                    self.log.warning("%s%r failed: %s", func.__name__, args,
+                                     e)
+
+    def _try(self, func, *args, **kwargs):
+        """
+        Call func via _retry, logging rather than raising if it still fails.
+
+        :returns: what func returned, or None if it failed
+        """
+        try:
+            return self._retry(func, *args, **kwargs)
+        except (MaxWhileTries,) + report_exceptions:
+            self.log.exception("%s%r failed; giving up", func.__name__, args)
+            return None
 
     def report_job(self, run_name, job_id, job_info=None, dead=False):
         """
@@ -375,8 +631,14 @@ class ResultsReporter(object):
         :param run_name: The name of the run
         :param job_ids:  A list of job ids
         """
-        for job_id in job_ids:
-            self.delete_job(self, run_name, job_id)
+        if self.concurrency == 1:
+            for job_id in job_ids:
+                self.delete_job(run_name, job_id)
+            return
+
+        with parallel(size=self.concurrency) as p:
+            for job_id in job_ids:
+                p.spawn(self._try, self.delete_job, run_name, job_id)
 
     def delete_run(self, run_name):
         """
@@ -390,6 +652,16 @@ class ResultsReporter(object):
         response.raise_for_status()
 
 
+def _rate(count, start):
+    """
+    :returns: count per second elapsed since start
+    """
+    elapsed = time.time() - start
+    if elapsed <= 0:
+        return 0.0
+    return count / elapsed
+
+
 def push_job_info(run_name, job_id, job_info, base_uri=None):
     """
     Push a job's info (example: ctx.config) to the results server.
@@ -11,6 +11,7 @@ import teuthology
 from teuthology import misc
 from teuthology import ls
 from .report import ResultsSerializer
+from .watcher import ArchiveWatcher
 
 log = logging.getLogger(__name__)
 
@@ -39,12 +40,23 @@ def results(args):
     starttime = time.time()
 
     log.info('Waiting up to %d seconds for tests to finish...', args.timeout)
-    while serializer.running_jobs_for_run(args.name) and args.timeout > 0:
-        if time.time() - starttime > args.timeout:
-            log.warn('test(s) did not finish before timeout of %d seconds',
-                     args.timeout)
-            break
-        time.sleep(10)
+    with ArchiveWatcher([args.archive_dir]) as watcher:
+        while args.timeout > 0:
+            running = serializer.running_jobs_for_run(args.name)
+            if not running:
+                break
+            remaining = args.timeout - (time.time() - starttime)
+            if remaining <= 0:
+                log.warn('test(s) did not finish before timeout of %d seconds',
+                         args.timeout)
+                break
+            # wake up as soon as any of them writes its summary.yaml
+            added = [watcher.add(job_dir) for job_dir in running.itervalues()]
+            if any(added):
+                # a job may have finished before we started watching it,
+                # in which case no event is coming; check again first
+                continue
+            watcher.wait(timeout=remaining)
     log.info('Tests finished! gathering results...')
 
     (subject, body) = build_email_body(args.name, args.archive_dir,
@@ -7,6 +7,7 @@ from cStringIO import StringIO
 
 import argparse
 import contextlib
+import gevent
 import logging
 import os
 import struct
@@ -15,6 +16,7 @@ import time
 
 from teuthology import misc as teuthology
 from teuthology import contextutil
+from teuthology.parallel import parallel
 from ..orchestra import run
 import ceph_client as cclient
 
@@ -43,6 +45,32 @@ class DaemonState(object):
         self.id_ = id_
         self.log = command_kwargs.get('logger', log)
         self.proc = None
+        self.listeners = []
+
+    def _notify(self, event):
+        """
+        Pass event ('started' or 'exited') to our listeners.
+        """
+        for listener in self.listeners:
+            listener(self, event)
+
+    def _started(self, proc):
+        """
+        Tell listeners that proc was started, and again once it exits.
+        """
+        self.proc = proc
+        self._notify('started')
+
+        def watch():
+            try:
+                proc.wait()
+            except Exception:
+                pass
+            # if proc was stopped or replaced by a restart in the meantime,
+            # whoever did that has already told the listeners
+            if self.proc is proc:
+                self._notify('exited')
+        gevent.spawn(watch)
 
     def stop(self, timeout=300):
         """
@@ -60,6 +88,7 @@ class DaemonState(object):
         self.log.debug('waiting for process to exit')
         run.wait([self.proc], timeout=timeout)
         self.proc = None
+        self._notify('exited')
         self.log.info('Stopped')
 
     def restart(self, *args, **kwargs):
@@ -77,7 +106,7 @@ class DaemonState(object):
         cmd_args.extend(args)
         cmd_kwargs = self.command_kwargs
         cmd_kwargs.update(kwargs)
-        self.proc = self.remote.run(*cmd_args, **cmd_kwargs)
+        self._started(self.remote.run(*cmd_args, **cmd_kwargs))
         self.log.info('Started')
 
     def restart_with_args(self, extra_args):
@@ -97,7 +126,7 @@ class DaemonState(object):
         from copy import deepcopy
         cmd_kwargs['args'] = deepcopy(self.command_kwargs['args'])
         cmd_kwargs['args'].extend(extra_args)
-        self.proc = self.remote.run(*cmd_args, **cmd_kwargs)
+        self._started(self.remote.run(*cmd_args, **cmd_kwargs))
         self.log.info('Started')
 
     def signal(self, sig):
@@ -131,6 +160,7 @@ class DaemonState(object):
                 run.wait([self.proc])
             finally:
                 self.proc = None
+                self._notify('exited')
 
 class CephState(object):
     """
@@ -142,6 +172,14 @@ class CephState(object):
         DaemonState values indexcd by an id parameter.
         """
         self.daemons = {}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        Call listener(daemon, event) whenever a daemon is 'started' or has
+        'exited' (whether it was stopped or died).
+        """
+        self.listeners.append(listener)
 
     def add_daemon(self, remote, role, id_, *args, **kwargs):
         """
@@ -160,6 +198,7 @@ class CephState(object):
             self.daemons[role][id_].stop()
             self.daemons[role][id_] = None
         self.daemons[role][id_] = DaemonState(remote, role, id_, *args, **kwargs)
+        self.daemons[role][id_].listeners = self.listeners
         self.daemons[role][id_].restart()
 
     def get_daemon(self, role, id_):
@@ -250,16 +289,9 @@ def ship_utilities(ctx, config):
     filenames = []
 
     log.info('Shipping valgrind.supp...')
-    with file(os.path.join(os.path.dirname(__file__), 'valgrind.supp'), 'rb') as f:
-        fn = os.path.join(testdir, 'valgrind.supp')
-        filenames.append(fn)
-        for rem in ctx.cluster.remotes.iterkeys():
-            teuthology.sudo_write_file(
-                remote=rem,
-                path=fn,
-                data=f,
-                )
-            f.seek(0)
+    fn = os.path.join(testdir, 'valgrind.supp')
+    filenames.append(fn)
+    files = [(os.path.join(os.path.dirname(__file__), 'valgrind.supp'), fn)]
 
     FILES = ['daemon-helper', 'adjust-ulimits', 'kcon_most']
     destdir = '/usr/bin'
@@ -268,23 +300,8 @@ def ship_utilities(ctx, config):
         src = os.path.join(os.path.dirname(__file__), filename)
         dst = os.path.join(destdir, filename)
         filenames.append(dst)
-        with file(src, 'rb') as f:
-            for rem in ctx.cluster.remotes.iterkeys():
-                teuthology.sudo_write_file(
-                    remote=rem,
-                    path=dst,
-                    data=f,
-                )
-                f.seek(0)
-                rem.run(
-                    args=[
-                        'sudo',
-                        'chmod',
-                        'a=rx',
-                        '--',
-                        dst,
-                    ],
-                )
+        files.append((src, dst, 'a=rx'))
+    ctx.cluster.put_files(files, sudo=True)
 
     try:
         yield
@@ -436,6 +453,241 @@ def write_conf(ctx, conf_path=DEFAULT_CONF_PATH):
     run.wait(writes)
 
 
+def probe_osd_devs(remote, roles_for_host, config):
+    """
+    Pick the scratch devices (and journals) for the osds on one host.
+
+    :param remote: Remote the osds run on
+    :param roles_for_host: roles assigned to remote
+    :param config: ceph task configuration
+    :returns: (remote, roles_to_devs, roles_to_journals)
+    """
+    devs = teuthology.get_scratch_devices(remote)
+    roles_to_devs = {}
+    roles_to_journals = {}
+    if config.get('fs'):
+        log.info('fs option selected, checking for scratch devs')
+        log.info('found devs: %s' % (str(devs),))
+        devs_id_map = teuthology.get_wwn_id_map(remote, devs)
+        iddevs = devs_id_map.values()
+        roles_to_devs = assign_devs(
+            teuthology.roles_of_type(roles_for_host, 'osd'), iddevs
+            )
+        if len(roles_to_devs) < len(iddevs):
+            iddevs = iddevs[len(roles_to_devs):]
+
+    if config.get('block_journal'):
+        log.info('block journal enabled')
+        roles_to_journals = assign_devs(
+            teuthology.roles_of_type(roles_for_host, 'osd'), iddevs
+            )
+        log.info('journal map: %s', roles_to_journals)
+
+    if config.get('tmpfs_journal'):
+        log.info('tmpfs journal enabled')
+        roles_to_journals = {}
+        remote.run( args=[ 'sudo', 'mount', '-t', 'tmpfs', 'tmpfs', '/mnt' ] )
+        for osd in teuthology.roles_of_type(roles_for_host, 'osd'):
+            tmpfs = '/mnt/osd.%s' % osd
+            roles_to_journals[osd] = tmpfs
+            remote.run( args=[ 'truncate', '-s', '1500M', tmpfs ] )
+        log.info('journal map: %s', roles_to_journals)
+    return remote, roles_to_devs, roles_to_journals
+
+
+def provision_osds(ctx, config, remote, ids, roles_to_devs):
+    """
+    Create, format and mount the data directories of the osds on one host
+    and run ceph-osd --mkfs for each, several osds at a time (see the
+    osd_mkfs_concurrency option).
+
+    :returns: (remote, [(id, fs, mount_options) for each osd mounted on a
+              scratch device])
+    """
+    mounted = []
+    with parallel(size=config.get('osd_mkfs_concurrency', 4)) as p:
+        for id_ in ids:
+            p.spawn(provision_osd, ctx, config, remote, id_,
+                    roles_to_devs.get(id_))
+        for result in p:
+            if result is not None:
+                mounted.append(result)
+    return remote, mounted
+
+
+def provision_osd(ctx, config, remote, id_, dev):
+    """
+    Create (and if dev is given, format and mount) the data directory of
+    a single osd, then run ceph-osd --mkfs in it.
+
+    :returns: (id, fs, mount_options) if dev was mounted, otherwise None
+    """
+    testdir = teuthology.get_testdir(ctx)
+    coverage_dir = '{tdir}/archive/coverage'.format(tdir=testdir)
+    data_dir = os.path.join('/var/lib/ceph/osd', 'ceph-{id}'.format(id=id_))
+    remote.run(
+        args=[
+            'sudo',
+            'mkdir',
+            '-p',
+            data_dir,
+            ])
+    ret = None
+    if dev:
+        fs = config.get('fs')
+        package = None
+        mkfs_options = config.get('mkfs_options')
+        mount_options = config.get('mount_options')
+        if fs == 'btrfs':
+            #package = 'btrfs-tools'
+            if mount_options is None:
+                mount_options = ['noatime','user_subvol_rm_allowed']
+            if mkfs_options is None:
+                mkfs_options = ['-m', 'single',
+                                '-l', '32768',
+                                '-n', '32768']
+        if fs == 'xfs':
+            #package = 'xfsprogs'
+            if mount_options is None:
+                mount_options = ['noatime']
+            if mkfs_options is None:
+                mkfs_options = ['-f', '-i', 'size=2048']
+        if fs == 'ext4' or fs == 'ext3':
+            if mount_options is None:
+                mount_options = ['noatime','user_xattr']
+
+        if mount_options is None:
+            mount_options = []
+        # copy, since several osds are set up at once from the same config
+        mkfs_options = list(mkfs_options or [])
+        mkfs = ['mkfs.%s' % fs] + mkfs_options
+        log.info('%s on %s on %s' % (mkfs, dev, remote))
+        if package is not None:
+            remote.run(
+                args=[
+                    'sudo',
+                    'apt-get', 'install', '-y', package
+                    ],
+                stdout=StringIO(),
+                )
+
+        try:
+            remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
+        except run.CommandFailedError:
+            # Newer btfs-tools doesn't prompt for overwrite, use -f
+            if '-f' not in mkfs_options:
+                mkfs_options.append('-f')
+                mkfs = ['mkfs.%s' % fs] + mkfs_options
+                log.info('%s on %s on %s' % (mkfs, dev, remote))
+            remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
+
+        log.info('mount %s on %s -o %s' % (dev, remote,
+                                           ','.join(mount_options)))
+        remote.run(
+            args=[
+                'sudo',
+                'mount',
+                '-t', fs,
+                '-o', ','.join(mount_options),
+                dev,
+                data_dir,
+                ]
+            )
+        ret = (id_, fs, mount_options)
+
+    remote.run(
+        args=[
+            'sudo',
+            'MALLOC_CHECK_=3',
+            'adjust-ulimits',
+            'ceph-coverage',
+            coverage_dir,
+            'ceph-osd',
+            '--mkfs',
+            '--mkkey',
+            '-i', id_,
+            '--monmap', '{tdir}/monmap'.format(tdir=testdir),
+            ],
+        )
+    return ret
+
+
+def read_keyrings(remote, roles_for_host):
+    """
+    Read the keyrings of all the mds, osd and client roles on a host in a
+    single round trip.
+
+    :returns: a list of (type, id, keyring data)
+    """
+    keys = []
+    paths = []
+    for type_ in ['mds', 'osd']:
+        for id_ in teuthology.roles_of_type(roles_for_host, type_):
+            keys.append((type_, id_))
+            paths.append('/var/lib/ceph/{type}/ceph-{id}/keyring'.format(
+                type=type_,
+                id=id_,
+                ))
+    for id_ in teuthology.roles_of_type(roles_for_host, 'client'):
+        keys.append(('client', id_))
+        paths.append('/etc/ceph/ceph.client.{id}.keyring'.format(id=id_))
+    if not paths:
+        return []
+    data = teuthology.get_files(remote, paths, sudo=True)
+    return [(type_, id_, d) for ((type_, id_), d) in zip(keys, data)]
+
+
+def compress_ceph_logs(remote):
+    """
+    gzip the logs in /var/log/ceph on a host, using pigz if it is installed
+    and otherwise one gzip per cpu.
+    """
+    remote.run(
+        args=[
+            'sudo', 'sh', '-c',
+            'find /var/log/ceph -name "*.log" -print0 | '
+            'if command -v pigz >/dev/null; then '
+            'xargs -0 --no-run-if-empty -- pigz --; '
+            'else '
+            'xargs -0 --no-run-if-empty -P "$(nproc)" -n 1 -- gzip --; '
+            'fi',
+            ],
+        )
+
+
+def archive_ceph_logs(remote, roles, archive):
+    """
+    Compress the ceph logs on a host, then copy them (and the data of any
+    monitors on it) into the archive.
+
+    :returns: (shortname, stats), where stats has the time spent
+              compressing and the bytes, files and duration of the log
+              transfer
+    """
+    start = time.time()
+    compress_ceph_logs(remote)
+    stats = dict(compress_duration=time.time() - start)
+    for role in roles:
+        if role.startswith('mon.'):
+            teuthology.pull_directory_tarball(
+                remote,
+                '/var/lib/ceph/mon',
+                os.path.join(archive, 'data', role + '.tgz'))
+    sub = os.path.join(archive, 'remote', remote.shortname)
+    os.makedirs(sub)
+    # the logs are compressed already
+    transfer = teuthology.pull_directory(remote, '/var/log/ceph',
+                                         os.path.join(sub, 'log'),
+                                         codec='none')
+    stats.update(bytes=transfer['bytes'], files=transfer['files'],
+                 transfer_duration=transfer['duration'],
+                 duration=time.time() - start)
+    log.info('Archived ceph logs from %s: %d bytes in %.1fs '
+             '(%.1fs compressing)', remote.shortname, stats['bytes'],
+             stats['duration'], stats['compress_duration'])
+    return remote.shortname, stats
+
+
 @contextlib.contextmanager
 def cluster(ctx, config):
     """
@@ -491,44 +743,20 @@ def cluster(ctx, config):
     devs_to_clean = {}
     remote_to_roles_to_devs = {}
     remote_to_roles_to_journals = {}
+    provision_times = {}
     osds = ctx.cluster.only(teuthology.is_type('osd'))
-    for remote, roles_for_host in osds.remotes.iteritems():
-        devs = teuthology.get_scratch_devices(remote)
-        roles_to_devs = {}
-        roles_to_journals = {}
-        if config.get('fs'):
-            log.info('fs option selected, checking for scratch devs')
-            log.info('found devs: %s' % (str(devs),))
-            devs_id_map = teuthology.get_wwn_id_map(remote, devs)
-            iddevs = devs_id_map.values()
-            roles_to_devs = assign_devs(
-                teuthology.roles_of_type(roles_for_host, 'osd'), iddevs
-                )
-            if len(roles_to_devs) < len(iddevs):
-                iddevs = iddevs[len(roles_to_devs):]
-            devs_to_clean[remote] = []
-
-        if config.get('block_journal'):
-            log.info('block journal enabled')
-            roles_to_journals = assign_devs(
-                teuthology.roles_of_type(roles_for_host, 'osd'), iddevs
-                )
-            log.info('journal map: %s', roles_to_journals)
-
-        if config.get('tmpfs_journal'):
-            log.info('tmpfs journal enabled')
-            roles_to_journals = {}
-            remote.run( args=[ 'sudo', 'mount', '-t', 'tmpfs', 'tmpfs', '/mnt' ] )
-            for osd in teuthology.roles_of_type(roles_for_host, 'osd'):
-                tmpfs = '/mnt/osd.%s' % osd
-                roles_to_journals[osd] = tmpfs
-                remote.run( args=[ 'truncate', '-s', '1500M', tmpfs ] )
-            log.info('journal map: %s', roles_to_journals)
-
-        log.info('dev map: %s' % (str(roles_to_devs),))
-        remote_to_roles_to_devs[remote] = roles_to_devs
-        remote_to_roles_to_journals[remote] = roles_to_journals
-
+    log.info('Probing scratch devices on osd nodes...')
+    start = time.time()
+    with parallel() as p:
+        for remote, roles_for_host in osds.remotes.iteritems():
+            p.spawn(probe_osd_devs, remote, roles_for_host, config)
+        for remote, roles_to_devs, roles_to_journals in p:
+            log.info('dev map for %s: %s' % (remote, str(roles_to_devs)))
+            if config.get('fs'):
+                devs_to_clean[remote] = []
+            remote_to_roles_to_devs[remote] = roles_to_devs
+            remote_to_roles_to_journals[remote] = roles_to_journals
+    provision_times['probe'] = time.time() - start
 
     log.info('Generating config...')
     remotes_and_roles = ctx.cluster.remotes.items()
@@ -634,7 +862,7 @@ def cluster(ctx, config):
         path='{tdir}/monmap'.format(tdir=testdir),
         )
 
-    for rem in ctx.cluster.remotes.iterkeys():
+    def send_monmap(rem):
         # copy mon key and initial monmap
         log.info('Sending monmap to node {remote}'.format(remote=rem))
         teuthology.sudo_write_file(
@@ -649,6 +877,10 @@ def cluster(ctx, config):
             data=monmap,
             )
 
+    with parallel() as p:
+        for rem in ctx.cluster.remotes.iterkeys():
+            p.spawn(send_monmap, rem)
+
     log.info('Setting up mon nodes...')
     mons = ctx.cluster.only(teuthology.is_type('mon'))
     run.wait(
@@ -704,82 +936,19 @@ def cluster(ctx, config):
     ctx.disk_config.remote_to_roles_to_dev_fstype = {}
 
     log.info("ctx.disk_config.remote_to_roles_to_dev: {r}".format(r=str(ctx.disk_config.remote_to_roles_to_dev)))
-    for remote, roles_for_host in osds.remotes.iteritems():
-        roles_to_devs = remote_to_roles_to_devs[remote]
-        roles_to_journals = remote_to_roles_to_journals[remote]
-
-
-        for id_ in teuthology.roles_of_type(roles_for_host, 'osd'):
-            remote.run(
-                args=[
-                    'sudo',
-                    'mkdir',
-                    '-p',
-                    '/var/lib/ceph/osd/ceph-{id}'.format(id=id_),
-                    ])
-            log.info(str(roles_to_journals))
-            log.info(id_)
-            if roles_to_devs.get(id_):
-                dev = roles_to_devs[id_]
-                fs = config.get('fs')
-                package = None
-                mkfs_options = config.get('mkfs_options')
-                mount_options = config.get('mount_options')
-                if fs == 'btrfs':
-                    #package = 'btrfs-tools'
-                    if mount_options is None:
-                        mount_options = ['noatime','user_subvol_rm_allowed']
-                    if mkfs_options is None:
-                        mkfs_options = ['-m', 'single',
-                                        '-l', '32768',
-                                        '-n', '32768']
-                if fs == 'xfs':
-                    #package = 'xfsprogs'
-                    if mount_options is None:
-                        mount_options = ['noatime']
-                    if mkfs_options is None:
-                        mkfs_options = ['-f', '-i', 'size=2048']
-                if fs == 'ext4' or fs == 'ext3':
-                    if mount_options is None:
-                        mount_options = ['noatime','user_xattr']
-
-                if mount_options is None:
-                    mount_options = []
-                if mkfs_options is None:
-                    mkfs_options = []
-                mkfs = ['mkfs.%s' % fs] + mkfs_options
-                log.info('%s on %s on %s' % (mkfs, dev, remote))
-                if package is not None:
-                    remote.run(
-                        args=[
-                            'sudo',
-                            'apt-get', 'install', '-y', package
-                            ],
-                        stdout=StringIO(),
-                        )
-
-                try:
-                    remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
-                except run.CommandFailedError:
-                    # Newer btfs-tools doesn't prompt for overwrite, use -f
-                    if '-f' not in mount_options:
-                        mkfs_options.append('-f')
-                        mkfs = ['mkfs.%s' % fs] + mkfs_options
-                        log.info('%s on %s on %s' % (mkfs, dev, remote))
-                    remote.run(args= ['yes', run.Raw('|')] + ['sudo'] + mkfs + [dev])
-
-                log.info('mount %s on %s -o %s' % (dev, remote,
-                                                   ','.join(mount_options)))
-                remote.run(
-                    args=[
-                        'sudo',
-                        'mount',
-                        '-t', fs,
-                        '-o', ','.join(mount_options),
-                        dev,
-                        os.path.join('/var/lib/ceph/osd', 'ceph-{id}'.format(id=id_)),
-                        ]
-                    )
+    start = time.time()
+    with parallel() as p:
+        for remote, roles_for_host in osds.remotes.iteritems():
+            p.spawn(
+                provision_osds,
+                ctx,
+                config,
+                remote,
+                teuthology.roles_of_type(roles_for_host, 'osd'),
+                remote_to_roles_to_devs[remote],
+                )
+        for remote, mounted in p:
+            for id_, fs, mount_options in mounted:
                 if not remote in ctx.disk_config.remote_to_roles_to_dev_mount_options:
                     ctx.disk_config.remote_to_roles_to_dev_mount_options[remote] = {}
                 ctx.disk_config.remote_to_roles_to_dev_mount_options[remote][id_] = mount_options
@@ -787,53 +956,24 @@ def cluster(ctx, config):
                     ctx.disk_config.remote_to_roles_to_dev_fstype[remote] = {}
                 ctx.disk_config.remote_to_roles_to_dev_fstype[remote][id_] = fs
                 devs_to_clean[remote].append(
-                    os.path.join(
-                        os.path.join('/var/lib/ceph/osd', 'ceph-{id}'.format(id=id_)),
-                        )
+                    os.path.join('/var/lib/ceph/osd', 'ceph-{id}'.format(id=id_))
                     )
-
-        for id_ in teuthology.roles_of_type(roles_for_host, 'osd'):
-            remote.run(
-                args=[
-                    'sudo',
-                    'MALLOC_CHECK_=3',
-                    'adjust-ulimits',
-                    'ceph-coverage',
-                    coverage_dir,
-                    'ceph-osd',
-                    '--mkfs',
-                    '--mkkey',
-                    '-i', id_,
-                    '--monmap', '{tdir}/monmap'.format(tdir=testdir),
-                    ],
-                )
-
+    provision_times['mkfs'] = time.time() - start
+    log.info('Provisioned osds in %.1f seconds (probe %.1f, mkfs %.1f)',
+             provision_times['probe'] + provision_times['mkfs'],
+             provision_times['probe'], provision_times['mkfs'])
+    ctx.summary['osd_provisioning'] = provision_times
 
     log.info('Reading keys from all nodes...')
+    with parallel() as p:
+        for remote, roles_for_host in ctx.cluster.remotes.iteritems():
+            p.spawn(read_keyrings, remote, roles_for_host)
+        keys = []
+        for host_keys in p:
+            keys.extend(host_keys)
     keys_fp = StringIO()
-    keys = []
-    for remote, roles_for_host in ctx.cluster.remotes.iteritems():
-        for type_ in ['mds','osd']:
-            for id_ in teuthology.roles_of_type(roles_for_host, type_):
-                data = teuthology.get_file(
-                    remote=remote,
-                    path='/var/lib/ceph/{type}/ceph-{id}/keyring'.format(
-                        type=type_,
-                        id=id_,
-                        ),
-                    sudo=True,
-                    )
-                keys.append((type_, id_, data))
-                keys_fp.write(data)
-    for remote, roles_for_host in ctx.cluster.remotes.iteritems():
-        for type_ in ['client']:
-            for id_ in teuthology.roles_of_type(roles_for_host, type_):
-                data = teuthology.get_file(
-                    remote=remote,
-                    path='/etc/ceph/ceph.client.{id}.keyring'.format(id=id_)
-                    )
-                keys.append((type_, id_, data))
-                keys_fp.write(data)
+    for type_, id_, data in keys:
+        keys_fp.write(data)
 
     log.info('Adding keys to all mons...')
     writes = mons.run(
@@ -848,24 +988,24 @@ def cluster(ctx, config):
     keys_fp.seek(0)
     teuthology.feed_many_stdins_and_close(keys_fp, writes)
     run.wait(writes)
-    for type_, id_, data in keys:
-        run.wait(
-            mons.run(
-                args=[
-                    'sudo',
-                    'adjust-ulimits',
-                    'ceph-coverage',
-                    coverage_dir,
-                    'ceph-authtool',
-                    keyring_path,
-                    '--name={type}.{id}'.format(
-                        type=type_,
-                        id=id_,
-                        ),
-                    ] + list(teuthology.generate_caps(type_)),
-                wait=False,
-                ),
-            )
+    mons.batch(
+        [
+            [
+                'sudo',
+                'adjust-ulimits',
+                'ceph-coverage',
+                coverage_dir,
+                'ceph-authtool',
+                keyring_path,
+                '--name={type}.{id}'.format(
+                    type=type_,
+                    id=id_,
+                    ),
+                ] + list(teuthology.generate_caps(type_))
+            for type_, id_, data in keys
+            ],
+        stop_on_error=True,
+        )
 
     log.info('Running mkfs on mon nodes...')
     for remote, roles_for_host in mons.remotes.iteritems():
@@ -916,48 +1056,26 @@ def cluster(ctx, config):
         (mon0_remote,) = ctx.cluster.only(firstmon).remotes.keys()
 
         log.info('Checking cluster log for badness...')
-        def first_in_ceph_log(pattern, excludes):
-            """
-            Find the first occurence of the pattern specified in the Ceph log,
-            Returns None if none found.
-
-            :param pattern: Pattern scanned for.
-            :param excludes: Patterns to ignore.
-            :return: First line of text (or None if not found)
-            """
-            args = [
-                'sudo',
-                'egrep', pattern,
-                '/var/log/ceph/ceph.log',
-                ]
-            for exclude in excludes:
-                args.extend([run.Raw('|'), 'egrep', '-v', exclude])
-            args.extend([
-                    run.Raw('|'), 'head', '-n', '1',
-                    ])
-            r = mon0_remote.run(
-                stdout=StringIO(),
-                args=args,
-                )
-            stdout = r.stdout.getvalue()
-            if stdout != '':
-                return stdout
-            return None
-
-        if first_in_ceph_log('\[ERR\]|\[WRN\]|\[SEC\]',
-                             config['log_whitelist']) is not None:
-            log.warning('Found errors (ERR|WRN|SEC) in cluster log')
+        scan = teuthology.scan_logs(
+            mon0_remote,
+            ['/var/log/ceph/ceph.log'],
+            ['\[SEC\]', '\[ERR\]', '\[WRN\]'],
+            excludes=config['log_whitelist'],
+            sudo=True,
+            )
+        if scan:
+            log.warning('Found errors (ERR|WRN|SEC) in cluster log: %s',
+                        ', '.join('%d %s' % (count, pattern)
+                                  for pattern, count in scan.counts.iteritems()
+                                  if count))
             ctx.summary['success'] = False
             # use the most severe problem as the failure reason
             if 'failure_reason' not in ctx.summary:
-                for pattern in ['\[SEC\]', '\[ERR\]', '\[WRN\]']:
-                    match = first_in_ceph_log(pattern, config['log_whitelist'])
-                    if match is not None:
-                        ctx.summary['failure_reason'] = \
-                            '"{match}" in cluster log'.format(
-                            match=match.rstrip('\n'),
-                            )
-                        break
+                (pattern, path, match) = scan.most_severe()
+                ctx.summary['failure_reason'] = \
+                    '"{match}" in cluster log'.format(
+                    match=match,
+                    )
 
         for remote, dirs in devs_to_clean.iteritems():
             for dir_ in dirs:
@@ -983,51 +1101,18 @@ def cluster(ctx, config):
 
         if ctx.archive is not None and \
                 not (ctx.config.get('archive-on-error') and ctx.summary['success']):
-            # archive mon data, too
-            log.info('Archiving mon data...')
-            path = os.path.join(ctx.archive, 'data')
-            os.makedirs(path)
-            for remote, roles in mons.remotes.iteritems():
-                for role in roles:
-                    if role.startswith('mon.'):
-                        teuthology.pull_directory_tarball(
-                            remote,
-                            '/var/lib/ceph/mon',
-                            path + '/' + role + '.tgz')
-
-            # and logs
-            log.info('Compressing logs...')
-            run.wait(
-                ctx.cluster.run(
-                    args=[
-                        'sudo',
-                        'find',
-                        '/var/log/ceph',
-                        '-name',
-                        '*.log',
-                        '-print0',
-                        run.Raw('|'),
-                        'sudo',
-                        'xargs',
-                        '-0',
-                        '--no-run-if-empty',
-                        '--',
-                        'gzip',
-                        '--',
-                        ],
-                    wait=False,
-                    ),
-                )
-
-            log.info('Archiving logs...')
-            path = os.path.join(ctx.archive, 'remote')
-            os.makedirs(path)
-            for remote in ctx.cluster.remotes.iterkeys():
-                sub = os.path.join(path, remote.shortname)
-                os.makedirs(sub)
-                teuthology.pull_directory(remote, '/var/log/ceph',
-                                          os.path.join(sub, 'log'))
-
+            log.info('Archiving mon data and logs...')
+            os.makedirs(os.path.join(ctx.archive, 'data'))
+            os.makedirs(os.path.join(ctx.archive, 'remote'))
+            conf = ctx.config.get('archive-transfer') or {}
+            ctx.summary['ceph_log_archive'] = {}
+            # each host compresses and then uploads on its own, so one
+            # host's transfer overlaps with the others' compression
+            with parallel(size=conf.get('concurrency')) as p:
+                for remote, roles in ctx.cluster.remotes.iteritems():
+                    p.spawn(archive_ceph_logs, remote, roles, ctx.archive)
+                for name, stats in p:
+                    ctx.summary['ceph_log_archive'][name] = stats
 
         log.info('Cleaning ceph cluster...')
         run.wait(
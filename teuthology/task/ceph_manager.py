@@ -2,15 +2,91 @@
 ceph manager -- Thrasher and CephManager objects
 """
 from cStringIO import StringIO
+import functools
 import random
+import re
 import time
 import gevent
+import gevent.event
 import json
+import os
 import threading
+import yaml
 from teuthology import misc as teuthology
+from teuthology.orchestra import run
 from teuthology.task import ceph as ceph_task
 from teuthology.task.scrub import Scrubber
 
+class ThrashStats(object):
+    """
+    Thrasher telemetry: how long each kind of action took, and how long the
+    cluster took to recover after each run of actions.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    buckets = (1, 2, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.start = time.time()
+        self.actions = {}
+        self.recoveries = []
+        self.since_recovery = []
+
+    def bucket(self, duration):
+        """
+        :returns: the histogram bucket label for duration
+        """
+        for bound in self.buckets:
+            if duration < bound:
+                return '<%ds' % bound
+        return '>=%ds' % self.buckets[-1]
+
+    def record_action(self, name, duration):
+        """
+        Record that an action called name took duration seconds.
+        """
+        stats = self.actions.setdefault(
+            name, dict(count=0, total=0.0, min=None, max=None, histogram={}))
+        stats['count'] += 1
+        stats['total'] += duration
+        if stats['min'] is None or duration < stats['min']:
+            stats['min'] = duration
+        if stats['max'] is None or duration > stats['max']:
+            stats['max'] = duration
+        bucket = self.bucket(duration)
+        stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+        self.since_recovery.append(name)
+
+    def record_recovery(self, duration):
+        """
+        Record that the cluster took duration seconds to recover from the
+        actions recorded since the previous recovery.
+        """
+        self.recoveries.append(dict(duration=duration,
+                                    after=self.since_recovery))
+        self.since_recovery = []
+
+    def as_dict(self):
+        """
+        :returns: everything recorded so far, suitable for yaml.safe_dump
+        """
+        elapsed = time.time() - self.start
+        num_actions = sum(a['count'] for a in self.actions.itervalues())
+        ret = dict(
+            elapsed=elapsed,
+            actions_per_hour=num_actions * 3600.0 / elapsed if elapsed else 0,
+            actions={},
+            recoveries=self.recoveries,
+            )
+        for name, stats in self.actions.iteritems():
+            ret['actions'][name] = dict(stats,
+                                        mean=stats['total'] / stats['count'])
+        if self.recoveries:
+            durations = [r['duration'] for r in self.recoveries]
+            ret['recovery_mean'] = sum(durations) / len(durations)
+            ret['recovery_max'] = max(durations)
+        return ret
+
+
 class Thrasher:
     """
     Object used to thrash Ceph
@@ -31,6 +107,11 @@ class Thrasher:
             self.revive_timeout += 120
         self.clean_wait = self.config.get('clean_wait', 0)
         self.minin = self.config.get("min_in", 3)
+        self.action_concurrency = self.config.get('action_concurrency', 1)
+        self.inflight = []
+        self.busy_osds = set()
+        self.busy_hosts = set()
+        self.stats = ThrashStats()
 
         num_osds = self.in_osds + self.out_osds
         self.max_pgs = self.config.get("max_pgs_per_pool_osd", 1200) * num_osds
@@ -104,9 +185,9 @@ class Thrasher:
         if osd is None:
             osd = random.choice(self.in_osds)
         self.log("Removing osd %s, in_osds are: %s" % (str(osd), str(self.in_osds)))
-        self.ceph_manager.mark_out_osd(osd)
         self.in_osds.remove(osd)
         self.out_osds.append(osd)
+        self.ceph_manager.mark_out_osd(osd)
 
     def in_osd(self, osd=None):
         """
@@ -338,15 +419,15 @@ class Thrasher:
         actions.append((self.test_backfill_full, chance_test_backfill_full,))
         for key in ['heartbeat_inject_failure', 'filestore_inject_stall']:
             for scenario in [
-                (lambda: self.inject_pause(key,
-                                           self.config.get('pause_short', 3),
-                                           0,
-                                           False),
+                (functools.partial(self.inject_pause, key,
+                                   self.config.get('pause_short', 3),
+                                   0,
+                                   False),
                  self.config.get('chance_inject_pause_short', 1),),
-                (lambda: self.inject_pause(key,
-                                           self.config.get('pause_long', 80),
-                                           self.config.get('pause_check_after', 70),
-                                           True),
+                (functools.partial(self.inject_pause, key,
+                                   self.config.get('pause_long', 80),
+                                   self.config.get('pause_check_after', 70),
+                                   True),
                  self.config.get('chance_inject_pause_long', 0),)]:
                 actions.append(scenario)
 
@@ -358,6 +439,89 @@ class Thrasher:
             val -= prob
         return None
 
+    def run_action(self, action, *args):
+        """
+        Run one action, recording how long it took.
+        """
+        name = getattr(action, 'func', action).__name__
+        start = time.time()
+        try:
+            action(*args)
+        finally:
+            self.stats.record_action(name, time.time() - start)
+
+    def osd_candidates(self, action):
+        """
+        :returns: the osds action may pick from, or None if action is not
+                  confined to a single osd.
+        """
+        return {
+            self.out_osd: self.in_osds,
+            self.kill_osd: self.live_osds,
+            self.in_osd: self.out_osds,
+            self.revive_osd: self.dead_osds,
+            self.reweight_osd: self.in_osds,
+            self.primary_affinity: self.in_osds,
+            }.get(action)
+
+    def osd_host(self, osd):
+        """
+        :returns: the name of the host osd runs on
+        """
+        if self.ceph_manager.ctx is None:
+            return None
+        (remote,) = self.ceph_manager.ctx.cluster.only(
+            'osd.{o}'.format(o=osd)).remotes.iterkeys()
+        return remote.name
+
+    def reap(self):
+        """
+        Forget finished actions, raising the error of any that failed.
+        """
+        for greenlet in [g for g in self.inflight if g.ready()]:
+            self.inflight.remove(greenlet)
+            greenlet.get()
+
+    def drain(self):
+        """
+        Wait for all in-flight actions to finish.
+        """
+        while self.inflight:
+            gevent.joinall(self.inflight)
+            self.reap()
+
+    def schedule_action(self, action):
+        """
+        Start action in the background if it only touches one osd and an
+        osd on an otherwise idle host is available. Anything else waits for
+        the in-flight actions and then runs on its own.
+        """
+        candidates = self.osd_candidates(action)
+        if candidates is None:
+            self.drain()
+            self.run_action(action)
+            return
+        free = [osd for osd in candidates if osd not in self.busy_osds and
+                self.osd_host(osd) not in self.busy_hosts]
+        if not free:
+            self.log('no idle osd for %s, skipping' % action.__name__)
+            return
+        osd = random.choice(free)
+        host = self.osd_host(osd)
+        self.busy_osds.add(osd)
+        self.busy_hosts.add(host)
+
+        def run():
+            try:
+                self.run_action(action, osd)
+            finally:
+                self.busy_osds.discard(osd)
+                self.busy_hosts.discard(host)
+        self.inflight.append(gevent.spawn(run))
+        # let the action update in_osds/live_osds and friends before we
+        # choose the next one
+        gevent.sleep(0)
+
     def do_thrash(self):
         """
         Loop to select random actions to thrash ceph manager with.
@@ -372,6 +536,7 @@ class Thrasher:
                                                 "dead_osds: ", self.dead_osds, "live_osds: ",
                                                 self.live_osds]]))
             if random.uniform(0, 1) < (float(delay) / cleanint):
+                self.drain()
                 while len(self.dead_osds) > maxdead:
                     self.revive_osd()
                 for osd in self.in_osds:
@@ -381,18 +546,464 @@ class Thrasher:
                     self.config.get('chance_test_map_discontinuity', 0)):
                     self.test_map_discontinuity()
                 else:
+                    start = time.time()
                     self.ceph_manager.wait_for_recovery(
                         timeout=self.config.get('timeout')
                         )
+                    self.stats.record_recovery(time.time() - start)
                 time.sleep(self.clean_wait)
                 if scrubint > 0:
                     if random.uniform(0, 1) < (float(delay) / scrubint):
                         self.log('Scrubbing while thrashing being performed')
                         Scrubber(self.ceph_manager, self.config)
-            self.choose_action()()
+            if self.action_concurrency > 1:
+                while len(self.inflight) >= self.action_concurrency:
+                    gevent.joinall(self.inflight, count=1)
+                    self.reap()
+                self.schedule_action(self.choose_action())
+                self.reap()
+            else:
+                self.run_action(self.choose_action())
             time.sleep(delay)
+        self.drain()
         self.all_up()
 
+
+def load_cluster_json(out):
+    """
+    Parse json printed by a ceph command, skipping any status lines
+    (e.g. "dumped all in format json") printed ahead of it.
+    """
+    lines = out.split('\n')
+    while lines and not lines[0].lstrip().startswith(('{', '[')):
+        lines.pop(0)
+    return json.loads('\n'.join(lines))
+
+
+# ceph commands that only report on the cluster; any other command may
+# change it, and so makes cached pg snapshots and osdmaps stale
+READ_ONLY_COMMANDS = [
+    ('status',), ('health',), ('df',), ('report',), ('fsid',), ('version',),
+    ('quorum_status',), ('mon_status',),
+    ('pg', 'dump'), ('pg', 'stat'), ('pg', 'map'), ('pg', 'ls'),
+    ('osd', 'dump'), ('osd', 'stat'), ('osd', 'tree'), ('osd', 'ls'),
+    ('osd', 'getmap'), ('osd', 'getcrushmap'), ('osd', 'map'),
+    ('osd', 'find'), ('osd', 'metadata'), ('osd', 'perf'),
+    ('osd', 'lspools'), ('osd', 'pool', 'get'), ('osd', 'pool', 'ls'),
+    ('osd', 'crush', 'dump'), ('osd', 'erasure-code-profile', 'get'),
+    ('osd', 'erasure-code-profile', 'ls'),
+    ('mon', 'dump'), ('mon', 'stat'), ('mds', 'dump'), ('mds', 'stat'),
+    ('auth', 'list'), ('auth', 'get'), ('auth', 'export'),
+    ('auth', 'get-key'), ('auth', 'print-key'),
+    ]
+
+
+def is_read_only_cmd(args):
+    """
+    :returns: True if the ceph command with arguments args cannot change
+              the cluster
+    """
+    words = tuple(arg for arg in args if not arg.startswith('-'))
+    if not words:
+        # e.g. ceph -s
+        return True
+    if len(words) >= 3 and words[0] == 'pg' and words[2] == 'query':
+        return True
+    return any(words[:len(cmd)] == cmd for cmd in READ_ONLY_COMMANDS)
+
+
+class PGSnapshot(object):
+    """
+    PG state counters for a single point in time, computed in one pass.
+
+    Snapshots come from one of three sources, in decreasing order of cost
+    and detail:
+
+    dump: ``pg dump``; self.pgs holds the full pg_stats entries.
+    brief: ``pg dump pgs_brief``; self.pgs holds pgid, state, up and acting.
+    stat: ``pg stat``; only the counters are available and self.pgs is None.
+    """
+    sources = ('stat', 'brief', 'dump')
+
+    def __init__(self, states, num_pgs=None, pgs=None, source='dump'):
+        """
+        :param states: dict mapping pg state strings (e.g. 'active+clean')
+                       to the number of pgs in that state.
+        :param num_pgs: total number of pgs; defaults to the sum of states.
+        :param pgs: the per-pg entries the counters were computed from.
+        :param source: one of PGSnapshot.sources
+        """
+        self.stamp = time.time()
+        self.states = states
+        self.pgs = pgs
+        self.source = source
+        # whether recovery i/o was reported; None if the source doesn't say
+        self.recovering = None
+        self._by_pgid = None
+        if num_pgs is None:
+            num_pgs = sum(states.itervalues())
+        self.num_pgs = num_pgs
+        self.num_creating = 0
+        self.num_active = 0
+        self.num_active_clean = 0
+        self.num_active_recovered = 0
+        self.num_down = 0
+        self.num_active_down = 0
+        for state, count in states.iteritems():
+            if 'creating' in state:
+                self.num_creating += count
+            if 'stale' in state:
+                continue
+            active = 'active' in state
+            down = 'down' in state or 'incomplete' in state
+            if active:
+                self.num_active += count
+                if 'clean' in state:
+                    self.num_active_clean += count
+                if 'recover' not in state and 'backfill' not in state:
+                    self.num_active_recovered += count
+            if down:
+                self.num_down += count
+            if active or down:
+                self.num_active_down += count
+
+    @classmethod
+    def from_pgs(cls, pgs, source='dump'):
+        """
+        Build a snapshot from a list of pg_stats (or pgs_brief) entries.
+        """
+        states = {}
+        for pg in pgs:
+            states[pg['state']] = states.get(pg['state'], 0) + 1
+        return cls(states, num_pgs=len(pgs), pgs=pgs, source=source)
+
+    @classmethod
+    def from_stat(cls, stat):
+        """
+        Build a snapshot from the output of ``pg stat --format=json``.
+        """
+        stat = stat.get('pg_summary', stat)
+        states = {}
+        for entry in stat.get('num_pg_by_state', []):
+            states[entry['name']] = entry['num']
+        return cls(states, num_pgs=stat.get('num_pgs'), source='stat')
+
+    @classmethod
+    def from_status(cls, status):
+        """
+        Build a snapshot, including whether recovery is making progress,
+        from the output of ``status --format=json``.
+        """
+        pgmap = status['pgmap']
+        states = {}
+        for entry in pgmap.get('pgs_by_state', []):
+            states[entry['state_name']] = entry['count']
+        snap = cls(states, num_pgs=pgmap.get('num_pgs'), source='stat')
+        snap.recovering = any(
+            pgmap.get('recovering_%s_per_sec' % what, 0) > 0
+            for what in ('keys', 'bytes', 'objects'))
+        return snap
+
+    def age(self):
+        """
+        Seconds since this snapshot was taken.
+        """
+        return time.time() - self.stamp
+
+    def covers(self, source):
+        """
+        True if this snapshot holds at least as much detail as a snapshot
+        taken from source would.
+        """
+        return self.sources.index(self.source) >= self.sources.index(source)
+
+    @property
+    def is_clean(self):
+        return self.num_active_clean == self.num_pgs
+
+    @property
+    def is_recovered(self):
+        return self.num_active_recovered == self.num_pgs
+
+    @property
+    def is_active(self):
+        return self.num_active == self.num_pgs
+
+    @property
+    def is_active_or_down(self):
+        return self.num_active_down == self.num_pgs
+
+    def histogram(self):
+        """
+        Return the number of pgs in each individual state, e.g.
+        {'active': 10, 'clean': 8, 'degraded': 2}
+        """
+        ret = {}
+        for state, count in self.states.iteritems():
+            for status in state.split('+'):
+                ret[status] = ret.get(status, 0) + count
+        return ret
+
+    def delta(self, prev):
+        """
+        :param prev: an earlier snapshot
+        :returns: a dict mapping each pg state whose count changed since prev
+                  to its (old, new) counts.
+        """
+        ret = {}
+        for state in set(self.states) | set(prev.states):
+            old = prev.states.get(state, 0)
+            new = self.states.get(state, 0)
+            if old != new:
+                ret[state] = (old, new)
+        return ret
+
+    def get_pg(self, pgid):
+        """
+        :returns: the entry for pgid, or None if there is no such pg. The
+                  pgid index is built on first use.
+        """
+        assert self.pgs is not None, \
+            'a %s snapshot has no per-pg entries' % self.source
+        if self._by_pgid is None:
+            self._by_pgid = dict((pg['pgid'], pg) for pg in self.pgs)
+        return self._by_pgid.get(pgid)
+
+
+class OSDMap(object):
+    """
+    One epoch of the osdmap, as reported by ``ceph osd dump``, indexed by
+    pool name, pool id and osd id.
+    """
+    # pool properties whose osd dump field differs from the 'osd pool get'
+    # name
+    pool_fields = {
+        'pgp_num': 'pg_placement_num',
+        }
+
+    def __init__(self, dump):
+        """
+        :param dump: decoded ``ceph osd dump --format=json`` output
+        """
+        self.dump = dump
+        self.epoch = int(dump['epoch'])
+        self.pools = dict((str(pool['pool_name']), pool)
+                          for pool in dump['pools'])
+        self.pools_by_id = dict((int(pool['pool']), pool)
+                                for pool in dump['pools'])
+        self.osds = dict((int(osd['osd']), osd) for osd in dump['osds'])
+
+    def pool_names(self):
+        """
+        :returns: pool names, in pool id order
+        """
+        return [str(self.pools_by_id[id_]['pool_name'])
+                for id_ in sorted(self.pools_by_id)]
+
+    def pool_num(self, name):
+        """
+        :returns: the id of the named pool
+        """
+        return int(self.pools[name]['pool'])
+
+    def pool_property(self, name, prop):
+        """
+        :returns: prop of the named pool as an int, or None if the osd dump
+                  does not include it
+        """
+        value = self.pools[name].get(self.pool_fields.get(prop, prop))
+        if value is None:
+            return None
+        return int(value)
+
+    def osd_ids(self, up=None, in_=None):
+        """
+        :param up: if not None, only osds that are (or are not) up
+        :param in_: if not None, only osds that are (or are not) in
+        :returns: sorted osd ids
+        """
+        ret = []
+        for id_ in sorted(self.osds):
+            osd = self.osds[id_]
+            if up is not None and bool(osd['up'] > 0) != up:
+                continue
+            if in_ is not None and bool(osd['in'] > 0) != in_:
+                continue
+            ret.append(id_)
+        return ret
+
+    def osd_is_up(self, osd):
+        """
+        True if the osd exists and is up.
+        """
+        return osd in self.osds and self.osds[osd]['up'] > 0
+
+
+class ClusterEvents(object):
+    """
+    Follow the cluster log (``ceph -w``) and daemon exits, so callers can
+    block until something changes instead of polling the monitors.
+
+    The PG state counters come from the pgmap lines in the log. OSD up/down
+    state comes from the manager's `OSDMap`, which is only refetched when
+    the log reports a new osdmap epoch. If the log goes quiet for refresh_interval seconds while
+    someone is waiting, the PG state is queried directly, so waiters make
+    progress even if the monitors stop logging pgmap updates.
+    """
+    pgmap_re = re.compile(r'pgmap v(\d+): (\d+) pgs: (.*?); ')
+    osdmap_re = re.compile(r'osdmap e(\d+):')
+    boot_re = re.compile(r'\b(osd\.\d+) \S+ boot\b')
+
+    def __init__(self, manager, refresh_interval=30):
+        """
+        :param manager: the CephManager to run ceph commands with
+        :param refresh_interval: seconds to wait for news before querying
+                                 the cluster directly
+        """
+        self.manager = manager
+        self.refresh_interval = refresh_interval
+        self.pgs = None
+        self.recovering = None
+        self.osdmap_epoch = None
+        self.booted = set()
+        self.exited = set()
+        self._event = gevent.event.Event()
+        self._last_event = time.time()
+        self.proc = None
+        self.reader = None
+
+    def start(self):
+        """
+        Start following the cluster log and daemon exits.
+        """
+        testdir = teuthology.get_testdir(self.manager.ctx)
+        self.proc = self.manager.controller.run(
+            args=[
+                'adjust-ulimits',
+                'ceph-coverage',
+                '{tdir}/archive/coverage'.format(tdir=testdir),
+                'daemon-helper',
+                'kill',
+                'ceph',
+                '-w',
+                ],
+            stdin=run.PIPE,
+            stdout=run.PIPE,
+            wait=False,
+            )
+        self.reader = gevent.spawn(self._read, self.proc.stdout)
+        daemons = getattr(self.manager.ctx, 'daemons', None)
+        if daemons is not None:
+            daemons.add_listener(self.daemon_event)
+        return self
+
+    def stop(self):
+        """
+        Stop following the cluster log.
+        """
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.reader.kill()
+            self.proc = None
+
+    def _read(self, stdout):
+        while True:
+            line = stdout.readline()
+            if not line:
+                break
+            self.handle_line(line)
+
+    def _notify(self):
+        self._last_event = time.time()
+        event, self._event = self._event, gevent.event.Event()
+        event.set()
+
+    def handle_line(self, line):
+        """
+        Update our view of the cluster from one line of ``ceph -w`` output.
+        """
+        match = self.pgmap_re.search(line)
+        if match:
+            states = {}
+            for part in match.group(3).split(', '):
+                count, _, state = part.partition(' ')
+                if count.isdigit():
+                    states[state] = int(count)
+            self.pgs = PGSnapshot(states, num_pgs=int(match.group(2)),
+                                  source='stat')
+            self.pgs.recovering = 'recovering' in line[match.end():]
+            self.recovering = self.pgs.recovering
+        match = self.osdmap_re.search(line)
+        if match:
+            self.osdmap_epoch = int(match.group(1))
+        match = self.boot_re.search(line)
+        if match:
+            self.booted.add(match.group(1))
+        self._notify()
+
+    def daemon_event(self, daemon, event):
+        """
+        `CephState` listener: track which daemons have exited.
+        """
+        name = '{role}.{id}'.format(role=daemon.role, id=daemon.id_)
+        if event == 'started':
+            self.exited.discard(name)
+            self.booted.discard(name)
+        else:
+            self.exited.add(name)
+        self._notify()
+
+    def refresh(self):
+        """
+        Query the PG state directly, and stop trusting our osdmap epoch.
+        """
+        self.pgs = self.manager.get_pg_progress()
+        self.recovering = self.pgs.recovering
+        self.manager.invalidate_osdmap()
+        self._notify()
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Block until predicate() is true, re-checking it whenever the cluster
+        log or a daemon reports a change.
+
+        :returns: True, or False if timeout seconds passed first
+        """
+        start = time.time()
+        while True:
+            event = self._event
+            if predicate():
+                return True
+            wait = self.refresh_interval
+            if timeout is not None:
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            if not event.wait(wait) and \
+                    time.time() - self._last_event >= self.refresh_interval:
+                self.refresh()
+
+    def next_pgs(self, prev, timeout):
+        """
+        Wait up to timeout seconds for the PG state to differ from prev.
+
+        :returns: the latest `PGSnapshot`
+        """
+        if self.pgs is None:
+            self.refresh()
+        self.wait_for(lambda: self.pgs is not prev and self.pgs.delta(prev),
+                      timeout=timeout)
+        return self.pgs
+
+    def osd_is_up(self, osd):
+        """
+        True if osd is up in the latest osdmap.
+        """
+        osdmap = self.manager.get_osdmap(min_epoch=self.osdmap_epoch)
+        return osdmap.osd_is_up(osd)
+
+
 class CephManager:
     """
     Ceph manager object.
@@ -415,10 +1026,30 @@ class CephManager:
             self.log = tmp
         if self.config is None:
             self.config = dict()
-        pools = self.list_pools()
+        self.pg_snapshot_ttl = float(self.config.get('pg_snapshot_ttl', 2))
+        self.pg_snapshot_source = self.config.get('pg_snapshot_source', 'dump')
+        self.pg_poll_min = float(self.config.get('pg_poll_min', 1))
+        self.pg_poll_max = float(self.config.get('pg_poll_max', 5))
+        assert self.pg_snapshot_source in PGSnapshot.sources, \
+            'pg_snapshot_source must be one of %s' % (PGSnapshot.sources,)
+        self._pg_snapshot = None
+        self._osdmap = None
+        self._osdmap_stale = False
+        self.events = None
+        if self.config.get('event_stream'):
+            self.events = ClusterEvents(self).start()
+        osdmap = self.get_osdmap()
         self.pools = {}
-        for pool in pools:
-            self.pools[pool] = self.get_pool_property(pool, 'pg_num')
+        for pool in osdmap.pool_names():
+            self.pools[pool] = osdmap.pool_property(pool, 'pg_num')
+
+    def stop_events(self):
+        """
+        Stop following the cluster log, if we were.
+        """
+        if self.events is not None:
+            self.events.stop()
+            self.events = None
 
     def raw_cluster_cmd(self, *args):
         """
@@ -432,10 +1063,13 @@ class CephManager:
                 'ceph',
                 ]
         ceph_args.extend(args)
-        proc = self.controller.run(
-            args=ceph_args,
-            stdout=StringIO(),
-            )
+        try:
+            proc = self.controller.run(
+                args=ceph_args,
+                stdout=StringIO(),
+                )
+        finally:
+            self._cluster_cmd_done(args)
         return proc.stdout.getvalue()
 
     def raw_cluster_cmd_result(self, *args):
@@ -454,8 +1088,19 @@ class CephManager:
             args=ceph_args,
             check_status=False,
             )
+        self._cluster_cmd_done(args)
         return proc.exitstatus
 
+    def _cluster_cmd_done(self, args):
+        """
+        Forget cached cluster state that the ceph command with arguments
+        args may have changed, e.g. 'osd out' or 'osd lost' run by a task
+        directly.
+        """
+        if not is_read_only_cmd(args):
+            self.invalidate_pg_snapshot()
+            self.invalidate_osdmap()
+
     def do_rados(self, remote, cmd):
         """
         Execute a remote rados command.
@@ -560,49 +1205,42 @@ class CephManager:
             pgnum=pgnum)
         return pg_str
 
+    def get_pg_acting(self, pool, pgnum):
+        """
+        get the acting set for pool, pgnum, as it is now; callers use it to
+        pick an osd to act on, so no cached pg state is used
+        """
+        out = self.raw_cluster_cmd('pg', 'map', self.get_pgid(pool, pgnum),
+                                   '--format=json')
+        return [int(osd) for osd in load_cluster_json(out)['acting']]
+
     def get_pg_replica(self, pool, pgnum):
         """
         get replica for pool, pgnum (e.g. (data, 0)->0
         """
-        output = self.raw_cluster_cmd("pg", "dump", '--format=json')
-        j = json.loads('\n'.join(output.split('\n')[1:]))
-        pg_str = self.get_pgid(pool, pgnum)
-        for pg in j['pg_stats']:
-            if pg['pgid'] == pg_str:
-                return int(pg['acting'][-1])
-        assert False
+        return self.get_pg_acting(pool, pgnum)[-1]
 
     def get_pg_primary(self, pool, pgnum):
         """
         get primary for pool, pgnum (e.g. (data, 0)->0
         """
-        output = self.raw_cluster_cmd("pg", "dump", '--format=json')
-        j = json.loads('\n'.join(output.split('\n')[1:]))
-        pg_str = self.get_pgid(pool, pgnum)
-        for pg in j['pg_stats']:
-            if pg['pgid'] == pg_str:
-                return int(pg['acting'][0])
-        assert False
+        return self.get_pg_acting(pool, pgnum)[0]
 
     def get_pool_num(self, pool):
         """
         get number for pool (e.g., data -> 2)
         """
-        out = self.raw_cluster_cmd('osd', 'dump', '--format=json')
-        j = json.loads('\n'.join(out.split('\n')[1:]))
-        for i in j['pools']:
-            if i['pool_name'] == pool:
-                return int(i['pool'])
-        assert False
+        osdmap = self.get_osdmap()
+        assert pool in osdmap.pools
+        return osdmap.pool_num(pool)
 
     def list_pools(self):
         """
         list all pool names
         """
-        out = self.raw_cluster_cmd('osd', 'dump', '--format=json')
-        j = json.loads('\n'.join(out.split('\n')[1:]))
-        self.log(j['pools'])
-        return [str(i['pool_name']) for i in j['pools']]
+        pools = self.get_osdmap().pool_names()
+        self.log(pools)
+        return pools
 
     def clear_pools(self):
         """
@@ -625,7 +1263,9 @@ class CephManager:
         If osd_admin_socket call suceeds, return.  Otherwise wait
         five seconds and try again.
         """
-        tries = 0
+        start = time.time()
+        name = 'osd.{o}'.format(o=osdnum)
+        booted = False
         while True:
             proc = self.osd_admin_socket(
                 osdnum, args,
@@ -633,14 +1273,24 @@ class CephManager:
             if proc.exitstatus is 0:
                 break
             else:
-                tries += 1
-                if (tries * 5) > timeout:
+                if time.time() - start > timeout:
                     raise Exception('timed out waiting for admin_socket to appear after osd.{o} restart'.format(o=osdnum))
                 self.log(
                     "waiting on admin_socket for {osdnum}, {command}".format(
                         osdnum=osdnum,
                         command=args))
-                time.sleep(5)
+                if self.events is None:
+                    time.sleep(5)
+                    continue
+                # wake up early once the osd boots (or dies)
+                events = self.events
+                events.wait_for(
+                    lambda: name in events.exited or
+                    (not booted and name in events.booted),
+                    timeout=5)
+                if name in events.exited:
+                    raise Exception('{name} exited while waiting for its admin_socket'.format(name=name))
+                booted = name in events.booted
 
     def set_config(self, osdnum, **argdict):
         """
@@ -669,37 +1319,26 @@ class CephManager:
         """
         Get osd statuses sorted by states that the osds are in.
         """
-        osd_lines = filter(
-            lambda x: x.startswith('osd.') and (("up" in x) or ("down" in x)),
-            self.raw_osd_status().split('\n'))
-        self.log(osd_lines)
-        in_osds = [int(i[4:].split()[0]) for i in filter(
-                lambda x: " in " in x,
-                osd_lines)]
-        out_osds = [int(i[4:].split()[0]) for i in filter(
-                lambda x: " out " in x,
-                osd_lines)]
-        up_osds = [int(i[4:].split()[0]) for i in filter(
-                lambda x: " up " in x,
-                osd_lines)]
-        down_osds = [int(i[4:].split()[0]) for i in filter(
-                lambda x: " down " in x,
-                osd_lines)]
+        osdmap = self.get_osdmap()
+        osds = [osdmap.osds[i] for i in sorted(osdmap.osds)]
+        self.log(osds)
+        in_osds = osdmap.osd_ids(in_=True)
+        out_osds = osdmap.osd_ids(in_=False)
+        up_osds = osdmap.osd_ids(up=True)
+        down_osds = osdmap.osd_ids(up=False)
         dead_osds = [int(x.id_) for x in
                      filter(lambda x: not x.running(), self.ctx.daemons.iter_daemons_of_role('osd'))]
         live_osds = [int(x.id_) for x in
                      filter(lambda x: x.running(), self.ctx.daemons.iter_daemons_of_role('osd'))]
         return { 'in' : in_osds, 'out' : out_osds, 'up' : up_osds,
                  'down' : down_osds, 'dead' : dead_osds, 'live' : live_osds,
-                 'raw' : osd_lines}
+                 'raw' : osds}
 
     def get_num_pgs(self):
         """
-        Check cluster status for the number of pgs
+        Find the number of pgs.
         """
-        status = self.raw_cluster_status()
-        self.log(status)
-        return status['pgmap']['num_pgs']
+        return self.get_pg_snapshot().num_pgs
 
     def create_erasure_code_profile(self, name, **kwargs):
         """
@@ -741,6 +1380,8 @@ class CephManager:
             else:
                 self.raw_cluster_cmd('osd', 'pool', 'create', pool_name, str(pg_num))
             self.pools[pool_name] = pg_num
+            self.invalidate_pg_snapshot()
+            self.invalidate_osdmap()
 
     def remove_pool(self, pool_name):
         """
@@ -756,6 +1397,8 @@ class CephManager:
                 self.controller,
                 ['rmpool', pool_name, pool_name, "--yes-i-really-really-mean-it"]
                 )
+            self.invalidate_pg_snapshot()
+            self.invalidate_osdmap()
 
     def get_pool(self):
         """
@@ -783,6 +1426,9 @@ class CephManager:
         with self.lock:
             assert isinstance(pool_name, str)
             assert isinstance(prop, str)
+            value = self.get_osdmap().pool_property(pool_name, prop)
+            if value is not None:
+                return value
             output = self.raw_cluster_cmd(
                 'osd',
                 'pool',
@@ -813,6 +1459,8 @@ class CephManager:
                     prop,
                     str(val))
                 if r != 11: # EAGAIN
+                    self.invalidate_pg_snapshot()
+                    self.invalidate_osdmap()
                     break
                 tries += 1
                 if tries > 50:
@@ -871,50 +1519,123 @@ class CephManager:
             del r['more']
         return r
 
+    def get_pg_snapshot(self, max_age=None, source=None):
+        """
+        Return a PGSnapshot, reusing the last one taken if it is recent
+        enough and detailed enough.
+
+        :param max_age: oldest acceptable snapshot, in seconds. Defaults to
+                        the pg_snapshot_ttl config option (2); 0 forces a
+                        fresh query.
+        :param source: least detailed acceptable source (see PGSnapshot).
+                       Defaults to the pg_snapshot_source config option
+                       ('dump').
+        """
+        if max_age is None:
+            max_age = self.pg_snapshot_ttl
+        if source is None:
+            source = self.pg_snapshot_source
+        snap = self._pg_snapshot
+        if snap is not None and snap.age() < max_age and snap.covers(source):
+            return snap
+        if source == 'stat':
+            out = self.raw_cluster_cmd('pg', 'stat', '--format=json')
+            snap = PGSnapshot.from_stat(load_cluster_json(out))
+        elif source == 'brief':
+            out = self.raw_cluster_cmd('pg', 'dump', 'pgs_brief',
+                                       '--format=json')
+            j = load_cluster_json(out)
+            if isinstance(j, dict):
+                j = j['pg_stats']
+            snap = PGSnapshot.from_pgs(j, source='brief')
+        else:
+            out = self.raw_cluster_cmd('pg', 'dump', '--format=json')
+            j = load_cluster_json(out)
+            snap = PGSnapshot.from_pgs(j['pg_stats'], source='dump')
+        self._pg_snapshot = snap
+        return snap
+
+    def get_pg_progress(self):
+        """
+        Return a PGSnapshot of the pg state counters and whether recovery
+        is making progress, from a single ``status`` query.
+        """
+        snap = PGSnapshot.from_status(self.raw_cluster_status())
+        if self._pg_snapshot is None or self._pg_snapshot.source == 'stat':
+            self._pg_snapshot = snap
+        return snap
+
+    def invalidate_pg_snapshot(self):
+        """
+        Forget the cached PGSnapshot, so that the next query sees the
+        effects of a change we just made to the cluster.
+        """
+        self._pg_snapshot = None
+
+    def get_osdmap(self, min_epoch=None):
+        """
+        Return the current OSDMap, reusing the last one fetched unless the
+        osdmap epoch has moved on.
+
+        :param min_epoch: the caller knows the map has reached this epoch
+                          (e.g. from the cluster log), so there is no need
+                          to ask the monitors for it.
+        """
+        osdmap = self._osdmap
+        if osdmap is not None:
+            epoch = min_epoch
+            if epoch is None and self.events is not None:
+                epoch = self.events.osdmap_epoch
+            if epoch is None or self._osdmap_stale:
+                out = self.raw_cluster_cmd('osd', 'stat', '--format=json')
+                epoch = int(load_cluster_json(out)['epoch'])
+                self._osdmap_stale = False
+            if epoch <= osdmap.epoch:
+                return osdmap
+        out = self.raw_cluster_cmd('osd', 'dump', '--format=json')
+        self._osdmap = OSDMap(load_cluster_json(out))
+        self._osdmap_stale = False
+        return self._osdmap
+
+    def invalidate_osdmap(self):
+        """
+        Make the next get_osdmap() check the epoch with the monitors, so
+        that it sees the effects of a change we just made to the cluster.
+        """
+        self._osdmap_stale = True
+
     def get_pg_stats(self):
         """
         Dump the cluster and get pg stats
         """
-        out = self.raw_cluster_cmd('pg', 'dump', '--format=json')
-        j = json.loads('\n'.join(out.split('\n')[1:]))
-        return j['pg_stats']
+        return self.get_pg_snapshot(max_age=0, source='dump').pgs
 
     def compile_pg_status(self):
         """
         Return a histogram of pg state values
         """
-        ret = {}
-        j = self.get_pg_stats()
-        for pg in j:
-            for status in pg['state'].split('+'):
-                if status not in ret:
-                    ret[status] = 0
-                ret[status] += 1
-        return ret
+        return self.get_pg_snapshot().histogram()
 
     def pg_scrubbing(self, pool, pgnum):
         """
         pg scrubbing wrapper
         """
         pgstr = self.get_pgid(pool, pgnum)
-        stats = self.get_single_pg_stats(pgstr)
-        return 'scrub' in stats['state']
+        return 'scrub' in self.query_pg(pgstr)['state']
 
     def pg_repairing(self, pool, pgnum):
         """
         pg repairing wrapper
         """
         pgstr = self.get_pgid(pool, pgnum)
-        stats = self.get_single_pg_stats(pgstr)
-        return 'repair' in stats['state']
+        return 'repair' in self.query_pg(pgstr)['state']
 
     def pg_inconsistent(self, pool, pgnum):
         """
         pg inconsistent wrapper
         """
         pgstr = self.get_pgid(pool, pgnum)
-        stats = self.get_single_pg_stats(pgstr)
-        return 'inconsistent' in stats['state']
+        return 'inconsistent' in self.query_pg(pgstr)['state']
 
     def get_last_scrub_stamp(self, pool, pgnum):
         """
@@ -927,32 +1648,35 @@ class CephManager:
         """
         Scrub pg and wait for scrubbing to finish
         """
-        init = self.get_last_scrub_stamp(pool, pgnum)
-        self.raw_cluster_cmd('pg', stype, self.get_pgid(pool, pgnum))
-        while init == self.get_last_scrub_stamp(pool, pgnum):
+        # ask the pg itself rather than dumping every pg in the cluster on
+        # each poll
+        pgid = self.get_pgid(pool, pgnum)
+        init = self.query_pg(pgid)['info']['stats']['last_scrub_stamp']
+        self.raw_cluster_cmd('pg', stype, pgid)
+        while init == self.query_pg(pgid)['info']['stats']['last_scrub_stamp']:
             self.log("waiting for scrub type %s"%(stype,))
             time.sleep(10)
 
+    def query_pg(self, pgid):
+        """
+        Return the output of ``ceph pg <pgid> query``. This is answered by
+        the pg's primary, so it only works for pgs that are up.
+        """
+        out = self.raw_cluster_cmd('pg', pgid, 'query')
+        return load_cluster_json(out)
+
     def get_single_pg_stats(self, pgid):
         """
         Return pg for the pgid specified.
         """
-        all_stats = self.get_pg_stats()
-
-        for pg in all_stats:
-            if pg['pgid'] == pgid:
-                return pg
-
-        return None
+        return self.get_pg_snapshot(max_age=0, source='dump').get_pg(pgid)
 
     def get_osd_dump(self):
         """
         Dump osds
         :returns: all osds
         """
-        out = self.raw_cluster_cmd('osd', 'dump', '--format=json')
-        j = json.loads('\n'.join(out.split('\n')[1:]))
-        return j['osds']
+        return self.get_osdmap().dump['osds']
 
     def get_stuck_pgs(self, type_, threshold):
         """
@@ -974,122 +1698,168 @@ class CephManager:
         """
         Find the number of pgs in creating mode.
         """
-        pgs = self.get_pg_stats()
-        num = 0
-        for pg in pgs:
-            if 'creating' in pg['state']:
-                num += 1
-        return num
+        return self.get_pg_snapshot().num_creating
 
     def get_num_active_clean(self):
         """
         Find the number of active and clean pgs.
         """
-        pgs = self.get_pg_stats()
-        num = 0
-        for pg in pgs:
-            if pg['state'].count('active') and pg['state'].count('clean') and not pg['state'].count('stale'):
-                num += 1
-        return num
+        return self.get_pg_snapshot().num_active_clean
 
     def get_num_active_recovered(self):
         """
         Find the number of active and recovered pgs.
         """
-        pgs = self.get_pg_stats()
-        num = 0
-        for pg in pgs:
-            if pg['state'].count('active') and not pg['state'].count('recover') and not pg['state'].count('backfill') and not pg['state'].count('stale'):
-                num += 1
-        return num
+        return self.get_pg_snapshot().num_active_recovered
 
     def get_is_making_recovery_progress(self):
         """
         Return whether there is recovery progress discernable in the
         raw cluster status
         """
-        status = self.raw_cluster_status()
-        kps = status['pgmap'].get('recovering_keys_per_sec', 0)
-        bps = status['pgmap'].get('recovering_bytes_per_sec', 0)
-        ops = status['pgmap'].get('recovering_objects_per_sec', 0)
-        return kps > 0 or bps > 0 or ops > 0
+        if self.events is not None and self.events.recovering is not None:
+            return self.events.recovering
+        return self.get_pg_progress().recovering
 
     def get_num_active(self):
         """
         Find the number of active pgs.
         """
-        pgs = self.get_pg_stats()
-        num = 0
-        for pg in pgs:
-            if pg['state'].count('active') and not pg['state'].count('stale'):
-                num += 1
-        return num
+        return self.get_pg_snapshot().num_active
 
     def get_num_down(self):
         """
         Find the number of pgs that are down.
         """
-        pgs = self.get_pg_stats()
-        num = 0
-        for pg in pgs:
-            if (pg['state'].count('down') and not pg['state'].count('stale')) or \
-                    (pg['state'].count('incomplete') and not pg['state'].count('stale')):
-                num += 1
-        return num
+        return self.get_pg_snapshot().num_down
 
     def get_num_active_down(self):
         """
         Find the number of pgs that are either active or down.
         """
-        pgs = self.get_pg_stats()
-        num = 0
-        for pg in pgs:
-            if (pg['state'].count('active') and not pg['state'].count('stale')) or \
-                    (pg['state'].count('down') and not pg['state'].count('stale')) or \
-                    (pg['state'].count('incomplete') and not pg['state'].count('stale')):
-                num += 1
-        return num
+        return self.get_pg_snapshot().num_active_down
 
     def is_clean(self):
         """
         True if all pgs are clean
         """
-        return self.get_num_active_clean() == self.get_num_pgs()
+        return self.get_pg_snapshot().is_clean
 
     def is_recovered(self):
         """
         True if all pgs have recovered
         """
-        return self.get_num_active_recovered() == self.get_num_pgs()
+        return self.get_pg_snapshot().is_recovered
 
     def is_active_or_down(self):
         """
         True if all pgs are active or down
         """
-        return self.get_num_active_down() == self.get_num_pgs()
+        return self.get_pg_snapshot().is_active_or_down
 
-    def wait_for_clean(self, timeout=None):
+    def _poll_pg_snapshot(self, prev):
         """
-        Returns trues when all pgs are clean.
+        Wait a poll interval (or, when following the cluster log, until pg
+        states change), take a new snapshot and log how pg states changed
+        since prev.
         """
-        self.log("waiting for clean")
-        start = time.time()
-        num_active_clean = self.get_num_active_clean()
-        while not self.is_clean():
+        if self.events is not None:
+            snap = self.events.next_pgs(prev,
+                                        timeout=self.events.refresh_interval)
+        else:
+            time.sleep(3)
+            snap = self.get_pg_snapshot()
+        delta = snap.delta(prev)
+        if delta:
+            self.log('pg states changed: %s' % ', '.join(
+                '%s %d -> %d' % (state, old, new)
+                for state, (old, new) in sorted(delta.iteritems())))
+        return snap
+
+    def _wait_for_pgs(self, what, done, progress, failure, timeout=None):
+        """
+        Wait until done(snap) is true of a PGSnapshot, polling with one
+        ``status`` query per tick. The poll interval shrinks (down to
+        pg_poll_min seconds) while the pg states are changing and backs off
+        (up to pg_poll_max) while they are not, and is capped at half the
+        estimated time left, extrapolated from how fast progress(snap) has
+        been rising towards num_pgs. The pg state counts seen at each tick
+        are appended to pg_states.yaml in the archive.
+
+        :param what: description of what we are waiting for, for logging
+        :param done: predicate on a PGSnapshot
+        :param progress: the counter in a PGSnapshot that is expected to
+                         reach num_pgs
+        :param failure: assertion message if we time out
+        :param timeout: fail if the pg states have not changed and recovery
+                        has not been making progress for this many seconds
+        """
+        self.log("waiting for %s" % what)
+        begin = start = time.time()
+        interval = self.pg_poll_min
+        snap = self.get_pg_progress()
+        series = [(0.0, snap.states)]
+        while not done(snap):
             if timeout is not None:
-                if self.get_is_making_recovery_progress():
+                if snap.recovering:
                     self.log("making progress, resetting timeout")
                     start = time.time()
                 else:
                     self.log("no progress seen, keeping timeout for now")
-                    assert time.time() - start < timeout, \
-                        'failed to become clean before timeout expired'
-            cur_active_clean = self.get_num_active_clean()
-            if cur_active_clean != num_active_clean:
+                    assert time.time() - start < timeout, failure
+            if self.events is not None:
+                prev, snap = snap, self.events.next_pgs(snap,
+                                                        timeout=interval)
+            else:
+                time.sleep(interval)
+                prev, snap = snap, self.get_pg_progress()
+            series.append((snap.stamp - begin, snap.states))
+            delta = snap.delta(prev)
+            if delta:
+                self.log('pg states changed: %s' % ', '.join(
+                    '%s %d -> %d' % (state, old, new)
+                    for state, (old, new) in sorted(delta.iteritems())))
+                interval = max(self.pg_poll_min, interval / 2)
                 start = time.time()
-                num_active_clean = cur_active_clean
-            time.sleep(3)
-        self.log("clean!")
+            else:
+                interval = min(self.pg_poll_max, interval * 1.5)
+            gained = progress(snap) - progress(prev)
+            if gained > 0 and snap.stamp > prev.stamp:
+                rate = gained / (snap.stamp - prev.stamp)
+                eta = (snap.num_pgs - progress(snap)) / rate
+                self.log('%d/%d pgs done, about %ds to go' %
+                         (progress(snap), snap.num_pgs, eta))
+                interval = max(self.pg_poll_min, min(interval, eta / 2))
+        self.log("done waiting for %s" % what)
+        self._archive_pg_series(what, begin, series)
+
+    def _archive_pg_series(self, what, begin, series):
+        """
+        Append the pg state counts seen while waiting for what to
+        pg_states.yaml in the archive, one yaml document per wait.
+        """
+        archive = getattr(self.ctx, 'archive', None)
+        if archive is None:
+            return
+        doc = dict(
+            wait=what,
+            start=begin,
+            duration=time.time() - begin,
+            samples=[dict(t=round(t, 3), states=states)
+                     for t, states in series],
+            )
+        with file(os.path.join(archive, 'pg_states.yaml'), 'a') as f:
+            f.write('---\n')
+            yaml.safe_dump(doc, f, default_flow_style=False)
+
+    def wait_for_clean(self, timeout=None):
+        """
+        Returns trues when all pgs are clean.
+        """
+        self._wait_for_pgs('clean', lambda snap: snap.is_clean,
+                           lambda snap: snap.num_active_clean,
+                           'failed to become clean before timeout expired',
+                           timeout)
 
     def are_all_osds_up(self):
         """
@@ -1117,24 +1887,10 @@ class CephManager:
         """
         Check peering. When this exists, we have recovered.
         """
-        self.log("waiting for recovery to complete")
-        start = time.time()
-        num_active_recovered = self.get_num_active_recovered()
-        while not self.is_recovered():
-            if timeout is not None:
-                if self.get_is_making_recovery_progress():
-                    self.log("making progress, resetting timeout")
-                    start = time.time()
-                else:
-                    self.log("no progress seen, keeping timeout for now")
-                    assert time.time() - start < timeout, \
-                        'failed to recover before timeout expired'
-            cur_active_recovered = self.get_num_active_recovered()
-            if cur_active_recovered != num_active_recovered:
-                start = time.time()
-                num_active_recovered = cur_active_recovered
-            time.sleep(3)
-        self.log("recovered!")
+        self._wait_for_pgs('recovery', lambda snap: snap.is_recovered,
+                           lambda snap: snap.num_active_recovered,
+                           'failed to recover before timeout expired',
+                           timeout)
 
     def wait_for_active(self, timeout=None):
         """
@@ -1142,16 +1898,14 @@ class CephManager:
         """
         self.log("waiting for peering to complete")
         start = time.time()
-        num_active = self.get_num_active()
-        while not self.is_active():
+        snap = self.get_pg_snapshot()
+        while not snap.is_active:
             if timeout is not None:
                 assert time.time() - start < timeout, \
                     'failed to recover before timeout expired'
-            cur_active = self.get_num_active()
-            if cur_active != num_active:
+            prev, snap = snap, self._poll_pg_snapshot(snap)
+            if snap.num_active != prev.num_active:
                 start = time.time()
-                num_active = cur_active
-            time.sleep(3)
         self.log("active!")
 
     def wait_for_active_or_down(self, timeout=None):
@@ -1161,30 +1915,38 @@ class CephManager:
         """
         self.log("waiting for peering to complete or become blocked")
         start = time.time()
-        num_active_down = self.get_num_active_down()
-        while not self.is_active_or_down():
+        snap = self.get_pg_snapshot()
+        while not snap.is_active_or_down:
             if timeout is not None:
                 assert time.time() - start < timeout, \
                     'failed to recover before timeout expired'
-            cur_active_down = self.get_num_active_down()
-            if cur_active_down != num_active_down:
+            prev, snap = snap, self._poll_pg_snapshot(snap)
+            if snap.num_active_down != prev.num_active_down:
                 start = time.time()
-                num_active_down = cur_active_down
-            time.sleep(3)
         self.log("active or down!")
 
     def osd_is_up(self, osd):
         """
         Wrapper for osd check
         """
-        osds = self.get_osd_dump()
-        return osds[osd]['up'] > 0
+        return self.get_osdmap().osd_is_up(osd)
 
     def wait_till_osd_is_up(self, osd, timeout=None):
         """
         Loop waiting for osd.
         """
         self.log('waiting for osd.%d to be up' % osd)
+        if self.events is not None:
+            name = 'osd.%d' % osd
+            up = self.events.wait_for(
+                lambda: name in self.events.exited or
+                self.events.osd_is_up(osd),
+                timeout=timeout)
+            assert name not in self.events.exited, \
+                'osd.%d exited before coming up' % osd
+            assert up, 'osd.%d failed to come up before timeout expired' % osd
+            self.log('osd.%d is up' % osd)
+            return
         start = time.time()
         while not self.osd_is_up(osd):
             if timeout is not None:
@@ -1197,7 +1959,7 @@ class CephManager:
         """
         Wrapper to check if active
         """
-        return self.get_num_active() == self.get_num_pgs()
+        return self.get_pg_snapshot().is_active
 
     def wait_till_active(self, timeout=None):
         """
@@ -1205,11 +1967,12 @@ class CephManager:
         """
         self.log("waiting till active")
         start = time.time()
-        while not self.is_active():
+        snap = self.get_pg_snapshot()
+        while not snap.is_active:
             if timeout is not None:
                 assert time.time() - start < timeout, \
                     'failed to become active before timeout expired'
-            time.sleep(3)
+            snap = self._poll_pg_snapshot(snap)
         self.log("active!")
 
     def mark_out_osd(self, osd):
@@ -1217,6 +1980,8 @@ class CephManager:
         Wrapper to mark osd out.
         """
         self.raw_cluster_cmd('osd', 'out', str(osd))
+        self.invalidate_pg_snapshot()
+        self.invalidate_osdmap()
 
     def kill_osd(self, osd):
         """
@@ -1230,6 +1995,7 @@ class CephManager:
             remote.console.power_off()
         else:
             self.ctx.daemons.get_daemon('osd', osd).stop()
+        self.invalidate_pg_snapshot()
 
     def blackhole_kill_osd(self, osd):
         """
@@ -1264,18 +2030,23 @@ class CephManager:
         self.wait_run_admin_socket(osd,
                                    args=['dump_ops_in_flight'],
                                    timeout=timeout)
+        self.invalidate_pg_snapshot()
 
     def mark_down_osd(self, osd):
         """
         Cluster command wrapper
         """
         self.raw_cluster_cmd('osd', 'down', str(osd))
+        self.invalidate_pg_snapshot()
+        self.invalidate_osdmap()
 
     def mark_in_osd(self, osd):
         """
         Cluster command wrapper
         """
         self.raw_cluster_cmd('osd', 'in', str(osd))
+        self.invalidate_pg_snapshot()
+        self.invalidate_osdmap()
 
 
     ## monitors
@@ -7,6 +7,7 @@ import time
 import os
 
 from teuthology import misc as teuthology
+from teuthology import artifact_cache
 from teuthology import contextutil
 from teuthology.parallel import parallel
 from ..orchestra import run
@@ -149,20 +150,10 @@ def _get_baseurlinfo_and_dist(ctx, remote, config):
     """
     retval = {}
     relval = None
-    r = remote.run(
-        args=['arch'],
-        stdout=StringIO(),
-    )
-    retval['arch'] = r.stdout.getvalue().strip()
-    r = remote.run(
-        args=['lsb_release', '-is'],
-        stdout=StringIO(),
-    )
-    retval['distro'] = r.stdout.getvalue().strip()
-    r = remote.run(
-        args=[
-            'lsb_release', '-rs'], stdout=StringIO())
-    retval['relval'] = r.stdout.getvalue().strip()
+    facts = remote.facts
+    retval['arch'] = facts['arch']
+    retval['distro'] = facts['distro']
+    retval['relval'] = facts['release']
     dist_name = None
     if ((retval['distro'] == 'CentOS') | (retval['distro'] == 'RedHatEnterpriseServer')):
         relval = retval['relval']
@@ -178,11 +169,7 @@ def _get_baseurlinfo_and_dist(ctx, remote, config):
         retval['distro_release'] = '%s%s' % (dist_name, retval['relval'])
         retval['dist'] = retval['dist_release'] = retval['distro_release']
     else:
-        r = remote.run(
-            args=['lsb_release', '-sc'],
-            stdout=StringIO(),
-        )
-        retval['dist'] = r.stdout.getvalue().strip()
+        retval['dist'] = facts['codename']
         retval['distro_release'] = None
         retval['dist_release'] = None
 
@@ -219,7 +206,7 @@ def _get_baseurl(ctx, remote, config):
         pkg_type=remote.system_type,
         **baseparms
     )
-    return base_url
+    return artifact_cache.cached_url(ctx, base_url)
 
 
 class VersionNotFoundError(Exception):
@@ -380,6 +367,36 @@ def _yum_fix_repo_priority(remote, project, uri):
     )
 
 
+def _yum_use_artifact_cache(ctx, remote, project):
+    """
+    If the job has an artifact cache, point the repos in:
+
+        /etc/yum.repos.d/{project}.repo
+
+    at it instead of at the gitbuilder host.
+
+    :param ctx: the argparse.Namespace object
+    :param remote: the teuthology.orchestra.remote.Remote object
+    :param project: the project whose repos need modification
+    """
+    host = ctx.teuthology_config.get('gitbuilder_host',
+                                     'gitbuilder.ceph.com')
+    prefix = 'http://{host}/'.format(host=host)
+    cached = artifact_cache.cached_url(ctx, prefix)
+    if cached == prefix:
+        return
+    remote.run(
+        args=[
+            'sudo',
+            'sed',
+            '-i',
+            '-e',
+            's;{prefix};{cached};g'.format(prefix=prefix, cached=cached),
+            '/etc/yum.repos.d/%s.repo' % project,
+        ]
+    )
+
+
 def _update_rpm_package_list_and_install(ctx, remote, rpm, config):
     """
     Installs the ceph-release package for the relevant branch, then installs
@@ -400,6 +417,7 @@ def _update_rpm_package_list_and_install(ctx, remote, rpm, config):
     dist_release = baseparms['dist_release']
     start_of_url = 'http://{host}/ceph-rpm-{distro_release}-{arch}-{flavor}/{uri}'.format(
         host=host, **baseparms)
+    start_of_url = artifact_cache.cached_url(ctx, start_of_url)
     ceph_release = 'ceph-release-{release}.{dist_release}.noarch'.format(
         release=RELEASE, dist_release=dist_release)
     rpm_name = "{rpm_nm}.rpm".format(rpm_nm=ceph_release)
@@ -422,6 +440,7 @@ def _update_rpm_package_list_and_install(ctx, remote, rpm, config):
     # Fix Repo Priority
     uri = baseparms['uri']
     _yum_fix_repo_priority(remote, config.get('project', 'ceph'), uri)
+    _yum_use_artifact_cache(ctx, remote, config.get('project', 'ceph'))
 
     remote.run(
         args=[
@@ -850,16 +869,8 @@ def _upgrade_deb_packages(ctx, config, remote, debs):
         )
 
     # get distro name and arch
-    r = remote.run(
-        args=['lsb_release', '-sc'],
-        stdout=StringIO(),
-    )
-    dist = r.stdout.getvalue().strip()
-    r = remote.run(
-        args=['arch'],
-        stdout=StringIO(),
-    )
-    arch = r.stdout.getvalue().strip()
+    dist = remote.facts['codename']
+    arch = remote.facts['arch']
     log.info("dist %s arch %s", dist, arch)
 
     # branch/tag/sha1 flavor
@@ -877,6 +888,7 @@ def _upgrade_deb_packages(ctx, config, remote, debs):
         flavor=flavor,
         uri=uri,
     )
+    base_url = artifact_cache.cached_url(ctx, base_url)
     log.info('Pulling from %s', base_url)
 
     # get package version string
@@ -974,6 +986,7 @@ def _upgrade_rpm_packages(ctx, config, remote, pkgs):
     _run_and_log_error_if_fails(remote, args)
     uri = _get_baseurlinfo_and_dist(ctx, remote, config)['uri']
     _yum_fix_repo_priority(remote, project, uri)
+    _yum_use_artifact_cache(ctx, remote, project)
 
     remote.run(
         args=[
@@ -1060,31 +1073,32 @@ def upgrade(ctx, config):
                 continue
             remotes[remote] = config.get(role)
 
-    for remote, node in remotes.iteritems():
-        if not node:
-            node = {}
-
-        this_overrides = copy.deepcopy(install_overrides)
-        if 'sha1' in node or 'tag' in node or 'branch' in node:
-            log.info('config contains sha1|tag|branch, removing those keys from override')
-            this_overrides.pop('sha1', None)
-            this_overrides.pop('tag', None)
-            this_overrides.pop('branch', None)
-        teuthology.deep_merge(node, this_overrides)
-        log.info('remote %s config %s', remote, node)
-
-        system_type = teuthology.get_system_type(remote)
-        assert system_type in ('deb', 'rpm')
-        pkgs = PACKAGES[project][system_type]
-        log.info("Upgrading {proj} {system_type} packages: {pkgs}".format(
-            proj=project, system_type=system_type, pkgs=', '.join(pkgs)))
-            # FIXME: again, make extra_pkgs distro-agnostic
-        pkgs += extra_pkgs
-        node['project'] = project
-        if system_type == 'deb':
-            _upgrade_deb_packages(ctx, node, remote, pkgs)
-        elif system_type == 'rpm':
-            _upgrade_rpm_packages(ctx, node, remote, pkgs)
+    with artifact_cache.serve(ctx):
+        for remote, node in remotes.iteritems():
+            if not node:
+                node = {}
+
+            this_overrides = copy.deepcopy(install_overrides)
+            if 'sha1' in node or 'tag' in node or 'branch' in node:
+                log.info('config contains sha1|tag|branch, removing those keys from override')
+                this_overrides.pop('sha1', None)
+                this_overrides.pop('tag', None)
+                this_overrides.pop('branch', None)
+            teuthology.deep_merge(node, this_overrides)
+            log.info('remote %s config %s', remote, node)
+
+            system_type = teuthology.get_system_type(remote)
+            assert system_type in ('deb', 'rpm')
+            pkgs = PACKAGES[project][system_type]
+            log.info("Upgrading {proj} {system_type} packages: {pkgs}".format(
+                proj=project, system_type=system_type, pkgs=', '.join(pkgs)))
+                # FIXME: again, make extra_pkgs distro-agnostic
+            pkgs += extra_pkgs
+            node['project'] = project
+            if system_type == 'deb':
+                _upgrade_deb_packages(ctx, node, remote, pkgs)
+            elif system_type == 'rpm':
+                _upgrade_rpm_packages(ctx, node, remote, pkgs)
 
     yield
 
@@ -1150,6 +1164,7 @@ def task(ctx, config):
     ctx.summary['flavor'] = flavor
 
     with contextutil.nested(
+        lambda: artifact_cache.serve(ctx),
         lambda: install(ctx=ctx, config=dict(
             branch=config.get('branch'),
             tag=config.get('tag'),
@@ -17,6 +17,7 @@ from teuthology import lock
 from teuthology import misc as teuthology
 from teuthology.parallel import parallel
 from ..orchestra import run
+from ..orchestra import connection
 
 log = logging.getLogger(__name__)
 
@@ -195,6 +196,9 @@ def timer(ctx, config):
         duration = time.time() - start
         log.info('Duration was %f seconds', duration)
         ctx.summary['duration'] = duration
+        ssh_metrics = connection.pool.metrics()
+        log.info('SSH connection pool: %s', ssh_metrics)
+        ctx.summary['ssh_pool'] = ssh_metrics
 
 def connect(ctx, config):
     """
@@ -229,6 +233,11 @@ def connect(ctx, config):
     else:
         for rem in remotes:
             ctx.cluster.add(rem, rem.name)
+    # gather platform facts for every host at once, rather than one host at
+    # a time whenever a task first asks
+    with parallel() as p:
+        for rem in remotes:
+            p.spawn(lambda rem: rem.facts, rem)
 
 
 def serialize_remote_roles(ctx, config):
@@ -249,18 +258,14 @@ def check_ceph_data(ctx, config):
     Check for old /var/lib/ceph directories and detect staleness.
     """
     log.info('Checking for old /var/lib/ceph...')
-    processes = ctx.cluster.run(
-        args=[
-            'test', '!', '-e', '/var/lib/ceph',
-            ],
-        wait=False,
+    results = ctx.cluster.batch(
+        [['test', '!', '-e', '/var/lib/ceph']],
+        check_status=False,
         )
     failed = False
-    for proc in processes:
-        try:
-            proc.wait()
-        except run.CommandFailedError:
-            log.error('Host %s has stale /var/lib/ceph, check lock and nuke/cleanup.', proc.remote.shortname)
+    for remote, (result,) in results.iteritems():
+        if result.exitstatus != 0:
+            log.error('Host %s has stale /var/lib/ceph, check lock and nuke/cleanup.', remote.shortname)
             failed = True
     if failed:
         raise RuntimeError('Stale /var/lib/ceph detected, aborting.')
@@ -271,22 +276,79 @@ def check_conflict(ctx, config):
     """
     log.info('Checking for old test directory...')
     testdir = teuthology.get_testdir(ctx)
-    processes = ctx.cluster.run(
-        args=[
-            'test', '!', '-e', testdir,
-            ],
-        wait=False,
+    results = ctx.cluster.batch(
+        [['test', '!', '-e', testdir]],
+        check_status=False,
         )
     failed = False
-    for proc in processes:
-        try:
-            proc.wait()
-        except run.CommandFailedError:
-            log.error('Host %s has stale test directory %s, check lock and cleanup.', proc.remote.shortname, testdir)
+    for remote, (result,) in results.iteritems():
+        if result.exitstatus != 0:
+            log.error('Host %s has stale test directory %s, check lock and cleanup.', remote.shortname, testdir)
             failed = True
     if failed:
         raise RuntimeError('Stale jobs detected, aborting.')
 
+def _pull_archives(ctx, archive_dir, logdir):
+    """
+    Pull archive_dir from every remote into logdir/<shortname>, several
+    hosts at a time.
+
+    The job config may tune this with::
+
+        archive-transfer:
+          concurrency: 4        # hosts at a time; default all of them
+          total-bandwidth: 200  # MB/s across all hosts
+          host-bandwidth: 50    # MB/s per host
+          codec: zstd           # gzip (default), zstd, lz4 or none;
+                                # falls back to gzip if unsupported
+          exclude: ['*.core']   # globs of files not to pull
+          dedupe: true          # hard link identical files across hosts
+                                # (saves archive space, not transfer time)
+          truncate:             # only done for passing jobs
+            max-size: 512       # MB; larger files are cut down to
+            keep: 64            # their first and last <keep> MB
+
+    :returns: a dict mapping each remote's shortname to the bytes, files
+              and duration of its transfer
+    """
+    conf = ctx.config.get('archive-transfer') or {}
+    total_throttle = None
+    if conf.get('total-bandwidth'):
+        total_throttle = teuthology.Throttle(
+            conf['total-bandwidth'] * 1024 * 1024)
+    exclude = conf.get('exclude', [])
+    dedupe = {} if conf.get('dedupe') else None
+    truncate = conf.get('truncate')
+    if not ctx.summary.get('success', False):
+        truncate = None
+
+    def _pull(remote):
+        throttles = [total_throttle]
+        if conf.get('host-bandwidth'):
+            throttles.append(
+                teuthology.Throttle(conf['host-bandwidth'] * 1024 * 1024))
+        if truncate:
+            teuthology.truncate_large_files(
+                remote, archive_dir,
+                max_size=truncate['max-size'] * 1024 * 1024,
+                keep=truncate['keep'] * 1024 * 1024,
+                # cutting compressed files would just corrupt them
+                exclude=['*.gz', '*.zst', '*.lz4'],
+                )
+        path = os.path.join(logdir, remote.shortname)
+        return remote.shortname, teuthology.pull_directory(
+            remote, archive_dir, path, throttles=throttles,
+            codec=conf.get('codec', 'gzip'), exclude=exclude, dedupe=dedupe)
+
+    stats = {}
+    with parallel(size=conf.get('concurrency')) as p:
+        for remote in ctx.cluster.remotes.iterkeys():
+            p.spawn(_pull, remote)
+        for shortname, host_stats in p:
+            stats[shortname] = host_stats
+    return stats
+
+
 @contextlib.contextmanager
 def archive(ctx, config):
     """
@@ -316,9 +378,8 @@ def archive(ctx, config):
             logdir = os.path.join(ctx.archive, 'remote')
             if (not os.path.exists(logdir)):
                 os.mkdir(logdir)
-            for remote in ctx.cluster.remotes.iterkeys():
-                path = os.path.join(logdir, remote.shortname)
-                teuthology.pull_directory(remote, archive_dir, path)
+            ctx.summary['archive_transfer'] = _pull_archives(
+                ctx, archive_dir, logdir)
 
         log.info('Removing archive directory...')
         run.wait(
@@ -387,39 +448,53 @@ def coredump(ctx, config):
     try:
         yield
     finally:
-        run.wait(
-            ctx.cluster.run(
-                args=[
+        coredump_dir = '{adir}/coredump'.format(adir=archive_dir)
+        results = ctx.cluster.batch(
+            [
+                [
                     'sudo', 'sysctl', '-w', 'kernel.core_pattern=core',
                     run.Raw('&&'),
                     # don't litter the archive dir if there were no cores dumped
                     'rmdir',
                     '--ignore-fail-on-non-empty',
                     '--',
-                    '{adir}/coredump'.format(adir=archive_dir),
+                    coredump_dir,
                     ],
-                wait=False,
-                )
+                ['test', '!', '-e', coredump_dir],
+                ],
+            check_status=False,
             )
 
         # set success=false if the dir is still there = coredumps were
         # seen
-        for remote in ctx.cluster.remotes.iterkeys():
-            r = remote.run(
-                args=[
-                    'if', 'test', '!', '-e', '{adir}/coredump'.format(adir=archive_dir), run.Raw(';'), 'then',
-                    'echo', 'OK', run.Raw(';'),
-                    'fi',
-                    ],
-                stdout=StringIO(),
-                )
-            if r.stdout.getvalue() != 'OK\n':
+        for remote, (reset, check) in results.iteritems():
+            if reset.exitstatus != 0:
+                raise run.CommandFailedError(command=reset.command,
+                                             exitstatus=reset.exitstatus,
+                                             node=remote.shortname)
+            if check.exitstatus != 0:
                 log.warning('Found coredumps on %s, flagging run as failed', remote)
                 ctx.summary['success'] = False
                 if 'failure_reason' not in ctx.summary:
                     ctx.summary['failure_reason'] = \
                         'Found coredumps on {remote}'.format(remote=remote)
 
+SYSLOG_PATTERNS = [r'\bBUG\b', r'\bDEADLOCK\b', r'\bINFO\b']
+SYSLOG_WHITELIST = [
+    r'task .* blocked for more than .* seconds',
+    r'lockdep is turned off',
+    r'trying to register non-static key',
+    r'DEBUG: fsize',  # xfs_fsr
+    r'CRON',  # ignore cron noise
+    r'BUG: bad unlock balance detected',  # #6097
+    r'inconsistent lock state',  # FIXME see #2523
+    r'\*\*\* DEADLOCK \*\*\*',  # part of lockdep output
+    r'INFO: possible irq lock inversion dependency detected',  # FIXME see #2590 and #147
+    r'INFO: NMI handler \(perf_event_nmi_handler\) took too long to run',
+    r'INFO: recovery required on readonly',
+    ]
+
+
 @contextlib.contextmanager
 def syslog(ctx, config):
     """
@@ -449,13 +524,7 @@ kern.* -{adir}/syslog/kern.log;RSYSLOG_FileFormat
 *.*;kern.none -{adir}/syslog/misc.log;RSYSLOG_FileFormat
 '''.format(adir=archive_dir))
     try:
-        for rem in ctx.cluster.remotes.iterkeys():
-            teuthology.sudo_write_file(
-                remote=rem,
-                path=CONF,
-                data=conf_fp,
-                )
-            conf_fp.seek(0)
+        ctx.cluster.put_files([(conf_fp, CONF)], sudo=True)
         run.wait(
             ctx.cluster.run(
                 args=[
@@ -474,9 +543,11 @@ kern.* -{adir}/syslog/kern.log;RSYSLOG_FileFormat
     finally:
         log.info('Shutting down syslog monitoring...')
 
-        run.wait(
-            ctx.cluster.run(
-                args=[
+        # race condition: nothing actually says rsyslog had time to
+        # flush the file fully. oh well.
+        results = ctx.cluster.batch(
+            [
+                [
                     'sudo',
                     'rm',
                     '-f',
@@ -488,59 +559,13 @@ kern.* -{adir}/syslog/kern.log;RSYSLOG_FileFormat
                     'rsyslog',
                     'restart',
                     ],
-                wait=False,
-                ),
-            )
-        # race condition: nothing actually says rsyslog had time to
-        # flush the file fully. oh well.
-
-        log.info('Checking logs for errors...')
-        for remote in ctx.cluster.remotes.iterkeys():
-            log.debug('Checking %s', remote.name)
-            r = remote.run(
-                args=[
-                    'egrep', '--binary-files=text',
-                    '\\bBUG\\b|\\bINFO\\b|\\bDEADLOCK\\b',
-                    run.Raw('{adir}/syslog/*.log'.format(adir=archive_dir)),
-                    run.Raw('|'),
-                    'grep', '-v', 'task .* blocked for more than .* seconds',
-                    run.Raw('|'),
-                    'grep', '-v', 'lockdep is turned off',
-                    run.Raw('|'),
-                    'grep', '-v', 'trying to register non-static key',
-                    run.Raw('|'),
-                    'grep', '-v', 'DEBUG: fsize',  # xfs_fsr
-                    run.Raw('|'),
-                    'grep', '-v', 'CRON',  # ignore cron noise
-                    run.Raw('|'),
-                    'grep', '-v', 'BUG: bad unlock balance detected', # #6097
-                    run.Raw('|'),
-                    'grep', '-v', 'inconsistent lock state', # FIXME see #2523
-                    run.Raw('|'),
-                    'grep', '-v', '*** DEADLOCK ***', # part of lockdep output
-                    run.Raw('|'),
-                    'grep', '-v', 'INFO: possible irq lock inversion dependency detected', # FIXME see #2590 and #147
-                    run.Raw('|'),
-                    'grep', '-v', 'INFO: NMI handler (perf_event_nmi_handler) took too long to run',
-                    run.Raw('|'),
-                    'grep', '-v', 'INFO: recovery required on readonly',
-                    run.Raw('|'),
-                    'head', '-n', '1',
-                    ],
-                stdout=StringIO(),
-                )
-            stdout = r.stdout.getvalue()
-            if stdout != '':
-                log.error('Error in syslog on %s: %s', remote.name, stdout)
-                ctx.summary['success'] = False
-                if 'failure_reason' not in ctx.summary:
-                    ctx.summary['failure_reason'] = \
-                        "'{error}' in syslog".format(error=stdout)
-
-        log.info('Compressing syslogs...')
-        run.wait(
-            ctx.cluster.run(
-                args=[
+                teuthology.log_scan_command(
+                    ['{adir}/syslog/*.log'.format(adir=archive_dir)],
+                    SYSLOG_PATTERNS,
+                    excludes=SYSLOG_WHITELIST,
+                    ),
+                # compress syslogs
+                [
                     'find',
                     '{adir}/syslog'.format(adir=archive_dir),
                     '-name',
@@ -555,10 +580,23 @@ kern.* -{adir}/syslog/kern.log;RSYSLOG_FileFormat
                     'gzip',
                     '--',
                     ],
-                wait=False,
-                ),
+                ],
+            stop_on_error=True,
             )
 
+        log.info('Checking logs for errors...')
+        for remote, (restart, check, compress) in results.iteritems():
+            log.debug('Checking %s', remote.name)
+            scan = teuthology.LogScan(SYSLOG_PATTERNS, check.stdout)
+            if scan:
+                (path, error) = scan.first_hit
+                log.error('Error in syslog on %s: %s:%s', remote.name, path,
+                          error)
+                ctx.summary['success'] = False
+                if 'failure_reason' not in ctx.summary:
+                    ctx.summary['failure_reason'] = \
+                        "'{error}' in syslog".format(error=error)
+
 def vm_setup(ctx, config):
     """
     Look for virtual machines and handle their initialization
@@ -10,6 +10,7 @@ import urllib2
 import urlparse
 
 from teuthology import misc as teuthology
+from teuthology import artifact_cache
 from ..orchestra import run
 from ..config import config as teuth_config
 
@@ -140,15 +141,8 @@ def need_to_install(ctx, role, version):
     ret = True
     log.info('Checking kernel version of {role}, want {ver}...'.format(
              role=role, ver=version))
-    uname_fp = StringIO()
-    ctx.cluster.only(role).run(
-        args=[
-            'uname',
-            '-r',
-            ],
-        stdout=uname_fp,
-        )
-    cur_version = uname_fp.getvalue().rstrip('\n')
+    (role_remote,) = ctx.cluster.only(role).remotes.keys()
+    cur_version = role_remote.facts['kernel']
     log.debug('current kernel version is {ver}'.format(ver=cur_version))
 
     if '.' in version:
@@ -171,7 +165,6 @@ def need_to_install(ctx, role, version):
                 ret = False
         else:
             log.debug('failed to parse current kernel version')
-    uname_fp.close()
     return ret
 
 def install_firmware(ctx, config):
@@ -280,6 +273,7 @@ def download_kernel(ctx, config):
                     )
 
                 kernel_url = urlparse.urljoin(rpm_url, 'kernel.x86_64.rpm')
+                kernel_url = artifact_cache.cached_url(ctx, kernel_url)
                 output, err_mess = StringIO(), StringIO()
                 role_remote.run(args=['sudo', 'yum', 'list', 'installed', 'kernel'], stdout=output, stderr=err_mess )
                 # Check if short (first 8 digits) sha1 is in uname output as expected
@@ -304,6 +298,7 @@ def download_kernel(ctx, config):
                 dist=ldist,
                 )
 
+            deb_url = artifact_cache.cached_url(ctx, deb_url)
             log.info('fetching kernel from {url}'.format(url=deb_url))
             proc = role_remote.run(
                 args=[
@@ -589,8 +584,7 @@ def need_to_install_distro(ctx, role):
     (role_remote,) = ctx.cluster.only(role).remotes.keys()
     system_type = teuthology.get_system_type(role_remote)
     output, err_mess = StringIO(), StringIO()
-    role_remote.run(args=['uname', '-r' ], stdout=output, stderr=err_mess )
-    current = output.getvalue().strip()
+    current = role_remote.facts['kernel']
     if system_type == 'rpm':
         role_remote.run(args=['sudo', 'yum', 'install', '-y', 'kernel'], stdout=output, stderr=err_mess )
         #reset stringIO output.
@@ -947,7 +941,8 @@ def task(ctx, config):
 
     if need_install:
         install_firmware(ctx, need_install)
-        download_kernel(ctx, need_install)
+        with artifact_cache.serve(ctx):
+            download_kernel(ctx, need_install)
         install_and_reboot(ctx, need_install)
         wait_for_reboot(ctx, need_version, timeout)
 
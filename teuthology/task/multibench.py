@@ -8,6 +8,8 @@ import time
 import copy
 import gevent
 
+from teuthology import benchmark
+
 log = logging.getLogger(__name__)
 
 @contextlib.contextmanager
@@ -22,6 +24,10 @@ def task(ctx, config):
         segments: <number of concurrent benches>
         radosbench: <config for radosbench>
 
+    Besides the results of each radosbench run, the combined bandwidth of
+    all the segments is recorded in benchmarks.json in the archive and in
+    the job summary.
+
     example:
 
     tasks:
@@ -35,17 +41,23 @@ def task(ctx, config):
     assert isinstance(config, dict), \
         "please list clients to run on"
 
+    pools = set()
+
     def run_one(num):
-    """Run test spawn from gevent"""
+        """Run test spawn from gevent"""
         start = time.time()
         benchcontext = copy.copy(config.get('radosbench'))
         iterations = 0
         while time.time() - start < int(config.get('time', 600)):
             log.info("Starting iteration %s of segment %s"%(iterations, num))
             benchcontext['pool'] = str(num) + "-" + str(iterations)
+            pools.add(benchcontext['pool'])
             with radosbench.task(ctx, benchcontext):
-                time.sleep()
+                pass
             iterations += 1
+        return time.time()
+
+    start = time.time()
     log.info("Starting %s threads"%(str(config.get('segments', 3)),))
     segments = [
         gevent.spawn(run_one, i) 
@@ -54,4 +66,20 @@ def task(ctx, config):
     try:
         yield
     finally:
-        [i.get() for i in segments]
+        end = max([i.get() for i in segments] or [start])
+        runs = [run for run in getattr(ctx, 'benchmarks', [])
+                if run['benchmark'] == 'radosbench' and
+                run.get('pool') in pools and
+                run.get('bandwidth_mbps') is not None and
+                run.get('total_time') is not None]
+        written = sum(run['bandwidth_mbps'] * run['total_time']
+                      for run in runs)
+        benchmark.record(
+            ctx, 'multibench', None,
+            dict(
+                segments=len(segments),
+                runs=len(runs),
+                total_time=end - start,
+                bandwidth_mbps=written / (end - start) if end > start else None,
+                ),
+            )
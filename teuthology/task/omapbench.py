@@ -5,6 +5,7 @@ import contextlib
 import logging
 
 from ..orchestra import run
+from teuthology import benchmark
 from teuthology import misc as teuthology
 
 log = logging.getLogger(__name__)
@@ -26,6 +27,9 @@ def task(ctx, config):
 		      increment: <interval to show in histogram (in ms)>
 		      omaptype: <how the omaps should be generated>
 
+    The latencies and histogram printed by each client are parsed and
+    recorded in benchmarks.json in the archive and in the job summary.
+
     example::
 
 		  tasks:
@@ -45,6 +49,7 @@ def task(ctx, config):
     assert isinstance(config, dict), \
         "please list clients to run on"
     omapbench = {}
+    captures = {}
     testdir = teuthology.get_testdir(ctx)
     print(str(config.get('increment',-1)))
     for role in config.get('clients', ['client.0']):
@@ -53,6 +58,8 @@ def task(ctx, config):
         assert role.startswith(PREFIX)
         id_ = role[len(PREFIX):]
         (remote,) = ctx.cluster.only(role).remotes.iterkeys()
+        capture = benchmark.OutputCapture(
+            log.getChild('omapbench.{id}'.format(id=id_)))
         proc = remote.run(
             args=[
                 "/bin/sh", "-c",
@@ -71,13 +78,20 @@ def task(ctx, config):
                           ]).format(tdir=testdir),
                 ],
             logger=log.getChild('omapbench.{id}'.format(id=id_)),
+            stdout=capture,
             stdin=run.PIPE,
             wait=False
             )
         omapbench[id_] = proc
+        captures[id_] = (role, capture)
 
     try:
         yield
     finally:
         log.info('joining omapbench')
         run.wait(omapbench.itervalues())
+        for role, capture in captures.itervalues():
+            benchmark.record(
+                ctx, 'omapbench', role,
+                benchmark.parse_omapbench(capture.lines),
+                )
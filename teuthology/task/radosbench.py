@@ -5,6 +5,7 @@ import contextlib
 import logging
 
 from ..orchestra import run
+from teuthology import benchmark
 from teuthology import misc as teuthology
 
 log = logging.getLogger(__name__)
@@ -25,6 +26,10 @@ def task(ctx, config):
           name: teuthologyprofile
         ec_pool: create ec pool, defaults to False
 
+    Bandwidth, IOPS, latency and the per-second progress of each client
+    are parsed from the rados bench output and recorded in
+    benchmarks.json in the archive and in the job summary.
+
     example:
 
     tasks:
@@ -38,6 +43,7 @@ def task(ctx, config):
     assert isinstance(config, dict), \
         "please list clients to run on"
     radosbench = {}
+    captures = {}
 
     testdir = teuthology.get_testdir(ctx)
 
@@ -63,6 +69,8 @@ def task(ctx, config):
         else:
             pool = ctx.manager.create_pool_with_unique_name(erasure_code_profile_name=erasure_code_profile_name)
 
+        capture = benchmark.OutputCapture(
+            log.getChild('radosbench.{id}'.format(id=id_)))
         proc = remote.run(
             args=[
                 "/bin/sh", "-c",
@@ -76,10 +84,12 @@ def task(ctx, config):
                           ]).format(tdir=testdir),
                 ],
             logger=log.getChild('radosbench.{id}'.format(id=id_)),
+            stdout=capture,
             stdin=run.PIPE,
             wait=False
             )
         radosbench[id_] = proc
+        captures[id_] = (role, pool, capture)
 
     try:
         yield
@@ -87,6 +97,12 @@ def task(ctx, config):
         timeout = config.get('time', 360) * 5
         log.info('joining radosbench (timing out after %ss)', timeout)
         run.wait(radosbench.itervalues(), timeout=timeout)
+        for role, bench_pool, capture in captures.itervalues():
+            benchmark.record(
+                ctx, 'radosbench', role,
+                benchmark.parse_rados_bench(capture.lines),
+                pool=bench_pool,
+                )
 
         if pool is not 'data':
             ctx.manager.remove_pool(pool)
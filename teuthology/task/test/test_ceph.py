@@ -0,0 +1,47 @@
+import gevent
+import gevent.event
+
+from .. import ceph
+
+
+class FakeProc(object):
+    def __init__(self):
+        self.exited = gevent.event.Event()
+
+    def wait(self):
+        self.exited.wait()
+
+
+class FakeRemote(object):
+    def __init__(self):
+        self.procs = []
+
+    def run(self, *args, **kwargs):
+        proc = FakeProc()
+        self.procs.append(proc)
+        return proc
+
+
+class TestDaemonState(object):
+    def setup(self):
+        self.remote = FakeRemote()
+        self.daemon = ceph.DaemonState(self.remote, 'osd', '0', args=['x'])
+        self.events = []
+        self.daemon.listeners = [
+            lambda daemon, event: self.events.append(event)]
+
+    def test_exited(self):
+        self.daemon.restart()
+        self.remote.procs[0].exited.set()
+        gevent.sleep(0)
+        assert self.events == ['started', 'exited']
+
+    def test_stale_exit_after_restart(self):
+        self.daemon.restart()
+        self.daemon.proc = None
+        self.daemon.restart()
+        # the old process only now turns out to have exited
+        self.remote.procs[0].exited.set()
+        gevent.sleep(0)
+        assert self.events == ['started', 'started']
+        assert self.daemon.proc is self.remote.procs[1]
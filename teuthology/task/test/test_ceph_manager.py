@@ -0,0 +1,424 @@
+import gevent
+import json
+import pytest
+import time
+import yaml
+
+from ..ceph_manager import (CephManager, ClusterEvents, OSDMap, PGSnapshot,
+                            ThrashStats, Thrasher, is_read_only_cmd,
+                            load_cluster_json)
+
+
+def osd_dump(epoch=1):
+    return dict(
+        epoch=epoch,
+        pools=[
+            dict(pool=1, pool_name='rbd', pg_num=16, pg_placement_num=8,
+                 size=2),
+            dict(pool=0, pool_name='data', pg_num=64, pg_placement_num=64,
+                 size=3),
+        ],
+        osds=[
+            dict(osd=0, up=1, **{'in': 1}),
+            dict(osd=1, up=0, **{'in': 1}),
+            dict(osd=2, up=1, **{'in': 0}),
+        ],
+    )
+
+
+class TestPGSnapshot(object):
+    def test_counters(self):
+        snap = PGSnapshot.from_pgs([
+            dict(pgid='0.0', state='active+clean'),
+            dict(pgid='0.1', state='active+clean'),
+            dict(pgid='0.2', state='active+recovering+degraded'),
+            dict(pgid='0.3', state='down+peering'),
+            dict(pgid='0.4', state='stale+active+clean'),
+            dict(pgid='0.5', state='creating'),
+        ])
+        assert snap.num_pgs == 6
+        assert snap.num_active == 3
+        assert snap.num_active_clean == 2
+        assert snap.num_active_recovered == 2
+        assert snap.num_down == 1
+        assert snap.num_active_down == 4
+        assert snap.num_creating == 1
+        assert not snap.is_clean
+        assert snap.histogram()['active'] == 4
+        assert snap.histogram()['clean'] == 3
+
+    def test_from_stat(self):
+        stat = dict(
+            num_pgs=3,
+            num_pg_by_state=[
+                dict(name='active+clean', num=2),
+                dict(name='active+remapped+backfilling', num=1),
+            ],
+        )
+        snap = PGSnapshot.from_stat(stat)
+        assert snap.pgs is None
+        assert snap.num_active == 3
+        assert snap.num_active_clean == 2
+        assert snap.num_active_recovered == 2
+        assert snap.is_active
+        assert not snap.is_recovered
+
+    def test_covers(self):
+        snap = PGSnapshot({}, source='brief')
+        assert snap.covers('stat')
+        assert snap.covers('brief')
+        assert not snap.covers('dump')
+
+    def test_delta(self):
+        prev = PGSnapshot({'active+clean': 2, 'peering': 1})
+        snap = PGSnapshot({'active+clean': 3})
+        assert snap.delta(prev) == {
+            'active+clean': (2, 3),
+            'peering': (1, 0),
+        }
+        assert snap.delta(snap) == {}
+
+    def test_get_pg(self):
+        snap = PGSnapshot.from_pgs([
+            dict(pgid='0.0', state='active+clean', acting=[1, 0]),
+            dict(pgid='0.1', state='peering', acting=[2]),
+        ], source='brief')
+        assert snap.get_pg('0.1')['acting'] == [2]
+        assert snap.get_pg('0.7') is None
+        with pytest.raises(AssertionError):
+            PGSnapshot({}, source='stat').get_pg('0.0')
+
+    def test_load_cluster_json(self):
+        out = 'dumped all in format json\n' + json.dumps(dict(pg_stats=[]))
+        assert load_cluster_json(out) == dict(pg_stats=[])
+        assert load_cluster_json('[1, 2]') == [1, 2]
+
+
+class FakeManager(object):
+    def __init__(self):
+        self.snapshots = 0
+        self.epochs = []
+        self.invalidated = 0
+
+    def get_pg_progress(self):
+        self.snapshots += 1
+        return PGSnapshot({'active+clean': 4}, source='stat')
+
+    def get_osdmap(self, min_epoch=None):
+        self.epochs.append(min_epoch)
+        return OSDMap(osd_dump())
+
+    def invalidate_osdmap(self):
+        self.invalidated += 1
+
+
+class FakeDaemon(object):
+    role = 'osd'
+    id_ = '1'
+
+
+class TestClusterEvents(object):
+    def setup(self):
+        self.manager = FakeManager()
+        self.events = ClusterEvents(self.manager, refresh_interval=0.1)
+
+    def test_pgmap_line(self):
+        self.events.handle_line(
+            '2014-01-01 00:00:00.000000 mon.0 [INF] pgmap v42: 24 pgs: '
+            '20 active+clean, 4 active+recovering+degraded; 9 kB data, '
+            '1 GB used; 2/10 objects degraded; 1 kB/s, 1 objects/s '
+            'recovering\n')
+        assert self.events.pgs.num_pgs == 24
+        assert self.events.pgs.num_active_clean == 20
+        assert self.events.pgs.num_active == 24
+        assert self.events.recovering
+
+    def test_osdmap_and_boot(self):
+        self.events.handle_line(
+            'mon.0 [INF] osdmap e12: 3 osds: 3 up, 3 in\n')
+        self.events.handle_line(
+            'mon.0 [INF] osd.1 10.0.0.1:6800/1234 boot\n')
+        assert self.events.osdmap_epoch == 12
+        assert 'osd.1' in self.events.booted
+        assert self.events.osd_is_up(0)
+        assert not self.events.osd_is_up(1)
+        assert self.manager.epochs == [12, 12]
+
+    def test_daemon_event(self):
+        daemon = FakeDaemon()
+        self.events.booted.add('osd.1')
+        self.events.daemon_event(daemon, 'exited')
+        assert 'osd.1' in self.events.exited
+        self.events.daemon_event(daemon, 'started')
+        assert 'osd.1' not in self.events.exited
+        assert 'osd.1' not in self.events.booted
+
+    def test_wait_for_timeout_refreshes(self):
+        assert not self.events.wait_for(lambda: False, timeout=0.3)
+        assert self.manager.snapshots >= 1
+        assert self.manager.invalidated >= 1
+
+    def test_next_pgs(self):
+        prev = PGSnapshot({'active+clean': 3, 'peering': 1})
+        snap = self.events.next_pgs(prev, timeout=1)
+        assert snap.num_active_clean == 4
+
+
+class TestOSDMap(object):
+    def test_indexes(self):
+        osdmap = OSDMap(osd_dump(epoch=5))
+        assert osdmap.epoch == 5
+        assert osdmap.pool_names() == ['data', 'rbd']
+        assert osdmap.pool_num('rbd') == 1
+        assert osdmap.pool_property('rbd', 'pg_num') == 16
+        assert osdmap.pool_property('rbd', 'pgp_num') == 8
+        assert osdmap.pool_property('rbd', 'hashpspool') is None
+        assert osdmap.osd_ids(up=True) == [0, 2]
+        assert osdmap.osd_ids(up=False) == [1]
+        assert osdmap.osd_ids(in_=True) == [0, 1]
+        assert osdmap.osd_ids(in_=False) == [2]
+        assert osdmap.osd_is_up(0)
+        assert not osdmap.osd_is_up(1)
+        assert not osdmap.osd_is_up(7)
+
+
+class FakeCephManager(CephManager):
+    def __init__(self):
+        self.epoch = 1
+        self.commands = []
+        CephManager.__init__(self, controller=None, config={},
+                             logger=None)
+
+    def raw_cluster_cmd(self, *args):
+        self.commands.append(args[:2])
+        out = self.reply(args)
+        self._cluster_cmd_done(args)
+        return out
+
+    def reply(self, args):
+        if args[:2] == ('osd', 'out'):
+            return ''
+        if args[:2] == ('osd', 'stat'):
+            return json.dumps(dict(epoch=self.epoch))
+        if args[:2] == ('osd', 'dump'):
+            return 'dumped osdmap epoch %d\n' % self.epoch + \
+                json.dumps(osd_dump(self.epoch))
+        if args[:3] == ('pg', 'dump', 'pgs_brief'):
+            return json.dumps([
+                dict(pgid='1.0', state='active+clean', acting=[2, 0]),
+                dict(pgid='1.1', state='active+clean', acting=[0, 1]),
+            ])
+        if args[:2] == ('pg', 'map'):
+            acting = {'1.0': [2, 0], '1.1': [0, 1]}[args[2]]
+            return json.dumps(dict(epoch=self.epoch, pgid=args[2],
+                                   up=acting, acting=acting))
+        if args[0] == 'pg' and args[2:] == ('query',):
+            return json.dumps(dict(state='active+clean+inconsistent'))
+        raise AssertionError(args)
+
+
+class TestCephManagerOSDMap(object):
+    def test_fetch_once_per_epoch(self):
+        manager = FakeCephManager()
+        assert manager.pools == dict(data=64, rbd=16)
+        assert manager.commands == [('osd', 'dump')]
+        assert manager.get_pool_num('rbd') == 1
+        assert manager.get_pool_property('data', 'size') == 3
+        assert manager.osd_is_up(0)
+        assert manager.commands.count(('osd', 'dump')) == 1
+        manager.epoch = 2
+        assert manager.list_pools() == ['data', 'rbd']
+        assert manager.commands.count(('osd', 'dump')) == 2
+        # a known epoch needs no round trip at all
+        del manager.commands[:]
+        assert manager.get_osdmap(min_epoch=2).epoch == 2
+        assert manager.commands == []
+        manager.invalidate_osdmap()
+        manager.get_osdmap(min_epoch=2)
+        assert manager.commands == [('osd', 'stat')]
+
+
+class TestCephManagerInvalidation(object):
+    def test_is_read_only_cmd(self):
+        assert is_read_only_cmd(('-s',))
+        assert is_read_only_cmd(('pg', 'dump', '--format=json'))
+        assert is_read_only_cmd(('pg', '1.0', 'query'))
+        assert is_read_only_cmd(('osd', 'pool', 'get', 'rbd', 'size'))
+        assert not is_read_only_cmd(('osd', 'out', '0'))
+        assert not is_read_only_cmd(('osd', 'lost', '1',
+                                     '--yes-i-really-mean-it'))
+        assert not is_read_only_cmd(('osd', 'pool', 'set', 'rbd', 'size', '2'))
+        assert not is_read_only_cmd(('tell', 'osd.0', 'injectargs', '--x'))
+
+    def test_raw_cluster_cmd_invalidates(self):
+        manager = FakeCephManager()
+        snap = manager.get_pg_snapshot(source='brief')
+        assert manager.get_pg_snapshot(source='brief') is snap
+        manager.get_osdmap()
+        assert not manager._osdmap_stale
+        manager.raw_cluster_cmd('osd', 'out', '0')
+        assert manager._osdmap_stale
+        assert manager.get_pg_snapshot(source='brief') is not snap
+
+
+class TestCephManagerPGLookup(object):
+    def test_acting_from_pg_map(self):
+        manager = FakeCephManager()
+        assert manager.get_pg_primary('rbd', 0) == 2
+        assert manager.get_pg_replica('rbd', 0) == 0
+        assert manager.get_pg_primary('rbd', 1) == 0
+        assert manager.commands.count(('pg', 'map')) == 3
+        assert ('pg', 'dump') not in manager.commands
+
+    def test_pg_query(self):
+        manager = FakeCephManager()
+        assert manager.pg_inconsistent('rbd', 1)
+        assert not manager.pg_repairing('rbd', 1)
+        assert ('pg', '1.1') in manager.commands
+        assert ('pg', 'dump') not in manager.commands
+
+
+class TestThrashStats(object):
+    def test_actions_and_recoveries(self):
+        stats = ThrashStats()
+        stats.record_action('kill_osd', 0.5)
+        stats.record_action('kill_osd', 12)
+        stats.record_action('out_osd', 3)
+        stats.record_recovery(40)
+        stats.record_action('in_osd', 1)
+        stats.record_recovery(20)
+        d = stats.as_dict()
+        kill = d['actions']['kill_osd']
+        assert kill['count'] == 2
+        assert kill['min'] == 0.5
+        assert kill['max'] == 12
+        assert kill['mean'] == 6.25
+        assert kill['histogram'] == {'<1s': 1, '<30s': 1}
+        assert d['recoveries'][0] == dict(duration=40,
+                                          after=['kill_osd', 'kill_osd',
+                                                 'out_osd'])
+        assert d['recoveries'][1]['after'] == ['in_osd']
+        assert d['recovery_mean'] == 30
+        assert d['recovery_max'] == 40
+        assert stats.bucket(1000) == '>=300s'
+
+
+class FakeThrasher(Thrasher):
+    def __init__(self):
+        self.ceph_manager = FakeManager()
+        self.ceph_manager.ctx = None
+        self.log = lambda x: None
+        self.in_osds = [0, 1, 2]
+        self.out_osds = []
+        self.live_osds = [0, 1, 2]
+        self.dead_osds = []
+        self.inflight = []
+        self.busy_osds = set()
+        self.busy_hosts = set()
+        self.stats = ThrashStats()
+        self.reweighted = []
+
+    def reweight_osd(self, osd=None):
+        self.reweighted.append(osd)
+        gevent.sleep(0.1)
+
+
+class TestThrasherScheduler(object):
+    def test_concurrent_actions_use_distinct_osds(self):
+        thrasher = FakeThrasher()
+        thrasher.osd_host = lambda osd: 'host%d' % osd
+        for i in range(4):
+            thrasher.schedule_action(thrasher.reweight_osd)
+        # only three osds, so the fourth action had nothing to run on
+        assert len(thrasher.inflight) == 3
+        assert sorted(thrasher.reweighted) == [0, 1, 2]
+        thrasher.drain()
+        assert thrasher.inflight == []
+        assert thrasher.busy_osds == set()
+        assert thrasher.stats.actions['reweight_osd']['count'] == 3
+
+    def test_exclusive_action_drains(self):
+        thrasher = FakeThrasher()
+        thrasher.osd_host = lambda osd: 'host'
+        thrasher.schedule_action(thrasher.reweight_osd)
+        thrasher.schedule_action(thrasher.reweight_osd)
+        # same host, so the second action was skipped
+        assert len(thrasher.inflight) == 1
+        ran = []
+
+        def grow_pool():
+            ran.append(len(thrasher.inflight))
+        thrasher.schedule_action(grow_pool)
+        assert ran == [0]
+
+    def test_failures_propagate(self):
+        thrasher = FakeThrasher()
+        thrasher.osd_host = lambda osd: 'host%d' % osd
+
+        def reweight_osd(osd=None):
+            raise RuntimeError('boom')
+        thrasher.osd_candidates = lambda action: thrasher.in_osds
+        thrasher.schedule_action(reweight_osd)
+        with pytest.raises(RuntimeError):
+            thrasher.drain()
+
+
+def status(clean, recovering=0, total=4):
+    states = [dict(state_name='active+clean', count=clean)]
+    if total > clean:
+        states.append(dict(state_name='active+recovering',
+                           count=total - clean))
+    return dict(pgmap=dict(num_pgs=total, pgs_by_state=states,
+                           recovering_objects_per_sec=recovering))
+
+
+class TestWaitForClean(object):
+    def test_from_status(self):
+        snap = PGSnapshot.from_status(status(3, recovering=12))
+        assert snap.num_pgs == 4
+        assert snap.num_active_clean == 3
+        assert snap.recovering
+        assert not PGSnapshot.from_status(status(4)).recovering
+
+    def test_one_query_per_tick_and_series(self, tmpdir, monkeypatch):
+        manager = FakeCephManager()
+        manager.ctx = type('ctx', (), dict(archive=str(tmpdir)))()
+        manager.pg_poll_min = 0.01
+        manager.pg_poll_max = 0.04
+        statuses = [status(1, 5), status(2, 5), status(2, 5), status(4)]
+        manager.raw_cluster_status = lambda: statuses.pop(0)
+        sleeps = []
+        monkeypatch.setattr(time, 'sleep', sleeps.append)
+        manager.wait_for_clean(timeout=60)
+        assert statuses == []
+        assert len(sleeps) == 3
+        # backed off when nothing changed
+        assert sleeps[2] > sleeps[1]
+        docs = list(yaml.safe_load_all(tmpdir.join('pg_states.yaml').read()))
+        assert docs[0]['wait'] == 'clean'
+        assert [s['states']['active+clean'] for s in docs[0]['samples']] == \
+            [1, 2, 2, 4]
+
+    def test_same_stamp(self, monkeypatch):
+        manager = FakeCephManager()
+        statuses = [status(1, 5), status(2, 5), status(4)]
+        manager.raw_cluster_status = lambda: statuses.pop(0)
+        monkeypatch.setattr(time, 'sleep', lambda s: None)
+        monkeypatch.setattr(time, 'time', lambda: 100.0)
+        manager.wait_for_clean(timeout=60)
+        assert statuses == []
+
+    def test_any_change_resets_timeout(self, monkeypatch):
+        manager = FakeCephManager()
+        manager.pg_poll_min = manager.pg_poll_max = 4
+        statuses = [status(3), status(2), status(2), status(2), status(4)]
+        manager.raw_cluster_status = lambda: statuses.pop(0)
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+        monkeypatch.setattr(time, 'sleep', sleep)
+        monkeypatch.setattr(time, 'time', lambda: clock[0])
+        # fewer clean pgs is still a change, so this does not time out
+        manager.wait_for_clean(timeout=10)
+        assert statuses == []
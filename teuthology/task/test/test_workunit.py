@@ -0,0 +1,150 @@
+import argparse
+import pytest
+import tarfile
+import time
+from cStringIO import StringIO
+
+from .. import workunit
+from ...orchestra import cluster, run
+
+
+def make_tarball(files):
+    out = StringIO()
+    tar = tarfile.open(mode='w:gz', fileobj=out)
+    for name, mode in files:
+        info = tarfile.TarInfo(name)
+        info.mode = mode
+        info.mtime = time.time()
+        if name.endswith('/'):
+            info.type = tarfile.DIRTYPE
+        tar.addfile(info, StringIO(''))
+    tar.close()
+    return out.getvalue()
+
+
+TARBALL = make_tarball([
+    ('./', 0755),
+    ('./Makefile', 0644),
+    ('./rados/', 0755),
+    ('./rados/test.sh', 0755),
+    ('./rados/helper.py', 0644),
+    ('./direct_io/', 0755),
+    ('./direct_io/direct_io_test', 0755),
+])
+
+
+class FakeProc(object):
+    def __init__(self, data=''):
+        self.stdout = StringIO(data)
+        self.waited = False
+
+    def wait(self):
+        self.waited = True
+
+
+class FakeRemote(object):
+    def __init__(self, name, distro='Ubuntu', release='14.04',
+                 arch='x86_64'):
+        self.name = self.shortname = name
+        self.facts = dict(distro=distro, release=release, arch=arch)
+        self.commands = []
+        self.received = []
+        self.background = []
+        self.fail = ()
+
+    def run(self, args, stdin=None, wait=True, **kwargs):
+        self.commands.append(args)
+        if stdin is not None:
+            self.received.append(stdin)
+        if any(str(arg).endswith(self.fail) for arg in args):
+            raise run.CommandFailedError(args, 1)
+        proc = FakeProc()
+        if not wait:
+            self.background.append(proc)
+        return proc
+
+    def get_tar_stream(self, path):
+        return FakeProc(TARBALL)
+
+
+def builds(remotes):
+    return [r.name for r in remotes
+            if any('archive' in cmd for cmd in r.commands)]
+
+
+def test_list_workunits():
+    assert workunit._list_workunits(TARBALL) == [
+        'direct_io/direct_io_test',
+        'rados/test.sh',
+        ]
+
+
+def test_fetch_once_per_platform():
+    ctx = argparse.Namespace()
+    remotes = [
+        FakeRemote('a'),
+        FakeRemote('b'),
+        FakeRemote('c'),
+        FakeRemote('d', distro='CentOS', release='6.5'),
+        ]
+    result = workunit._fetch_workunits(ctx, 'master', remotes, '/t/w.0')
+    assert sorted(builds(remotes)) == ['a', 'd']
+    assert [len(r.received) for r in remotes] == [0, 1, 1, 0]
+    assert remotes[1].received[0] == TARBALL
+    assert set(result) == set(remotes)
+    assert result[remotes[2]] == ['direct_io/direct_io_test', 'rados/test.sh']
+
+    # a later task at the same refspec reuses the builds
+    for remote in remotes:
+        remote.commands = []
+    workunit._fetch_workunits(ctx, 'master', remotes, '/t/w.1')
+    assert builds(remotes) == []
+    assert [len(r.received) for r in remotes] == [1, 2, 2, 1]
+
+    workunit._fetch_workunits(ctx, 'v0.80', remotes[:1], '/t/w.2')
+    assert builds(remotes) == ['a']
+
+
+class TestRunTests(object):
+    def setup(self):
+        self.remote = FakeRemote('a')
+        self.ctx = argparse.Namespace(
+            teuthology_config=dict(test_path='/t'),
+            cluster=cluster.Cluster([(self.remote, ['client.0'])]),
+            summary={},
+            )
+        self.workunits = {self.remote: ['direct_io/direct_io_test',
+                                        'rados/test.sh']}
+
+    def run_tests(self, tests, **kwargs):
+        workunit._run_tests(self.ctx, 'master', 'client.0', tests, None,
+                            '/t/w.0', self.workunits, **kwargs)
+
+    def test_durations(self):
+        self.remote.fail = ('rados/test.sh',)
+        with pytest.raises(run.CommandFailedError):
+            self.run_tests(['direct_io', 'rados'])
+        summary = self.ctx.summary['workunits']
+        assert [(w['client'], w['workunit'], w['success'])
+                for w in summary] == [
+            ('client.0', 'direct_io/direct_io_test', True),
+            ('client.0', 'rados/test.sh', False),
+            ]
+        assert all(w['duration'] >= 0 for w in summary)
+
+    def test_pipeline_cleans_up_in_background(self):
+        self.run_tests(['direct_io', 'rados'], pipeline=True)
+        scratch = '/t/mnt.0/client.0/tmp'
+        removed = [cmd[-1] for cmd in self.remote.commands
+                   if cmd[:3] == ['sudo', 'rm', '-rf']]
+        assert removed == [scratch + '.0', scratch + '.1']
+        assert len(self.remote.background) == 2
+        assert all(proc.waited for proc in self.remote.background)
+
+    def test_no_pipeline(self):
+        self.run_tests(['direct_io', 'rados'])
+        scratch = '/t/mnt.0/client.0/tmp'
+        removed = [cmd[-1] for cmd in self.remote.commands
+                   if cmd[:3] == ['sudo', 'rm', '-rf']]
+        assert removed == [scratch, scratch]
+        assert self.remote.background == []
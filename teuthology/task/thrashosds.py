@@ -3,6 +3,9 @@ Thrash -- Simulate random osd failures.
 """
 import contextlib
 import logging
+import os
+import time
+import yaml
 import ceph_manager
 from teuthology import misc as teuthology
 
@@ -94,6 +97,28 @@ def task(ctx, config):
     chance_test_map_discontinuity: (0) chance to test map discontinuity
     map_discontinuity_sleep_time: (40) time to wait for map trims
 
+    pg_snapshot_ttl: (2) number of seconds to reuse a pg state snapshot
+       before querying the monitors again
+    pg_snapshot_source: (dump) how to count pg states: 'dump' for a full
+       pg dump, or the cheaper 'brief' (pg dump pgs_brief) or 'stat'
+       (pg stat)
+    pg_poll_min: (1) shortest interval, in seconds, between polls while
+       waiting for clean or recovered; used while pg states are changing
+    pg_poll_max: (5) longest interval between such polls, backed off to
+       while nothing changes
+    event_stream: (false) follow the cluster log (ceph -w) and daemon exits,
+       waking waiters as soon as osd or pg states change rather than
+       polling the monitors every few seconds
+
+    action_concurrency: (1) number of actions to have in flight at once.
+       Above 1, actions that only touch one osd (kill, revive, in, out,
+       reweight, primary affinity) run in the background on osds whose
+       hosts have nothing else in flight; other actions wait for those to
+       finish and run alone.
+
+    Per-action latency histograms and the time taken to recover after
+    each run of actions are written to thrasher.yaml in the archive.
+
     example:
 
     tasks:
@@ -175,5 +200,19 @@ def task(ctx, config):
         yield
     finally:
         log.info('joining thrashosds')
-        thrash_proc.do_join()
-        manager.wait_for_recovery(config.get('timeout', 360))
+        try:
+            thrash_proc.do_join()
+            start = time.time()
+            manager.wait_for_recovery(config.get('timeout', 360))
+            thrash_proc.stats.record_recovery(time.time() - start)
+        finally:
+            manager.stop_events()
+        stats = thrash_proc.stats.as_dict()
+        ctx.summary['thrasher'] = dict(
+            actions_per_hour=stats['actions_per_hour'],
+            recovery_mean=stats.get('recovery_mean'),
+            recovery_max=stats.get('recovery_max'),
+            )
+        if ctx.archive is not None:
+            with file(os.path.join(ctx.archive, 'thrasher.yaml'), 'w') as f:
+                yaml.safe_dump(stats, f, default_flow_style=False)
@@ -1,9 +1,13 @@
 """
 Workunit task -- Run ceph on sets of specific clients
 """
+import itertools
 import logging
 import pipes
 import os
+import tarfile
+import time
+from cStringIO import StringIO
 
 from teuthology import misc as teuthology
 from teuthology.parallel import parallel
@@ -11,6 +15,9 @@ from ..orchestra import run
 
 log = logging.getLogger(__name__)
 
+# distinguishes the source dirs of workunit tasks running at the same time
+_task_ids = itertools.count()
+
 
 def task(ctx, config):
     """
@@ -55,6 +62,27 @@ def task(ctx, config):
               BAZ: quux
             timeout: 3h
 
+    An "all" section normally runs each workunit on every client before
+    any client starts the next one. With pipeline, each client instead
+    works through the list at its own pace, and a unit's scratch dir is
+    removed in the background while the next unit runs. Only use it when
+    the workunits do not depend on running in step across clients:
+
+        tasks:
+        - ceph:
+        - ceph-fuse:
+        - workunit:
+            clients:
+              all: [suites/fsstress.sh, suites/pjd.sh]
+            pipeline: true
+
+    The time each workunit took on each client is recorded in the job
+    summary under "workunits".
+
+    The workunits are fetched and built once per distro and arch among the
+    clients, and copied from there to the other clients. Builds are reused
+    by later workunit tasks in the same job at the same ref.
+
     :param ctx: Context
     :param config: Configuration
     """
@@ -92,19 +120,38 @@ def task(ctx, config):
         created_mnt_dir = _make_scratch_dir(ctx, role, config.get('subdir'))
         created_dir_dict[role] = created_mnt_dir
 
-    all_spec = False #is there an all grouping?
-    with parallel() as p:
-        for role, tests in clients.iteritems():
-            if role != "all":
-                p.spawn(_run_tests, ctx, refspec, role, tests,
-                        config.get('env'), timeout=timeout)
-            else:
-                all_spec = True
-
-    if all_spec:
-        all_tasks = clients["all"]
-        _spawn_on_all_clients(ctx, refspec, all_tasks, config.get('env'),
-                              config.get('subdir'), timeout=timeout)
+    if 'all' in clients:
+        roles = ['client.{id}'.format(id=id_) for id_ in
+                 teuthology.all_roles_of_type(ctx.cluster, 'client')]
+    else:
+        roles = clients.keys()
+    remotes = ctx.cluster.only(lambda role: role in roles)
+    srcdir = '{tdir}/workunit.{id}'.format(
+        tdir=teuthology.get_testdir(ctx), id=next(_task_ids))
+    try:
+        workunits = _fetch_workunits(ctx, refspec, remotes.remotes.keys(),
+                                     srcdir)
+
+        all_spec = False #is there an all grouping?
+        with parallel() as p:
+            for role, tests in clients.iteritems():
+                if role != "all":
+                    p.spawn(_run_tests, ctx, refspec, role, tests,
+                            config.get('env'), srcdir, workunits,
+                            timeout=timeout,
+                            pipeline=config.get('pipeline', False))
+                else:
+                    all_spec = True
+
+        if all_spec:
+            all_tasks = clients["all"]
+            _spawn_on_all_clients(ctx, refspec, all_tasks, config.get('env'),
+                                  srcdir, workunits, config.get('subdir'),
+                                  timeout=timeout,
+                                  pipeline=config.get('pipeline', False))
+    finally:
+        log.info('Removing workunits from %s...', srcdir)
+        remotes.fanout(args=['rm', '-rf', '--', srcdir], fail_fast=False)
 
     for role in clients.iterkeys():
         assert isinstance(role, basestring)
@@ -230,10 +277,115 @@ def _make_scratch_dir(ctx, role, subdir):
     return retVal
 
 
-def _spawn_on_all_clients(ctx, refspec, tests, env, subdir, timeout=None):
+def _build_workunits(remote, refspec, srcdir):
+    """
+    Extract the workunits at refspec from git into srcdir on remote, and
+    build them.
+
+    :returns: the built tree, as a gzipped tarball
+    """
+    remote.run(
+        logger=log.getChild(remote.shortname),
+        args=[
+            'rm', '-rf', '--', srcdir,
+            run.Raw('&&'),
+            'mkdir', '--', srcdir,
+            run.Raw('&&'),
+            'git',
+            'archive',
+            '--remote=git://ceph.newdream.net/git/ceph.git',
+            '%s:qa/workunits' % refspec,
+            run.Raw('|'),
+            'tar',
+            '-C', srcdir,
+            '-x',
+            '-f-',
+            run.Raw('&&'),
+            'cd', '--', srcdir,
+            run.Raw('&&'),
+            'if', 'test', '-e', 'Makefile', run.Raw(';'), 'then', 'make', run.Raw(';'), 'fi',
+            ],
+        )
+    proc = remote.get_tar_stream(srcdir)
+    tarball = proc.stdout.read()
+    proc.wait()
+    return tarball
+
+
+def _list_workunits(tarball):
+    """
+    :returns: the sorted paths of the executable files in a tarball made by
+              _build_workunits
+    """
+    tar = tarfile.open(mode='r:gz', fileobj=StringIO(tarball))
+    return sorted(os.path.normpath(member.name) for member in tar
+                  if member.isfile() and member.mode & 0111)
+
+
+def _fetch_workunits(ctx, refspec, remotes, srcdir):
+    """
+    Put the built workunits at refspec in srcdir on each of remotes.
+
+    The workunits are fetched from git and built once per distro, release
+    and arch, on one of the remotes running it, and the result is copied to
+    the others. Builds are kept for the rest of the job in
+    ctx.workunit_builds, so later workunit tasks at the same refspec do not
+    fetch or build them again.
+
+    :param remotes: the remotes to put workunits on
+    :returns: a dict mapping each remote to the sorted list of workunits in
+              srcdir
+    """
+    builds = getattr(ctx, 'workunit_builds', None)
+    if builds is None:
+        builds = ctx.workunit_builds = {}
+    platforms = {}
+    for remote in sorted(remotes, key=lambda rem: rem.name):
+        facts = remote.facts
+        key = (refspec, facts['distro'], facts['release'], facts['arch'])
+        platforms.setdefault(key, []).append(remote)
+
+    def _fetch(key, group):
+        remotes = list(group)
+        if key not in builds:
+            builder = remotes.pop(0)
+            log.info('Building workunits for %s on %s...', ', '.join(key[1:]),
+                     builder.shortname)
+            tarball = _build_workunits(builder, refspec, srcdir)
+            builds[key] = (tarball, _list_workunits(tarball))
+        tarball, workunits = builds[key]
+        with parallel() as p:
+            for remote in remotes:
+                p.spawn(
+                    remote.run,
+                    logger=log.getChild(remote.shortname),
+                    args=[
+                        'mkdir', '--', srcdir,
+                        run.Raw('&&'),
+                        'tar', '-C', srcdir, '-x', '-z', '-f-',
+                        ],
+                    stdin=tarball,
+                    )
+        return group, workunits
+
+    result = {}
+    with parallel() as p:
+        for key, group in platforms.iteritems():
+            p.spawn(_fetch, key, group)
+        for group, workunits in p:
+            assert workunits, 'no workunits found at {ref}'.format(ref=refspec)
+            for remote in group:
+                result[remote] = workunits
+    return result
+
+
+def _spawn_on_all_clients(ctx, refspec, tests, env, srcdir, workunits,
+                          subdir, timeout=None, pipeline=False):
     """
     Make a scratch directory for each client in the cluster, and then for each
-    test spawn _run_tests() for each role.
+    test spawn _run_tests() for each role. If pipeline is set, spawn
+    _run_tests() once per role with all the tests instead, so that the
+    clients do not wait for each other between tests.
 
     See run_tests() for parameter documentation.
     """
@@ -244,11 +396,17 @@ def _spawn_on_all_clients(ctx, refspec, tests, env, subdir, timeout=None):
         client_remotes.append((client_remote, 'client.{id}'.format(id=client)))
         _make_scratch_dir(ctx, "client.{id}".format(id=client), subdir)
 
-    for unit in tests:
+    if pipeline:
         with parallel() as p:
             for remote, role in client_remotes:
-                p.spawn(_run_tests, ctx, refspec, role, [unit], env, subdir,
-                        timeout=timeout)
+                p.spawn(_run_tests, ctx, refspec, role, tests, env, srcdir,
+                        workunits, subdir, timeout=timeout, pipeline=True)
+    else:
+        for unit in tests:
+            with parallel() as p:
+                for remote, role in client_remotes:
+                    p.spawn(_run_tests, ctx, refspec, role, [unit], env,
+                            srcdir, workunits, subdir, timeout=timeout)
 
     # cleanup the generated client directories
     client_generator = teuthology.all_roles_of_type(ctx.cluster, 'client')
@@ -256,23 +414,29 @@ def _spawn_on_all_clients(ctx, refspec, tests, env, subdir, timeout=None):
         _delete_dir(ctx, 'client.{id}'.format(id=client))
 
 
-def _run_tests(ctx, refspec, role, tests, env, subdir=None, timeout=None):
+def _run_tests(ctx, refspec, role, tests, env, srcdir, workunits,
+               subdir=None, timeout=None, pipeline=False):
     """
-    Run the individual test. Create a scratch directory and then extract the
-    workunits from git. Make the executables, and then run the tests.
-    Clean up (remove files created) after the tests are finished.
+    Run the individual test. Create a scratch directory and then run the
+    workunits matching each test from srcdir. Clean up (remove files
+    created) after the tests are finished.
 
     :param ctx:     Context
     :param refspec: branch, sha1, or version tag used to identify this
                     build
     :param tests:   specific tests specified.
     :param env:     environment set in yaml file.  Could be None.
+    :param srcdir:  where _fetch_workunits put the workunits
+    :param workunits: the dict of workunits on each remote returned by
+                    _fetch_workunits
     :param subdir:  subdirectory set in yaml file.  Could be None
     :param timeout: If present, use the 'timeout' command on the remote host
                     to limit execution time. Must be specified by a number
                     followed by 's' for seconds, 'm' for minutes, 'h' for
                     hours, or 'd' for days. If '0' or anything that evaluates
                     to False is passed, the 'timeout' command is not used.
+    :param pipeline: If set, move each workunit's scratch dir aside and
+                    remove it in the background while the next one runs.
     """
     testdir = teuthology.get_testdir(ctx)
     assert isinstance(role, basestring)
@@ -286,37 +450,10 @@ def _run_tests(ctx, refspec, role, tests, env, subdir=None, timeout=None):
         scratch_tmp = os.path.join(mnt, 'client.{id}'.format(id=id_), 'tmp')
     else:
         scratch_tmp = os.path.join(mnt, subdir)
-    srcdir = '{tdir}/workunit.{role}'.format(tdir=testdir, role=role)
-
-    remote.run(
-        logger=log.getChild(role),
-        args=[
-            'mkdir', '--', srcdir,
-            run.Raw('&&'),
-            'git',
-            'archive',
-            '--remote=git://ceph.newdream.net/git/ceph.git',
-            '%s:qa/workunits' % refspec,
-            run.Raw('|'),
-            'tar',
-            '-C', srcdir,
-            '-x',
-            '-f-',
-            run.Raw('&&'),
-            'cd', '--', srcdir,
-            run.Raw('&&'),
-            'if', 'test', '-e', 'Makefile', run.Raw(';'), 'then', 'make', run.Raw(';'), 'fi',
-            run.Raw('&&'),
-            'find', '-executable', '-type', 'f', '-printf', r'%P\0'.format(srcdir=srcdir),
-            run.Raw('>{tdir}/workunits.list'.format(tdir=testdir)),
-            ],
-        )
-
-    workunits = sorted(teuthology.get_file(
-                            remote,
-                            '{tdir}/workunits.list'.format(tdir=testdir)).split('\0'))
-    assert workunits
+    workunits = workunits[remote]
 
+    # background removals of old scratch dirs, when pipelining
+    cleanups = []
     try:
         assert isinstance(tests, list)
         for spec in tests:
@@ -327,6 +464,7 @@ def _run_tests(ctx, refspec, role, tests, env, subdir=None, timeout=None):
                 raise RuntimeError('Spec did not match any workunits: {spec!r}'.format(spec=spec))
             for workunit in to_run:
                 log.info('Running workunit %s...', workunit)
+                success = False
                 args = [
                     'mkdir', '-p', '--', scratch_tmp,
                     run.Raw('&&'),
@@ -354,19 +492,51 @@ def _run_tests(ctx, refspec, role, tests, env, subdir=None, timeout=None):
                         workunit=workunit,
                         ),
                     ])
-                remote.run(
-                    logger=log.getChild(role),
-                    args=args,
-                    )
-                remote.run(
-                    logger=log.getChild(role),
-                    args=['sudo', 'rm', '-rf', '--', scratch_tmp],
-                    )
+                start = time.time()
+                try:
+                    remote.run(
+                        logger=log.getChild(role),
+                        args=args,
+                        )
+                    success = True
+                finally:
+                    _record_duration(ctx, role, workunit,
+                                     time.time() - start, success)
+                if pipeline:
+                    trash = '{scratch}.{n}'.format(scratch=scratch_tmp,
+                                                   n=len(cleanups))
+                    # the workunit may have removed it itself
+                    remote.run(
+                        logger=log.getChild(role),
+                        args=[
+                            'if', 'test', '-e', scratch_tmp, run.Raw(';'),
+                            'then', 'sudo', 'mv', '--', scratch_tmp, trash,
+                            run.Raw(';'), 'fi',
+                            ],
+                        )
+                    cleanups.append(remote.run(
+                        logger=log.getChild(role),
+                        args=['sudo', 'rm', '-rf', '--', trash],
+                        wait=False,
+                        ))
+                else:
+                    remote.run(
+                        logger=log.getChild(role),
+                        args=['sudo', 'rm', '-rf', '--', scratch_tmp],
+                        )
     finally:
-        log.info('Stopping %s on %s...', spec, role)
-        remote.run(
-            logger=log.getChild(role),
-            args=[
-                'rm', '-rf', '--', '{tdir}/workunits.list'.format(tdir=testdir), srcdir,
-                ],
-            )
+        run.wait(cleanups)
+
+
+def _record_duration(ctx, role, workunit, duration, success):
+    """
+    Note how long a workunit took on a client in the job summary.
+    """
+    log.info('Workunit %s on %s %s after %.1f seconds', workunit, role,
+             'passed' if success else 'failed', duration)
+    ctx.summary.setdefault('workunits', []).append(dict(
+        client=role,
+        workunit=workunit,
+        duration=round(duration, 1),
+        success=success,
+        ))
@@ -0,0 +1,129 @@
+import argparse
+import os
+import time
+import urllib2
+from cStringIO import StringIO
+
+import gevent
+import pytest
+
+from .. import artifact_cache
+
+# the upstream fixture patches urllib2.urlopen; clients still need the real one
+real_urlopen = urllib2.urlopen
+
+
+class FakeUpstream(object):
+    def __init__(self, files):
+        self.files = files
+        self.fetched = []
+
+    def urlopen(self, url):
+        self.fetched.append(url)
+        # give concurrent requests a chance to pile up
+        gevent.sleep(0.01)
+        if url not in self.files:
+            raise urllib2.HTTPError(url, 404, 'Not Found', None, None)
+        return StringIO(self.files[url])
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = FakeUpstream({
+        'http://gitbuilder/deb/sha1/abc/version': '0.80-1\n',
+        'http://gitbuilder/deb/sha1/abc/ceph.deb': 'x' * 100,
+        'http://gitbuilder/deb/ref/master/version': '0.81-1\n',
+    })
+    monkeypatch.setattr(artifact_cache.urllib2, 'urlopen', upstream.urlopen)
+    return upstream
+
+
+def test_fetch_once(tmpdir, upstream):
+    store = artifact_cache.ArtifactStore(str(tmpdir), max_bytes=1024)
+    greenlets = [gevent.spawn(store.get, 'gitbuilder/deb/sha1/abc/ceph.deb')
+                 for i in range(5)]
+    gevent.joinall(greenlets)
+    paths = set(g.get() for g in greenlets)
+    assert len(paths) == 1
+    assert open(paths.pop()).read() == 'x' * 100
+    assert upstream.fetched == ['http://gitbuilder/deb/sha1/abc/ceph.deb']
+    store.get('gitbuilder/deb/sha1/abc/ceph.deb')
+    assert len(upstream.fetched) == 1
+    assert store.stats['hits'] == 1
+    assert store.stats['misses'] == 1
+
+
+def test_mutable_ttl(tmpdir, upstream):
+    store = artifact_cache.ArtifactStore(str(tmpdir), max_bytes=1024,
+                                         mutable_ttl=60)
+    key = 'gitbuilder/deb/ref/master/version'
+    path = store.get(key)
+    store.get(key)
+    assert len(upstream.fetched) == 1
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    store.get(key)
+    assert len(upstream.fetched) == 2
+
+
+def test_evict_lru(tmpdir, upstream):
+    store = artifact_cache.ArtifactStore(str(tmpdir), max_bytes=105)
+    version = store.get('gitbuilder/deb/sha1/abc/version')
+    old = time.time() - 120
+    os.utime(version, (old, old))
+    deb = store.get('gitbuilder/deb/sha1/abc/ceph.deb')
+    assert os.path.exists(deb)
+    assert not os.path.exists(version)
+
+
+def test_keep_oversized(tmpdir, upstream):
+    store = artifact_cache.ArtifactStore(str(tmpdir), max_bytes=50)
+    deb = store.get('gitbuilder/deb/sha1/abc/ceph.deb')
+    assert os.path.getsize(deb) == 100
+
+
+def test_bad_keys(tmpdir):
+    store = artifact_cache.ArtifactStore(str(tmpdir), max_bytes=1024)
+    with pytest.raises(ValueError):
+        store.path_for('gitbuilder/../../etc/passwd')
+    with pytest.raises(ValueError):
+        store.path_for('')
+
+
+def test_serve(tmpdir, upstream):
+    store = artifact_cache.ArtifactStore(str(tmpdir), max_bytes=1024)
+    cache = artifact_cache.ArtifactCache(store, address='127.0.0.1',
+                                         hosts=['gitbuilder']).start()
+    try:
+        ctx = argparse.Namespace(artifact_cache=cache)
+        url = artifact_cache.cached_url(
+            ctx, 'http://gitbuilder/deb/sha1/abc/version')
+        assert url == '%s/gitbuilder/deb/sha1/abc/version' % cache.url
+        assert real_urlopen(url).read() == '0.80-1\n'
+        with pytest.raises(urllib2.HTTPError) as e:
+            real_urlopen('%s/gitbuilder/missing' % cache.url)
+        assert e.value.code == 404
+        with pytest.raises(urllib2.HTTPError) as e:
+            real_urlopen('%s/example.com/index.html' % cache.url)
+        assert e.value.code == 403
+        assert upstream.fetched == [
+            'http://gitbuilder/deb/sha1/abc/version',
+            'http://gitbuilder/missing',
+            ]
+        assert cache.get_stats()['bytes_served'] == 7
+    finally:
+        cache.stop()
+
+
+def test_cached_url_passthrough():
+    ctx = argparse.Namespace()
+    url = 'http://gitbuilder/deb/sha1/abc/'
+    assert artifact_cache.cached_url(ctx, url) == url
+    ctx.artifact_cache = argparse.Namespace(url='http://cache:1',
+                                            hosts=['gitbuilder'])
+    https = 'https://ceph.com/keys/autobuild.asc'
+    assert artifact_cache.cached_url(ctx, https) == https
+    assert artifact_cache.cached_url(ctx, url) == \
+        'http://cache:1/gitbuilder/deb/sha1/abc/'
+    other = 'http://example.com/foo.tar.gz'
+    assert artifact_cache.cached_url(ctx, other) == other
@@ -0,0 +1,119 @@
+import argparse
+import json
+import logging
+import os
+
+from .. import benchmark
+
+RADOS_BENCH = """\
+ Maintaining 16 concurrent writes of 4194304 bytes for up to 3 seconds or 0 objects
+ Object prefix: benchmark_data_plana01_12345
+   sec Cur ops   started  finished  avg MB/s  cur MB/s  last lat   avg lat
+     0       0         0         0         0         0         -         0
+     1      16        30        14   55.9807        56  0.745812  0.535542
+     2      16        46        30   59.9749        64   1.07083  0.784197
+     3      16        62        46   61.3076        64  0.652841  0.851183
+ Total time run:         3.481483
+Total writes made:      62
+Write size:             4194304
+Bandwidth (MB/sec):     71.232
+
+Stddev Bandwidth:       17.5788
+Max bandwidth (MB/sec): 64
+Min bandwidth (MB/sec): 0
+Average Latency:        0.899282
+Stddev Latency:         0.368837
+Max latency:            2.04327
+Min latency:            0.275154
+""".splitlines()
+
+OMAPBENCH = """\
+========================================================
+Number of object maps written:\t1000
+Number of threads used:\t\t30
+Entries per object map:\t\t10
+Characters per value:\t\t100
+Object name prefix:\t\tplana01.12345
+Characters per key:\t\t10
+
+Average latency:\t\t12.5ms
+Minimum latency:\t\t2ms
+Maximum latency:\t\t48ms
+Mode latency:\t\t\tbetween 10 and 20ms
+Total latency:\t\t\t12500ms
+
+Histogram:
+>= 0ms\t\t[**********
+>= 10ms\t\t[****************************************
+>= 20ms\t\t[*******************
+>= 40ms\t\t[*
+========================================================
+""".splitlines()
+
+
+def test_parse_rados_bench():
+    result = benchmark.parse_rados_bench(RADOS_BENCH)
+    assert result['bandwidth_mbps'] == 71.232
+    assert result['ops'] == 62
+    assert result['op_size'] == 4194304
+    assert result['latency_avg'] == 0.899282
+    assert result['latency_max'] == 2.04327
+    assert abs(result['iops'] - 62 / 3.481483) < 1e-6
+    assert [s['sec'] for s in result['series']] == [0, 1, 2, 3]
+    assert result['series'][0]['last_lat'] is None
+    assert result['series'][2]['cur_mbps'] == 64
+    assert result['last_lat_p50'] == 0.745812
+    assert result['last_lat_p99'] == 1.07083
+
+
+def test_parse_rados_bench_iops():
+    result = benchmark.parse_rados_bench([
+        'Average IOPS:           17',
+        'Average Latency(s):     0.9',
+        ])
+    assert result['iops'] == 17
+    assert result['latency_avg'] == 0.9
+    assert result['last_lat_p50'] is None
+
+
+def test_parse_omapbench():
+    result = benchmark.parse_omapbench(OMAPBENCH)
+    assert result['objects'] == 1000
+    assert result['threads'] == 30
+    assert result['latency_avg_ms'] == 12.5
+    assert result['latency_max_ms'] == 48
+    assert result['histogram'][:2] == [[0, 10], [10, 40]]
+    assert result['latency_p50_ms'] == 10
+    assert result['latency_p99_ms'] == 40
+    assert result['objects_per_sec'] == 2400.0
+
+
+def test_percentile():
+    assert benchmark.percentile([], 50) is None
+    assert benchmark.percentile([3, 1, 2], 50) == 2
+    assert benchmark.percentile(range(1, 101), 99) == 99
+    assert benchmark.percentile([5], 0) == 5
+
+
+def test_output_capture():
+    capture = benchmark.OutputCapture(logging.getLogger('test'))
+    capture.log(logging.INFO, 'a line')
+    assert capture.lines == ['a line']
+
+
+def test_record(tmpdir):
+    ctx = argparse.Namespace(archive=str(tmpdir), summary={})
+    results = benchmark.parse_rados_bench(RADOS_BENCH)
+    benchmark.record(ctx, 'radosbench', 'client.0', results, pool='data')
+    benchmark.record(ctx, 'omapbench', 'client.1',
+                     benchmark.parse_omapbench(OMAPBENCH))
+    summary = ctx.summary['benchmarks']
+    assert [s['benchmark'] for s in summary] == ['radosbench', 'omapbench']
+    assert summary[0]['pool'] == 'data'
+    assert summary[0]['bandwidth_mbps'] == 71.232
+    assert 'series' not in summary[0]
+    with open(os.path.join(str(tmpdir), 'benchmarks.json')) as f:
+        saved = json.load(f)
+    assert len(saved) == 2
+    assert len(saved[0]['series']) == 4
+    assert saved[1]['client'] == 'client.1'
@@ -0,0 +1,29 @@
+from .. import ls
+
+
+class TestTailLine(object):
+    def write(self, tmpdir, data):
+        path = tmpdir.join('teuthology.log')
+        path.write(data)
+        return str(path)
+
+    def test_last_line(self, tmpdir):
+        path = self.write(tmpdir, 'one\ntwo\nthree\n')
+        assert ls.tail_line(path) == 'three\n'
+
+    def test_no_trailing_newline(self, tmpdir):
+        path = self.write(tmpdir, 'one\ntwo')
+        assert ls.tail_line(path) == 'two'
+
+    def test_single_line(self, tmpdir):
+        path = self.write(tmpdir, 'only\n')
+        assert ls.tail_line(path) == 'only\n'
+
+    def test_empty(self, tmpdir):
+        path = self.write(tmpdir, '')
+        assert ls.tail_line(path) == ''
+
+    def test_spans_blocks(self, tmpdir):
+        long_line = 'x' * 100
+        path = self.write(tmpdir, 'first\n' + long_line + '\n')
+        assert ls.tail_line(path, blocksize=7) == long_line + '\n'
@@ -1,4 +1,5 @@
 import argparse
+import subprocess
 from ..orchestra import cluster
 from .. import misc
 from ..config import config
@@ -50,3 +51,194 @@ def test_get_http_log_path():
 
     path = misc.get_http_log_path(archive_dir)
     assert path == "http://qa-proxy.ceph.com/teuthology/teuthology-2013-09-12_11:49:50-ceph-deploy-master-testing-basic-vps/"
+
+
+class FakeTarProcess(object):
+    def __init__(self, files):
+        from cStringIO import StringIO
+        import tarfile
+        buf = StringIO()
+        tar = tarfile.open(mode='w:gz', fileobj=buf)
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, StringIO(data))
+        tar.close()
+        buf.seek(0)
+        self.stdout = buf
+        self.waited = False
+
+    def wait(self):
+        self.waited = True
+
+
+def test_pull_directory(tmpdir):
+    proc = FakeTarProcess({
+        './ceph.log': 'log data',
+        './sub/osd.0.log': 'osd data',
+        '../escape': 'evil',
+        })
+    remote = FakeRemote()
+    remote.shortname = 'fake'
+    remote.get_tar_stream = lambda path, **kwargs: proc
+    localdir = str(tmpdir.join('remote'))
+    stats = misc.pull_directory(remote, '/remote/dir', localdir)
+    assert proc.waited
+    assert stats['files'] == 3
+    assert stats['bytes'] == len(proc.stdout.getvalue())
+    assert tmpdir.join('remote', 'ceph.log').read() == 'log data'
+    assert tmpdir.join('remote', 'sub', 'osd.0.log').read() == 'osd data'
+    assert tmpdir.join('remote', '_.', 'escape').read() == 'evil'
+
+
+def test_throttle():
+    slept = []
+    throttle = misc.Throttle(1000, _sleeper=slept.append)
+    throttle.consume(500)
+    throttle.consume(500)
+    assert len(slept) == 2
+    # the second chunk has to wait for the first one's share too
+    assert 0.4 < slept[0] <= 0.5
+    assert 0.9 < slept[1] <= 1.0
+
+
+def test_pull_directory_throttled(tmpdir):
+    proc = FakeTarProcess({'./ceph.log': 'log data'})
+    remote = FakeRemote()
+    remote.shortname = 'fake'
+    remote.get_tar_stream = lambda path, **kwargs: proc
+    slept = []
+    throttle = misc.Throttle(1, _sleeper=slept.append)
+    stats = misc.pull_directory(remote, '/remote/dir',
+                                str(tmpdir.join('remote')),
+                                throttles=[throttle, None])
+    assert stats['bytes'] > 0
+    assert slept
+
+
+def test_pull_directory_dedupe(tmpdir):
+    seen = {}
+    for name in ('host1', 'host2'):
+        proc = FakeTarProcess({
+            './ceph.conf': 'same everywhere',
+            './osd.log': 'from ' + name,
+            })
+        remote = FakeRemote()
+        remote.shortname = name
+        remote.get_tar_stream = lambda path, **kwargs: proc
+        stats = misc.pull_directory(remote, '/remote/dir',
+                                    str(tmpdir.join(name)), dedupe=seen)
+    assert stats['files'] == 2
+    assert stats['deduped'] == 1
+    conf1 = tmpdir.join('host1', 'ceph.conf')
+    conf2 = tmpdir.join('host2', 'ceph.conf')
+    assert conf2.read() == 'same everywhere'
+    assert conf1.stat().ino == conf2.stat().ino
+    assert tmpdir.join('host2', 'osd.log').read() == 'from host2'
+
+
+def test_choose_tar_codec_unknown():
+    with pytest.raises(ValueError):
+        misc.choose_tar_codec(FakeRemote(), 'rot13')
+
+
+def test_choose_tar_codec_gzip():
+    assert misc.choose_tar_codec(FakeRemote(), 'gzip') == 'gzip'
+
+
+def test_get_scratch_devices():
+    remote = FakeRemote()
+    batches = []
+
+    def batch(commands, **kwargs):
+        batches.append(commands)
+        # sdc is mounted
+        return [argparse.Namespace(exitstatus=0),
+                argparse.Namespace(exitstatus=1),
+                argparse.Namespace(exitstatus=0)]
+    remote.batch = batch
+    remote.facts = dict(scratch_devs=['/dev/sdb', '/dev/sdc', '/dev/sdd'])
+    devs = misc.get_scratch_devices(remote)
+    assert devs == ['/dev/sdb', '/dev/sdd']
+    assert len(batches) == 1
+    assert len(batches[0]) == 3
+
+
+def test_gather_facts():
+    remote = FakeRemote()
+    remote.shortname = 'fake'
+    calls = []
+
+    def run(args, stdout):
+        calls.append(args)
+        stdout.write('\n'.join([
+            'arch=x86_64',
+            'kernel=3.13.0-24-generic',
+            'distro=Ubuntu',
+            'release=14.04',
+            'codename=trusty',
+            'cpus=8',
+            'mem_kb=16318084',
+            'scratch_devs=/dev/sdb /dev/sdc',
+        ]) + '\n')
+        return argparse.Namespace(stdout=stdout)
+    remote.run = run
+    facts = misc.gather_facts(remote)
+    assert len(calls) == 1
+    assert facts['arch'] == 'x86_64'
+    assert facts['codename'] == 'trusty'
+    assert facts['cpus'] == 8
+    assert facts['package_type'] == 'deb'
+    assert facts['scratch_devs'] == ['/dev/sdb', '/dev/sdc']
+    remote.facts = facts
+    assert misc.get_system_type(remote) == 'deb'
+    assert misc.get_system_type(remote, distro=True) == 'ubuntu'
+    assert misc.get_system_type(remote, distro=True, version=True) == \
+        ('ubuntu', '14.04')
+
+
+def test_get_files():
+    remote = FakeRemote()
+    calls = []
+
+    def batch(commands, **kwargs):
+        calls.append((commands, kwargs))
+        return [argparse.Namespace(stdout='key for ' + c[-1])
+                for c in commands]
+    remote.batch = batch
+    got = misc.get_files(remote, ['/a/keyring', '/b/keyring'], sudo=True)
+    assert got == ['key for /a/keyring', 'key for /b/keyring']
+    (commands, kwargs), = calls
+    assert commands[0] == ['sudo', 'cat', '--', '/a/keyring']
+    assert kwargs['log_output'] is False
+
+
+def test_scan_logs(tmpdir):
+    tmpdir.join('ceph.log').write('\n'.join([
+        'osd.0 [INF] boot',
+        'osd.1 [WRN] slow request 30 seconds old',
+        'osd.2 [ERR] 1.2 scrub 1 errors',
+        'mon.a [WRN] wrongly marked me down',
+        'osd.3 [ERR] 1.5 missing primary copy',
+        '',
+        ]))
+    patterns = [r'\[SEC\]', r'\[ERR\]', r'\[WRN\]']
+    args = misc.log_scan_command([str(tmpdir.join('*.log'))], patterns,
+                                 excludes=['wrongly marked me down'])
+    out = subprocess.check_output(args)
+    scan = misc.LogScan(patterns, out)
+    assert scan
+    assert scan.counts == {r'\[SEC\]': 0, r'\[ERR\]': 2, r'\[WRN\]': 1}
+    assert scan.first_hit[1] == 'osd.1 [WRN] slow request 30 seconds old'
+    pattern, path, line = scan.most_severe()
+    assert pattern == r'\[ERR\]'
+    assert path == str(tmpdir.join('ceph.log'))
+    assert line == 'osd.2 [ERR] 1.2 scrub 1 errors'
+
+
+def test_scan_logs_nothing_found(tmpdir):
+    patterns = [r'\bBUG\b']
+    args = misc.log_scan_command([str(tmpdir.join('*.log'))], patterns)
+    scan = misc.LogScan(patterns, subprocess.check_output(args))
+    assert not scan
+    assert scan.most_severe() is None
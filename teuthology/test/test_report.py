@@ -1,3 +1,8 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
 import yaml
 import json
 import fake_archive
@@ -9,10 +14,14 @@ class TestSerializer(object):
         self.archive = fake_archive.FakeArchive()
         self.archive.setup()
         self.archive_base = self.archive.archive_base
+        self.index_dir = tempfile.mkdtemp()
+        report.config.report_index_dir = self.index_dir
         self.reporter = report.ResultsReporter(archive_base=self.archive_base)
 
     def teardown(self):
         self.archive.teardown()
+        del report.config.report_index_dir
+        shutil.rmtree(self.index_dir)
 
     def test_all_runs_one_run(self):
         run_name = "test_all_runs"
@@ -74,4 +83,143 @@ class TestSerializer(object):
         out_obj = json.loads(out_json)
         assert full_obj == out_obj
 
+    def age_archive(self, seconds=60):
+        then = time.time() - seconds
+        for dirpath, dirnames, filenames in os.walk(self.archive_base):
+            for name in dirnames + filenames:
+                os.utime(os.path.join(dirpath, name), (then, then))
+            os.utime(dirpath, (then, then))
 
+    def test_job_info_cached(self):
+        run_name = "test_job_info_cached"
+        yaml_path = "examples/3node_ceph.yaml"
+        jobs = self.archive.create_fake_run(run_name, 1, yaml_path)
+        job_id = str(jobs[0]['job_id'])
+        self.age_archive()
+        serializer = self.reporter.serializer
+        first = serializer.job_info(run_name, job_id)
+
+        def no_parsing(*args, **kwargs):
+            raise AssertionError("job info was parsed again")
+        orig_load = yaml.load
+        yaml.load = no_parsing
+        try:
+            assert serializer.job_info(run_name, job_id) == first
+            # a fresh serializer reuses the on-disk index
+            serializer = report.ResultsSerializer(self.archive_base)
+            assert serializer.job_info(run_name, job_id) == first
+        finally:
+            yaml.load = orig_load
+
+    def test_job_info_invalidated(self):
+        run_name = "test_job_info_invalidated"
+        yaml_path = "examples/3node_ceph.yaml"
+        jobs = self.archive.create_fake_run(run_name, 1, yaml_path)
+        job_id = str(jobs[0]['job_id'])
+        self.age_archive()
+        serializer = self.reporter.serializer
+        assert 'extra' not in serializer.job_info(run_name, job_id)
+        summary_path = os.path.join(self.archive_base, run_name, job_id,
+                                    'summary.yaml')
+        with file(summary_path, 'a') as f:
+            f.write('extra: value\n')
+        assert serializer.job_info(run_name, job_id)['extra'] == 'value'
+
+    def test_index_outside_archive(self):
+        run_name = "test_index_outside_archive"
+        yaml_path = "examples/3node_ceph.yaml"
+        jobs = self.archive.create_fake_run(run_name, 1, yaml_path)
+        self.age_archive()
+        mtime = os.path.getmtime(self.archive_base)
+        serializer = self.reporter.serializer
+        assert serializer.all_runs == [run_name]
+        serializer.job_info(run_name, str(jobs[0]['job_id']))
+        assert os.path.getmtime(self.archive_base) == mtime
+        assert serializer.index.path.startswith(self.index_dir)
+
+    def test_locked_index(self):
+        run_name = "test_locked_index"
+        yaml_path = "examples/3node_ceph.yaml"
+        jobs = self.archive.create_fake_run(run_name, 1, yaml_path)
+        job_id = str(jobs[0]['job_id'])
+        self.age_archive()
+        index = self.reporter.serializer.index
+        other = sqlite3.connect(index.path, isolation_level=None)
+        other.execute('BEGIN EXCLUSIVE')
+        try:
+            index.put_job(run_name, job_id, [1], dict(a=1))
+            assert index.get_job(run_name, job_id, [1]) is None
+        finally:
+            other.execute('ROLLBACK')
+            other.close()
+        index.put_job(run_name, job_id, [1], dict(a=1))
+        assert index.get_job(run_name, job_id, [1]) == dict(a=1)
+
+    def test_jobs_for_run_new_job(self):
+        run_name = "test_jobs_for_run_new_job"
+        yaml_path = "examples/3node_ceph.yaml"
+        self.archive.create_fake_run(run_name, 2, yaml_path)
+        self.age_archive()
+        serializer = self.reporter.serializer
+        assert len(serializer.jobs_for_run(run_name)) == 2
+        os.mkdir(os.path.join(self.archive_base, run_name, '100001'))
+        assert len(serializer.jobs_for_run(run_name)) == 3
+
+
+class TestReporter(object):
+    def test_report_jobs_concurrent(self):
+        reporter = report.ResultsReporter(archive_base='/nonexistent',
+                                          base_uri='http://example.com/',
+                                          concurrency=4)
+        reported = []
+        failures = {'3': 1}
+
+        def report_job(run_name, job_id, dead=False):
+            if failures.get(job_id):
+                failures[job_id] -= 1
+                raise report.requests.exceptions.ConnectionError('flaky')
+            reported.append((run_name, job_id, dead))
+            return job_id
+        report_job.__name__ = 'report_job'
+        reporter.report_job = report_job
+        job_ids = [str(i) for i in range(10)]
+        orig_sleep = time.sleep
+        time.sleep = lambda s: None
+        try:
+            reporter.report_jobs('run', job_ids, dead=True)
+        finally:
+            time.sleep = orig_sleep
+        assert sorted(r[1] for r in reported) == sorted(job_ids)
+        assert all(r[0] == 'run' and r[2] for r in reported)
+
+    def test_report_jobs_gives_up_per_job(self):
+        reporter = report.ResultsReporter(archive_base='/nonexistent',
+                                          base_uri='http://example.com/',
+                                          concurrency=4, retries=2)
+        reported = []
+
+        def report_job(run_name, job_id, dead=False):
+            if job_id == '3':
+                raise report.requests.exceptions.ConnectionError('down')
+            reported.append(job_id)
+            return job_id
+        report_job.__name__ = 'report_job'
+        reporter.report_job = report_job
+        job_ids = [str(i) for i in range(10)]
+        orig_sleep = time.sleep
+        time.sleep = lambda s: None
+        try:
+            reporter.report_jobs('run', job_ids)
+        finally:
+            time.sleep = orig_sleep
+        assert sorted(reported) == sorted(set(job_ids) - set(['3']))
+        assert reporter.failed_jobs == 1
+
+    def test_delete_jobs(self):
+        reporter = report.ResultsReporter(archive_base='/nonexistent',
+                                          base_uri='http://example.com/')
+        deleted = []
+        reporter.delete_job = lambda run_name, job_id: deleted.append(
+            (run_name, job_id))
+        reporter.delete_jobs('run', ['1', '2'])
+        assert deleted == [('run', '1'), ('run', '2')]
@@ -0,0 +1,34 @@
+import gevent
+
+from .. import watcher
+
+
+class TestArchiveWatcher(object):
+    def test_wait_times_out(self, tmpdir):
+        with watcher.ArchiveWatcher([str(tmpdir)], poll_interval=0.01) as w:
+            assert w.wait(timeout=0.01) is False
+
+    def test_wait_sees_new_file(self, tmpdir):
+        with watcher.ArchiveWatcher([str(tmpdir)]) as w:
+            if not w.using_inotify:
+                return
+            gevent.spawn_later(0.05, tmpdir.join('summary.yaml').write, 'x')
+            assert w.wait(timeout=5) is True
+
+    def test_polling_fallback(self, tmpdir):
+        w = watcher.ArchiveWatcher([str(tmpdir)], poll_interval=0.01,
+                                   use_inotify=False)
+        assert not w.using_inotify
+        assert w.wait(timeout=5) is False
+        w.close()
+
+    def test_add(self, tmpdir):
+        with watcher.ArchiveWatcher() as w:
+            assert w.add(str(tmpdir)) is True
+            assert w.add(str(tmpdir)) is False
+            missing = str(tmpdir.join('missing'))
+            if w.using_inotify:
+                # not watched until it exists
+                assert w.add(missing) is False
+                tmpdir.join('missing').mkdir()
+            assert w.add(missing) is True
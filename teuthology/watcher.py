@@ -0,0 +1,113 @@
+"""
+Wait for changes in the archive without repeatedly rescanning it.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import time
+
+log = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _inotify_init = _libc.inotify_init
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                   ctypes.c_uint32]
+except (OSError, AttributeError):
+    _inotify_init = None
+
+
+class ArchiveWatcher(object):
+    """
+    Block until something is created in (or written to) any of a set of
+    directories.
+
+    Uses inotify where available; elsewhere, wait() simply sleeps for up to
+    poll_interval seconds, so callers must recheck whatever they are waiting
+    for after each wait() either way::
+
+        with ArchiveWatcher([run_dir]) as watcher:
+            while not finished():
+                watcher.wait(timeout=60)
+    """
+    mask = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE
+
+    def __init__(self, paths=(), poll_interval=10, use_inotify=True):
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.watched = set()
+        if use_inotify and _inotify_init is not None:
+            fd = _inotify_init()
+            if fd < 0:
+                log.debug('inotify_init failed: %s',
+                          os.strerror(ctypes.get_errno()))
+            else:
+                self.fd = fd
+        for path in paths:
+            self.add(path)
+
+    @property
+    def using_inotify(self):
+        return self.fd is not None
+
+    def add(self, path):
+        """
+        Start watching the directory at path. Paths already being watched
+        are ignored.
+
+        :returns: True if path was not being watched before and now is
+        """
+        if path in self.watched:
+            return False
+        if self.fd is None:
+            self.watched.add(path)
+            return True
+        wd = _inotify_add_watch(self.fd, path, self.mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err != errno.ENOENT:
+                log.debug('Not watching %s: %s', path, os.strerror(err))
+            # try again next time; it may not have been created yet
+            return False
+        self.watched.add(path)
+        return True
+
+    def wait(self, timeout=None):
+        """
+        Wait until a watched directory changes or timeout seconds pass.
+
+        :returns: True if a change was seen, False if it timed out or
+                  inotify is not available.
+        """
+        if timeout is None:
+            timeout = self.poll_interval
+        if self.fd is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return False
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # we only care that something happened; discard the events
+        os.read(self.fd, 65536)
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False